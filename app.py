@@ -5,8 +5,10 @@
 import streamlit as st
 import pandas as pd
 from typing import List, Optional, Dict
-import requests  # Thêm thư viện để gọi API
 import json      # Thêm thư viện để xử lý JSON
+import time
+import functools
+from datetime import timedelta
 
 # ---- Plotly import guard ----
 try:
@@ -14,8 +16,18 @@ try:
 except Exception:
     px = None
 
-from util.db import run_sql
-from util.filters import sidebar_filters
+from util import local_engine
+from util.db import (bind_params, data_versions, engine_config, fingerprint_lookup, fingerprint_stats,
+                     get_ai_cache, get_result_cache, mark_miss, query_stats, record_fingerprint, run_sql,
+                     run_sql_many, sql_fingerprint, table_version)
+from util.export import FORMATS as EXPORT_FORMATS, export_file
+from util.filters import (build_where as _build_where, filter_params, in_param_sql as _in_param_sql,
+                          keyword_sql as _keyword_sql, sidebar_filters)
+from util.prompt_context import compile_context
+from util.result_cache import canonical_sql
+from util.gemini import (DEFAULT_BASE_URL as GEMINI_BASE_URL, DEFAULT_MODEL as GEMINI_MODEL, GeminiError,
+                         GeminiStream, cache_key as ai_cache_key)
+from util.subset_cache import PARAM_DIMS, SubsetCache, filter_spec, filtered_dims
 
 # ---- Cấu hình trang (Page Config) ----
 st.set_page_config(
@@ -23,33 +35,78 @@ st.set_page_config(
     page_icon="💡",  # Icon mới
     layout="wide"
 )
+RUN_T0, RUN_STATS0 = time.perf_counter(), query_stats()  # đo query / thời gian của lượt chạy này
 st.title("💡 TikTok Creator Studio")
 st.caption("Dashboard 10 Chức năng hỗ trợ Ra Quyết định Sáng tạo & Quảng bá")
 
-# ---------------- Helpers ----------------
-def _sql_quote(val: str) -> str:
-    if val is None:
-        return "NULL"
-    return "'" + str(val).replace("'", "''") + "'"
-
-def _in_list_sql(values: List[str]) -> str:
-    return ",".join(_sql_quote(v) for v in values)
+# ------------- Engine -------------
+# "warehouse": mọi query chạy trên Databricks SQL.
+# "local": snapshot silver/gold theo version Delta + DuckDB trong process (đổi filter ~ ms).
+ENGINE = "warehouse"
+if local_engine.available():
+    if st.sidebar.toggle(
+        "⚡ Local engine (DuckDB)",
+        value=engine_config().get("mode") == "local",
+        help="Chạy query trên snapshot Parquet cục bộ thay vì SQL warehouse.",
+    ):
+        ENGINE = "local"
 
-def _date_expr(col: str) -> str:
-    return f"DATE({col})"
-
-@st.cache_data(ttl=600)  # Giữ cache 10 phút
-def run_sql_safe(sql: str) -> pd.DataFrame:
+# ---------------- Helpers ----------------
+def run_sql_safe(sql: str, params: Optional[dict] = None) -> pd.DataFrame:
+    # Chỉ giữ tham số mà query dùng -> cache key không phụ thuộc filter không liên quan
+    # Key gồm version Delta của các bảng query đọc -> giữ tới khi pipeline ghi dữ liệu mới
+    # Key là fingerprint của SQL dạng chuẩn -> khác khoảng trắng / comment / hoa-thường vẫn trúng cache
+    # Lỗi (timeout, mất kết nối, ...) bắt ở đây, ngoài hàm có cache -> không bị nhớ tới version dữ liệu sau
+    params = bind_params(sql, params)
+    key = sql_fingerprint(sql, params, ENGINE, data_versions(sql))
     try:
-        return run_sql(sql)
+        return fingerprint_lookup(key, sql, _run_sql_safe, key, sql, params)
     except Exception as e:
         st.warning(f"SQL error: {e}")
         return pd.DataFrame()
 
+@st.cache_data(max_entries=1024)
+def _run_sql_safe(key: str, _sql: str, _params: dict) -> pd.DataFrame:
+    mark_miss()
+    return run_sql(_sql, _params, engine=ENGINE)
+
+def run_sql_many_safe(queries: Dict[str, object], timeout: Optional[float] = None,
+                      subset_cols: Optional[Dict[str, dict]] = None) -> Dict[str, pd.DataFrame]:
+    """
+    Chạy song song các query độc lập ({tên: sql} hoặc {tên: (sql, params)});
+    query lỗi/quá hạn -> cảnh báo + DataFrame rỗng.
+    subset_cols: {tên: cột filter} cho query dùng subset cache (xem run_sql_subset).
+    """
+    subset_cols = subset_cols or {}
+    out: Dict[str, pd.DataFrame] = {}
+    for name, cols in subset_cols.items():
+        sql, params = queries[name]
+        hit = _subset_lookup(sql, params, cols)
+        if hit is not None:
+            out[name] = hit
+    todo = {name: q for name, q in queries.items() if name not in out}
+    results, errors = run_sql_many(todo, timeout=timeout, engine=ENGINE)
+    for name, e in errors.items():
+        st.warning(f"SQL error ({name}): {e}")
+    for name in todo:
+        out[name] = results.get(name, pd.DataFrame())
+        if name in subset_cols and name not in errors:
+            sql, params = queries[name]
+            _subset_store(sql, params, subset_cols[name], out[name])
+    return {name: out[name] for name in queries}
+
 def dedup_cols(df: pd.DataFrame) -> pd.DataFrame:
     if df is None or df.empty: return df
     return df.loc[:, ~pd.Index(df.columns).duplicated()]
 
+# Giá trị lấy từ DataFrame của run_sql: NULL là pd.NA / NaT -> `x or 0`, `if x:` sẽ lỗi, dùng 2 helper này
+def as_int(value, default: int = 0) -> int:
+    return default if value is None or pd.isna(value) else int(value)
+
+def as_date(value):
+    """Ngày (datetime.date) từ Timestamp / date / chuỗi; NULL -> None."""
+    return None if value is None or pd.isna(value) else pd.Timestamp(value).date()
+
 def uniquify_columns(df: pd.DataFrame) -> pd.DataFrame:
     if df is None or df.empty: return df
     seen: Dict[str, int] = {}
@@ -70,15 +127,42 @@ def show_data_expander(df: pd.DataFrame, title: str = "Xem dữ liệu chi tiế
         with st.expander(title):
             st.dataframe(df, use_container_width=True)
 
+def show_data_pages(df: pd.DataFrame, title: str = "Xem dữ liệu chi tiết (bảng)", page_size: int = 500):
+    """Như show_data_expander nhưng chỉ đưa 1 trang (page_size dòng) xuống trình duyệt mỗi lần."""
+    if df.empty:
+        return
+    with st.expander(title):
+        pages = max(1, -(-len(df) // page_size))
+        page = st.number_input(f"Trang (1–{pages})", min_value=1, max_value=pages, value=1, step=1,
+                               key=f"page_{title}") if pages > 1 else 1
+        start = (int(page) - 1) * page_size
+        st.dataframe(df.iloc[start:start + page_size], use_container_width=True)
+        st.caption(f"Dòng {start + 1:,}–{min(start + page_size, len(df)):,} / {len(df):,}")
+
 def plot_stretch(fig):
     st.plotly_chart(fig, use_container_width=True)  # Giữ nguyên để tránh lỗi version
 
-def csv_download(df: pd.DataFrame, filename: str):
-    if not df.empty:
-        st.download_button("⬇️ Tải CSV", df.to_csv(index=False).encode("utf-8"), filename, "text/csv")
+def file_download(df: pd.DataFrame, filename: str):
+    """Tải dữ liệu CSV / Parquet; file chỉ được tạo khi bấm nút (không dựng CSV ở mỗi lần rerun)."""
+    if df.empty:
+        return
+    col_fmt, col_btn = st.columns([1, 3])
+    fmt = col_fmt.radio("Định dạng", list(EXPORT_FORMATS), horizontal=True, key=f"fmt_{filename}",
+                        label_visibility="collapsed")
+    if col_btn.button(f"📦 Tạo file {fmt}", key=f"export_{filename}"):
+        buf, name, mime = export_file(df, filename, fmt)
+        col_btn.download_button(f"⬇️ Tải {name}", buf, name, mime, key=f"dl_{filename}")
+
+def _probe_sql(sql: str) -> pd.DataFrame:
+    """Chạy query dò metadata; lỗi (bảng chưa được notebook dựng, thiếu quyền) -> rỗng, không cảnh báo."""
+    try:
+        return run_sql(sql, engine=ENGINE)
+    except Exception:
+        return pd.DataFrame()
 
 def table_columns(table: str) -> List[str]:
-    df = run_sql_safe(f"SHOW COLUMNS IN {table}")
+    """Cột của bảng; bảng chưa có -> [] (im lặng) để caller dùng đường fallback."""
+    df = _probe_sql(f"SHOW COLUMNS IN {table}")
     cols: List[str] = []
     if not df.empty:
         if 'col_name' in df.columns:
@@ -86,105 +170,293 @@ def table_columns(table: str) -> List[str]:
         else:
             cols = [c for c in df.columns]
     else:
-        ddf = run_sql_safe(f"DESCRIBE TABLE {table}")
+        ddf = _probe_sql(f"DESCRIBE TABLE {table}")
         if not ddf.empty and 'col_name' in ddf.columns:
             cols = [str(x).strip() for x in ddf['col_name'].tolist()
                     if x and not str(x).startswith('#') and str(x).lower() != 'partition']
     return [c for c in cols if c and c.lower() != 'partition']
 
-# ------------- Load meta -------------
-meta = run_sql_safe("SELECT MIN(dt) AS min_d, MAX(dt) AS max_d FROM silver.silver_trend")
-min_d = meta.iloc[0]["min_d"] if not meta.empty else None
-max_d = meta.iloc[0]["max_d"] if not meta.empty else None
+# ------------- Meta snapshot -------------
+# 1 query duy nhất trên silver.silver_trend thay cho MIN/MAX(dt), DISTINCT country/industry
+# và các MAX(DATE(dt)) rải rác ở từng tab; memo theo version Delta của bảng.
+META_SQL = """
+SELECT
+  MIN(dt) AS min_d,
+  MAX(dt) AS max_d,
+  MAX(DATE(dt)) AS latest_d,
+  array_sort(collect_set(country_code)) AS countries,
+  array_sort(collect_set(industry)) AS industries,
+  COUNT(*) AS row_cnt,
+  :data_version AS data_version
+FROM silver.silver_trend
+"""
 
-countries_df = run_sql_safe("""
-    SELECT DISTINCT country_code
-    FROM silver.silver_trend
-    WHERE country_code IS NOT NULL
-    ORDER BY country_code
-""")
-countries = [str(x) for x in countries_df["country_code"].tolist()] if not countries_df.empty else []
+def _as_list(x) -> List[str]:
+    if x is None or (isinstance(x, float) and pd.isna(x)):
+        return []
+    if isinstance(x, str):
+        try:
+            x = json.loads(x)
+        except Exception:
+            return []
+    return [str(v) for v in list(x) if v is not None]
+
+def _empty_meta(data_version) -> Dict[str, object]:
+    return {
+        "min_d": None, "max_d": None, "latest_d": None,
+        "countries": [], "industries": [], "row_cnt": 0,
+        "data_version": data_version,
+    }
 
-industries_df = run_sql_safe("""
-    SELECT DISTINCT industry
-    FROM silver.silver_trend
-    WHERE industry IS NOT NULL
-    ORDER BY industry
-""")
-industries = [str(x) for x in industries_df["industry"].tolist()] if not industries_df.empty else []
+@st.cache_data(max_entries=8, show_spinner=False)
+def load_meta_snapshot(versions: tuple, engine: str = "warehouse") -> Dict[str, object]:
+    """Meta của silver theo version; query lỗi thì raise (không cache), xem meta_snapshot."""
+    data_version = dict(versions).get("silver.silver_trend")
+    snap = _empty_meta(data_version)
+    df = run_sql(META_SQL, {"data_version": data_version}, engine=engine)
+    if df.empty:
+        return snap
+    row = df.iloc[0]
+    for k in ["min_d", "max_d", "latest_d"]:
+        snap[k] = as_date(row[k])
+    snap["countries"] = _as_list(row["countries"])
+    snap["industries"] = _as_list(row["industries"])
+    snap["row_cnt"] = as_int(row["row_cnt"])
+    return snap
+
+def meta_snapshot() -> Dict[str, object]:
+    versions = data_versions(META_SQL)
+    try:
+        return load_meta_snapshot(versions, ENGINE)
+    except Exception as e:
+        st.warning(f"SQL error: {e}")
+        return _empty_meta(dict(versions).get("silver.silver_trend"))
+
+META = meta_snapshot()
+min_d = META["min_d"]
+max_d = META["max_d"]
+countries = META["countries"]
+industries = META["industries"]
 
 # Sidebar filters
 START_DATE, END_DATE, COUNTRIES, INDUSTRIES, KEYWORD, TOPN = sidebar_filters(
-    min_d if pd.notna(min_d) else None,
-    max_d if pd.notna(max_d) else None,
+    min_d,
+    max_d,
     countries,
     industries,
 )
 
 # ------------- WHERE-builder -------------
-def build_where(
-    dt_col: Optional[str] = "dt",
-    country_col: Optional[str] = "country_code",
-    industry_col: Optional[str] = "industry",
-    hashtag_expr: Optional[str] = "COALESCE(hashtag_raw, hashtag)",
-) -> str:
+# Giá trị filter đi qua tham số bind (util.filters): SQL text không đổi khi đổi filter.
+# Momentum lấy top max(TOPN, AI_MOMENTUM_POOL) mỗi panel: Tab 2 hiển thị TOPN dòng,
+# Tab 9 vẫn chọn từ 50 tag đang tăng / 30 tag đang giảm như trước khi đẩy top-K xuống SQL.
+AI_MOMENTUM_POOL = {"rn_rising": 50, "rn_fading": 30}
+FILTER_PARAMS: Dict[str, Optional[str]] = filter_params(
+    START_DATE, END_DATE, COUNTRIES, INDUSTRIES, KEYWORD, META["latest_d"],
+    max(TOPN, *AI_MOMENTUM_POOL.values()),
+)
+
+def build_where(**kwargs) -> str:
+    """util.filters.build_where; chỉ lọc theo ngày khi sidebar có đủ ngày bắt đầu / kết thúc."""
+    return _build_where(date_range=bool(START_DATE and END_DATE), **kwargs)
+
+# ------------- Subset cache -------------
+# Kết quả được giữ kèm predicate của filter. Thu hẹp filter (ALL -> ['VN'], rút ngắn ngày,
+# keyword dài hơn) -> lọc lại kết quả rộng hơn đang có ngay trên pandas, không query lại.
+# `cols`: chiều filter -> cột trong kết quả dùng để lọc lại
+#   {"date": "dt", "country": "country_code", "industry": "industry", "keyword": ("hashtag_raw", "hashtag")}
+# Chiều query có lọc nhưng không có trong `cols` (VD keyword của bảng đã GROUP BY) phải khớp tuyệt đối.
+@st.cache_resource(show_spinner=False)
+def _subset_cache() -> SubsetCache:
+    return SubsetCache(max_entries=64)
+
+def _subset_key(sql: str, params: dict) -> tuple:
+    other = tuple(sorted((k, str(v)) for k, v in params.items() if k not in PARAM_DIMS))
+    return (canonical_sql(sql), ENGINE, data_versions(sql), other)
+
+def _subset_lookup(sql: str, params: Optional[dict], cols: dict) -> Optional[pd.DataFrame]:
+    params = bind_params(sql, params)
+    df = _subset_cache().get(_subset_key(sql, params), filter_spec(params), cols, filtered_dims(params))
+    if df is not None:  # trượt -> lượt tra được ghi khi query chạy qua run_sql
+        record_fingerprint(sql_fingerprint(sql, params, ENGINE, data_versions(sql)), sql, hit=True)
+    return df
+
+def _subset_store(sql: str, params: Optional[dict], cols: dict, df: pd.DataFrame) -> None:
+    params = bind_params(sql, params)
+    _subset_cache().put(_subset_key(sql, params), filter_spec(params), cols, filtered_dims(params), df)
+
+def run_sql_subset(sql: str, cols: dict, params: Optional[dict] = None) -> pd.DataFrame:
+    """Như run_sql_safe(sql, FILTER_PARAMS) nhưng trả lời từ kết quả rộng hơn nếu đã có."""
+    params = FILTER_PARAMS if params is None else params
+    df = _subset_lookup(sql, params, cols)
+    if df is None:
+        df = run_sql_safe(sql, params)
+        if not df.empty or len(df.columns):
+            _subset_store(sql, params, cols, df)
+    return df
+
+ROW_COLS = {"date": "dt", "country": "country_code", "industry": "industry",
+            "keyword": ("hashtag_raw", "hashtag")}
+RET_COLS = dict(ROW_COLS, date="end_dt")
+COUNTRY_DAY_COLS = {"date": "dt", "country": "country_code"}
+
+# ------------- Gold daily cube -------------
+# gold.trend_daily_cube (notebook): tổng hợp sẵn theo (dt, country_code, industry) - view, video, số dòng,
+# promoted và HLL sketch hashtag. Cube không còn cột hashtag nên chỉ dùng khi không lọc keyword;
+# chưa có bảng / bảng cũ thiếu cột (hoặc local engine - không snapshot sketch) thì lặng lẽ gom từ silver như cũ.
+CUBE_COLS = {"dt", "country_code", "industry", "row_cnt", "promoted_cnt", "view_sum",
+             "eff_view_sum", "eff_video_sum", "hashtag_sketch"}
+USE_CUBE = not KEYWORD and CUBE_COLS <= {c.lower() for c in table_columns("gold.trend_daily_cube")}
+
+# View theo (ngày, quốc gia) - cộng dồn được nên lọc lại theo ngày / quốc gia
+if USE_CUBE:
+    SQL_COUNTRY_VIEWS = f"""
+    SELECT dt, country_code, SUM(view_sum) AS total_views
+    FROM gold.trend_daily_cube
+    {build_where(dt_col='dt', country_col='country_code', industry_col=None, hashtag_expr=None)}
+    GROUP BY 1,2 ORDER BY 1,2
     """
-    Xây WHERE clause theo filter global. 
-    Lưu ý:
-      - Nếu hashtag_expr=None thì sẽ bỏ qua filter KEYWORD (dùng cho bảng không có hashtag).
+else:
+    SQL_COUNTRY_VIEWS = f"""
+    SELECT DATE(dt) dt, country_code, SUM(view_count) AS total_views
+    FROM silver.silver_trend
+    {build_where(dt_col='dt', country_col='country_code', industry_col=None,
+                 hashtag_expr='COALESCE(hashtag_raw, hashtag)')}
+    GROUP BY 1,2 ORDER BY 1,2
     """
-    clauses: List[str] = []
-    if dt_col and START_DATE and END_DATE:
-        clauses.append(f"{_date_expr(dt_col)} BETWEEN DATE('{START_DATE}') AND DATE('{END_DATE}')")
-    if country_col and COUNTRIES and COUNTRIES != ["ALL"]:
-        items = [c for c in COUNTRIES if c != "ALL"]
-        if items:
-            clauses.append(f"{country_col} IN ({_in_list_sql(items)})")
-    if industry_col and INDUSTRIES and INDUSTRIES != ["ALL"]:
-        items = [i for i in INDUSTRIES if i != "ALL"]
-        if items:
-            clauses.append(f"{industry_col} IN ({_in_list_sql(items)})")
-    if KEYWORD and hashtag_expr:
-        kw = str(KEYWORD).lower().replace("'", "''")
-        clauses.append(f"LOWER({hashtag_expr}) LIKE '%{kw}%'")
-    return (" WHERE " + " AND ".join(clauses)) if clauses else ""
 
-# ------------- Action buttons (Simplified) -------------
-if st.sidebar.button("🔄 Refresh Cache (10m)"):
-    st.cache_data.clear()
-    st.sidebar.success("Cache cleared.")
+# Tổng view / video ngày mới nhất ở grain (ngành, quốc gia); cộng lại theo ngành trên pandas
+# -> 1 query phục vụ cả cơ cấu ngành lẫn hiệu quả ngành, và thu hẹp quốc gia không cần query lại.
+if USE_CUBE:
+    SQL_INDUSTRY_LATEST = f"""
+    SELECT industry, country_code,
+           SUM(view_sum) AS total_views,
+           SUM(eff_view_sum) AS eff_views,
+           SUM(eff_video_sum) AS total_videos
+    FROM gold.trend_daily_cube
+    WHERE dt = DATE(:latest_dt) AND industry IS NOT NULL
+      AND {_in_param_sql('country_code', 'f_countries')}
+    GROUP BY industry, country_code
+    """
+else:
+    SQL_INDUSTRY_LATEST = f"""
+    SELECT industry, country_code,
+           SUM(view_count) AS total_views,
+           SUM(CASE WHEN video_count > 0 THEN view_count END) AS eff_views,
+           SUM(CASE WHEN video_count > 0 THEN video_count END) AS total_videos
+    FROM silver.silver_trend
+    WHERE dt = DATE(:latest_dt) AND industry IS NOT NULL
+      AND {_in_param_sql('country_code', 'f_countries')}
+      AND {_keyword_sql('COALESCE(hashtag_raw, hashtag)')}
+    GROUP BY industry, country_code
+    """
 
-# --------- KPI header ---------
-st.divider()
-colA, colB, colC, colD = st.columns(4)
-sql_kpi = f"""
-SELECT
-  COUNT(DISTINCT hashtag) AS uniq_hashtags,
-  COUNT(DISTINCT CASE WHEN {_date_expr('dt')} = (SELECT MAX(DATE(dt)) FROM silver.silver_trend) THEN hashtag END) AS today_tags,
-  COUNT(DISTINCT country_code) AS uniq_countries,
-  COUNT(DISTINCT industry) AS uniq_industries
-FROM silver.silver_trend
-{build_where(dt_col='dt', hashtag_expr='COALESCE(hashtag_raw, hashtag)')}
-"""
-kpi = run_sql_safe(sql_kpi)
-a = int(kpi.iloc[0]["uniq_hashtags"] or 0) if not kpi.empty else 0
-b = int(kpi.iloc[0]["today_tags"] or 0)    if not kpi.empty else 0
-c = int(kpi.iloc[0]["uniq_countries"] or 0)if not kpi.empty else 0
-d = int(kpi.iloc[0]["uniq_industries"] or 0)if not kpi.empty else 0
-colA.metric("Hashtags trong phạm vi", f"{a:,}")
-colB.metric("Hashtags hôm mới nhất", f"{b:,}")
-colC.metric("Quốc gia", f"{c:,}")
-colD.metric("Ngành", f"{d:,}")
-st.caption("Các KPI phản ánh bộ lọc hiện tại trong sidebar.")
-st.divider()
+def top_industry_share(base: pd.DataFrame, k: int = 12) -> pd.DataFrame:
+    """Tổng view theo ngành (top k)."""
+    if base.empty:
+        return pd.DataFrame()
+    g = base.groupby("industry", as_index=False)["total_views"].sum(min_count=1)
+    return g.sort_values("total_views", ascending=False).head(k).reset_index(drop=True)
 
-# ------------- Tải Dữ liệu 1 lần (Tối ưu) -------------
+def top_industry_efficiency(base: pd.DataFrame, k: int = 15) -> pd.DataFrame:
+    """View / video theo ngành (chỉ tính dòng có video_count > 0), top k."""
+    if base.empty:
+        return pd.DataFrame()
+    g = base.groupby("industry", as_index=False)[["eff_views", "total_videos"]].sum(min_count=1)
+    g = g.dropna(subset=["total_videos"]).rename(columns={"eff_views": "total_views"})
+    videos = g["total_videos"].astype("float64")
+    g["view_per_video"] = g["total_views"].astype("float64") / videos.where(videos > 0)
+    return g.sort_values("view_per_video", ascending=False).head(k).reset_index(drop=True)
 
-# Lấy dữ liệu Momentum (dùng cho Tab 2)
+# ------------- Action buttons (Simplified) -------------
+# Cache được key theo version Delta của bảng: pipeline ghi dữ liệu mới -> chỉ kết quả của
+# bảng đó bị thay. Nút này buộc kiểm tra lại version ngay (thay vì chờ tối đa 60s) và xoá
+# cache RAM của app (run_sql_safe, meta); kết quả theo version trong run_sql / cache bền vững
+# vẫn giữ nên lượt sau không phải query lại những gì chưa đổi.
+RESULT_CACHE = get_result_cache()  # cache bền vững (disk / Redis), None nếu không bật
+if st.sidebar.button("🔄 Kiểm tra dữ liệu mới"):
+    table_version.clear()
+    _run_sql_safe.clear()
+    load_meta_snapshot.clear()
+    st.sidebar.success("Đã kiểm tra version dữ liệu.")
+if RESULT_CACHE is not None:
+    _rc = RESULT_CACHE.stats()
+    st.sidebar.caption(f"Result cache ({_rc['backend']}): {_rc['hits']} hit · {_rc['misses']} miss"
+                       f" · {_rc['evictions']} evicted")
+
+# ------------- Chọn chức năng (tab) -------------
+# Chỉ tab đang mở được chạy (query + vẽ biểu đồ); st.tabs cũ chạy cả 10 tab mỗi lần rerun.
+TAB_LABELS = [
+    "🎯 1. Tìm Ngách (Niche Finder)",
+    "🔥 2. Động lượng Trend (Momentum)",
+    "⚡ 3. Chiến lược Trend Nhanh",
+    "🌳 4. Chiến lược Bền vững",
+    "📊 5. Phân tích Bão hòa Ngành",
+    "🌍 6. Phân tích Thị trường QG",
+    "🏆 7. Top 100 Đã Kiểm chứng",
+    "📅 8. Lập kế hoạch Tuần",
+    "🤖 9. AI Phân tích Kênh",   # <-- TAB 9
+    "📣 10. Phân tích Promote"   # <-- TAB 10 mới
+]
+RENDER_ALL = st.sidebar.checkbox(
+    "Chạy tất cả tab (chế độ cũ)", value=False,
+    help="Chạy cả 10 tab mỗi lượt như st.tabs trước đây - dùng để so sánh số query / thời gian.",
+)
+# Đọc lựa chọn từ session_state ngay từ đầu để prefetch đúng dữ liệu; widget được vẽ bên dưới KPI.
+ACTIVE_TAB = st.session_state.get("active_tab", TAB_LABELS[0])
+if ACTIVE_TAB not in TAB_LABELS:
+    ACTIVE_TAB = TAB_LABELS[0]
+
+# ------------- Dimension hashtag -------------
+# gold.hashtag_dim (notebook, cập nhật tăng dần): 1 dòng / (ngày, hashtag, quốc gia, ngành)
+# với hashtag_raw / url của dòng rank tốt nhất. Chưa dựng bảng thì tính từ silver theo đúng
+# quy tắc chọn dòng của notebook (Cell 4b).
+HASHTAG_DIM = "gold.hashtag_dim" if table_columns("gold.hashtag_dim") else """(
+    SELECT DATE(dt) AS dt, hashtag, country_code, industry, hashtag_raw, url, rank AS best_rank
+    FROM silver.silver_trend
+    QUALIFY ROW_NUMBER() OVER (
+      PARTITION BY DATE(dt), hashtag, country_code, industry
+      ORDER BY COALESCE(rank, 2147483647), view_count DESC
+    ) = 1
+  )"""
+
+# Theo tuần cho weekly summary: join theo (tuần, hashtag) thay vì chỉ hashtag
+# (join theo hashtag nhân mỗi dòng tuần với mọi ngày hashtag từng xuất hiện).
+HASHTAG_DIM_WEEK = f"""(
+    SELECT DATE(DATE_TRUNC('week', d.dt)) AS week, d.hashtag, d.country_code, d.industry,
+           MAX(d.hashtag_raw) AS hashtag_raw
+    FROM {HASHTAG_DIM} d
+    GROUP BY DATE(DATE_TRUNC('week', d.dt)), d.hashtag, d.country_code, d.industry
+  )"""
+
+# ------------- SQL chính của từng bộ dữ liệu -------------
+if USE_CUBE:
+    # Số hashtag distinct gộp từ HLL sketch (xấp xỉ, sai số ~1-2%)
+    sql_kpi = f"""
+    SELECT
+      COALESCE(hll_sketch_estimate(hll_union_agg(hashtag_sketch)), 0) AS uniq_hashtags,
+      COALESCE(hll_sketch_estimate(hll_union_agg(
+        CASE WHEN dt = DATE(:latest_dt) THEN hashtag_sketch END)), 0) AS today_tags,
+      COUNT(DISTINCT country_code) AS uniq_countries,
+      COUNT(DISTINCT industry) AS uniq_industries
+    FROM gold.trend_daily_cube
+    {build_where(dt_col='dt', hashtag_expr=None)}
+    """
+else:
+    sql_kpi = f"""
+    SELECT
+      COUNT(DISTINCT hashtag) AS uniq_hashtags,
+      COUNT(DISTINCT CASE WHEN dt = DATE(:latest_dt) THEN hashtag END) AS today_tags,
+      COUNT(DISTINCT country_code) AS uniq_countries,
+      COUNT(DISTINCT industry) AS uniq_industries
+    FROM silver.silver_trend
+    {build_where(dt_col='dt', hashtag_expr='COALESCE(hashtag_raw, hashtag)')}
+    """
+
+# Momentum (dùng cho Tab 2)
 sql_m = f"""
   WITH b AS (
-    SELECT DISTINCT DATE(dt) AS dt, hashtag, country_code, industry, hashtag_raw
-    FROM silver.silver_trend
+    SELECT dt, hashtag, country_code, industry, hashtag_raw FROM {HASHTAG_DIM} d
   ),
   m AS (
     SELECT dt, hashtag, rank, prev_rank, rank_velocity, view_delta, video_delta
@@ -198,46 +470,54 @@ sql_m = f"""
   {build_where(dt_col='j.dt', country_col='j.country_code', industry_col='j.industry',
               hashtag_expr='COALESCE(j.hashtag_raw, j.hashtag)')}
 """
-mom = run_sql_safe(sql_m)
-if mom.empty:
-    sql_fb = f"""
-      WITH s AS (
-        SELECT DATE(dt) dt, hashtag, rank, view_count, video_count, country_code, industry, hashtag_raw
-        FROM silver.silver_trend
-      ),
-      best AS (
-        SELECT * FROM (
-          SELECT s.*, ROW_NUMBER() OVER (PARTITION BY dt, hashtag ORDER BY COALESCE(rank,999), view_count DESC) rn
-          FROM s
-        ) x WHERE rn=1
-      ),
-      x AS (
-        SELECT
-          dt, hashtag, rank,
-          LAG(rank) OVER (PARTITION BY hashtag ORDER BY dt) AS prev_rank,
-          (LAG(rank) OVER (PARTITION BY hashtag ORDER BY dt) - rank) AS rank_velocity,
-          (view_count - LAG(view_count) OVER (PARTITION BY hashtag ORDER BY dt)) AS view_delta,
-          (video_count - LAG(video_count) OVER (PARTITION BY hashtag ORDER BY dt)) AS video_delta,
-          country_code, industry, hashtag_raw
-        FROM best
-      )
-      SELECT * FROM x
-      {build_where(dt_col='dt', country_col='country_code', industry_col='industry',
-                   hashtag_expr='COALESCE(hashtag_raw, hashtag)')}
-    """
-    mom = run_sql_safe(sql_fb)
 
-mom = uniquify_columns(dedup_cols(mom))
-mom["view_delta"] = pd.to_numeric(mom.get("view_delta"), errors="coerce").fillna(0)
-mom["rank_velocity"] = pd.to_numeric(mom.get("rank_velocity"), errors="coerce").fillna(0)
-latest_mom_dt = mom['dt'].max() if not mom.empty else "N/A"
-mom_latest = mom[mom['dt'] == latest_mom_dt] if not mom.empty else pd.DataFrame()
+# Momentum tính thẳng từ silver (khi chưa có gold.trend_momentum)
+sql_m_fb = f"""
+  WITH s AS (
+    SELECT DATE(dt) dt, hashtag, rank, view_count, video_count, country_code, industry, hashtag_raw
+    FROM silver.silver_trend
+  ),
+  best AS (
+    SELECT * FROM (
+      SELECT s.*, ROW_NUMBER() OVER (PARTITION BY dt, hashtag ORDER BY COALESCE(rank,999), view_count DESC) rn
+      FROM s
+    ) x WHERE rn=1
+  ),
+  x AS (
+    SELECT
+      dt, hashtag, rank,
+      LAG(rank) OVER (PARTITION BY hashtag ORDER BY dt) AS prev_rank,
+      (LAG(rank) OVER (PARTITION BY hashtag ORDER BY dt) - rank) AS rank_velocity,
+      (view_count - LAG(view_count) OVER (PARTITION BY hashtag ORDER BY dt)) AS view_delta,
+      (video_count - LAG(video_count) OVER (PARTITION BY hashtag ORDER BY dt)) AS video_delta,
+      country_code, industry, hashtag_raw
+    FROM best
+  )
+  SELECT * FROM x
+  {build_where(dt_col='dt', country_col='country_code', industry_col='industry',
+               hashtag_expr='COALESCE(hashtag_raw, hashtag)')}
+"""
+
+def momentum_top_sql(base_sql: str) -> str:
+    """
+    Top :top_k (>= TOPN ở sidebar, xem AI_MOMENTUM_POOL) của ngày mới nhất theo từng panel Tab 2 - tăng view, tăng hạng, giảm view -
+    bằng QUALIFY ROW_NUMBER(); chỉ vài trăm dòng về app thay vì cả lịch sử momentum.
+    """
+    return f"""
+      WITH f AS ({base_sql}),
+      latest AS (SELECT * FROM f WHERE dt = (SELECT MAX(dt) FROM f))
+      SELECT latest.*,
+             ROW_NUMBER() OVER (ORDER BY COALESCE(view_delta, 0) DESC, hashtag) AS rn_rising,
+             ROW_NUMBER() OVER (ORDER BY COALESCE(rank_velocity, 0) DESC, hashtag) AS rn_rank_rising,
+             ROW_NUMBER() OVER (ORDER BY COALESCE(view_delta, 0) ASC, hashtag) AS rn_fading
+      FROM latest
+      QUALIFY rn_rising <= :top_k OR rn_rank_rising <= :top_k OR rn_fading <= :top_k
+    """
 
-# Lấy dữ liệu Retention (dùng cho Tab 3, 4)
+# Retention (dùng cho Tab 3, 4)
 sql_ret = f"""
   WITH base AS (
-    SELECT DISTINCT DATE(dt) AS dt, hashtag, url, country_code, industry, hashtag_raw
-    FROM silver.silver_trend
+    SELECT dt, hashtag, url, country_code, industry, hashtag_raw FROM {HASHTAG_DIM} d
   ),
   j AS (
     SELECT r.hashtag, r.start_dt, r.end_dt, r.streak_days,
@@ -249,38 +529,10 @@ sql_ret = f"""
   {build_where(dt_col='j.end_dt', country_col='j.country_code', industry_col='j.industry',
                hashtag_expr='COALESCE(j.hashtag_raw, j.hashtag)')}
 """
-df_ret = run_sql_safe(sql_ret)
-if df_ret.empty:
-    sql_ret_fb = f"""
-      WITH s AS (
-        SELECT DISTINCT DATE(dt) dt, hashtag FROM silver.silver_trend
-      ),
-      g AS (
-        SELECT hashtag, dt,
-          DATEDIFF(dt, DATE'1970-01-01') - ROW_NUMBER() OVER (PARTITION BY hashtag ORDER BY dt) grp
-        FROM s
-      ),
-      streaks AS (
-        SELECT hashtag, MIN(dt) start_dt, MAX(dt) end_dt, COUNT(*) streak_days
-        FROM g GROUP BY hashtag, grp
-      ),
-      dim AS (
-        SELECT DISTINCT DATE(dt) dt, hashtag, url, country_code, industry, hashtag_raw
-        FROM silver.silver_trend
-      )
-      SELECT r.hashtag, r.start_dt, r.end_dt, r.streak_days,
-             d.url, d.country_code, d.industry, d.hashtag_raw
-      FROM streaks r
-      LEFT JOIN dim d ON r.hashtag=d.hashtag AND r.end_dt=d.dt
-      {build_where(dt_col='r.end_dt', country_col='d.country_code', industry_col='d.industry',
-                   hashtag_expr='COALESCE(d.hashtag_raw, r.hashtag)')}
-    """
-    df_ret = run_sql_safe(sql_ret_fb)
-df_ret = uniquify_columns(dedup_cols(df_ret))
 
-# Lấy dữ liệu New Entries (dùng cho Tab 3)
+# New Entries (dùng cho Tab 3)
 sql_new = f"""
-WITH base AS (SELECT DISTINCT DATE(dt) dt, hashtag FROM silver.silver_trend),
+WITH base AS (SELECT DISTINCT dt, hashtag FROM {HASHTAG_DIM} d),
      firsts AS (SELECT hashtag, MIN(dt) dt FROM base GROUP BY hashtag)
 SELECT dt, COUNT(*) AS new_count
 FROM firsts
@@ -288,55 +540,277 @@ FROM firsts
 GROUP BY dt
 ORDER BY dt
 """
-df_new = run_sql_safe(sql_new)
 
-# ------------- Tabs (Cấu trúc 10 Chức năng Sáng tạo) -------------
-tabs = st.tabs([
-    "🎯 1. Tìm Ngách (Niche Finder)",
-    "🔥 2. Động lượng Trend (Momentum)",
-    "⚡ 3. Chiến lược Trend Nhanh",
-    "🌳 4. Chiến lược Bền vững",
-    "📊 5. Phân tích Bão hòa Ngành",
-    "🌍 6. Phân tích Thị trường QG",
-    "🏆 7. Top 100 Đã Kiểm chứng",
-    "📅 8. Lập kế hoạch Tuần",
-    "🤖 9. AI Phân tích Kênh",   # <-- TAB 9
-    "📣 10. Phân tích Promote"   # <-- TAB 10 mới
-])
+# Opportunity (dùng cho Tab 1, 9)
+sql_opp = f"""
+    SELECT
+      t.hashtag, t.view_count, t.video_count,
+      t.industry, t.country_code, t.rank,
+      t.dt, t.hashtag_raw
+    FROM gold.trend_latest_top100 t
+    {build_where(dt_col='t.dt', country_col='t.country_code', industry_col='t.industry',
+                 hashtag_expr='COALESCE(t.hashtag_raw, t.hashtag)', extra=['t.dt = DATE(:latest_dt)'])}
+"""
 
-# ===== 🎯 1. Tìm Ngách (Niche Finder) =====
-with tabs[0]:
-    st.subheader("🎯 1. Phát hiện Cơ hội (Niche Finder)")
-    st.markdown("Chức năng: Tìm hashtag có **lượt xem (Demand) cao** nhưng **số video (Competition) thấp**."
-                " Hãy tìm các điểm ở **góc trên bên trái**.")
+# Top 100 (dùng cho Tab 7, 9)
+sql_top100 = f"""
+    SELECT
+      t.dt, t.hashtag, t.rank, t.view_count, t.video_count,
+      t.country_code, t.industry, t.category,
+      t.hashtag_raw, t.url
+    FROM gold.trend_latest_top100 t
+    {build_where(dt_col='t.dt', country_col='t.country_code', industry_col='t.industry',
+                 hashtag_expr='COALESCE(t.hashtag_raw, t.hashtag)', extra=['t.dt = DATE(:latest_dt)'])}
+    ORDER BY COALESCE(t.rank, 999) ASC
+    LIMIT 100
+"""
 
-    sql_opp = f"""
-        WITH mx AS (SELECT MAX(dt) AS mx FROM silver.silver_trend)
-        SELECT
-          t.hashtag, t.view_count, t.video_count,
-          t.industry, t.country_code, t.rank
-        FROM gold.trend_latest_top100 t
-        JOIN mx ON t.dt = mx.mx
-        {build_where(dt_col='t.dt', country_col='t.country_code', industry_col='t.industry',
-                     hashtag_expr='COALESCE(t.hashtag_raw, t.hashtag)')}
+# Weekly (dùng cho Tab 8, 9) - WHERE riêng vì dt_col là 'week'
+_weekly_parts: List[str] = []
+if START_DATE and END_DATE:
+    _weekly_parts.append(
+        "w.week BETWEEN DATE_TRUNC('week', DATE(:f_start)) AND DATE_TRUNC('week', DATE(:f_end))"
+    )
+_weekly_parts.append(_in_param_sql("b.country_code", "f_countries"))
+_weekly_parts.append(_in_param_sql("b.industry", "f_industries"))
+_weekly_parts.append(_keyword_sql("COALESCE(b.hashtag_raw, w.hashtag)"))
+weekly_where = (" WHERE " + " AND ".join(_weekly_parts)) if _weekly_parts else ""
+
+sql_week = f"""
+  SELECT w.week, w.hashtag, w.best_rank, w.avg_rank, w.new_days_count, w.max_views,
+         b.country_code, b.industry, b.hashtag_raw
+  FROM gold.trend_weekly_summary w
+  LEFT JOIN {HASHTAG_DIM_WEEK} b ON DATE(w.week) = b.week AND w.hashtag = b.hashtag
+  {weekly_where}
+  ORDER BY w.week DESC, COALESCE(w.best_rank, 999) ASC
+"""
+
+INDUSTRY_COLS = {"country": "country_code"}
+
+# tên -> (SQL, cột subset cache hoặc None)
+DATASETS: Dict[str, tuple] = {
+    "kpi": (sql_kpi, None),
+    "mom": (momentum_top_sql(sql_m), None),
+    "ret": (sql_ret, RET_COLS),
+    "new": (sql_new, None),
+    "opp": (sql_opp, ROW_COLS),
+    "top100": (sql_top100, None),
+    "week": (sql_week, None),
+    "industry": (SQL_INDUSTRY_LATEST, INDUSTRY_COLS),
+    "country": (SQL_COUNTRY_VIEWS, COUNTRY_DAY_COLS),
+}
+
+# Tab -> các bộ dữ liệu cần (prefetch song song cùng KPI). Tab 6 / 10 chọn SQL theo cột của bảng gold
+# nên tự chạy trong tab.
+TAB_DATASETS: Dict[str, List[str]] = dict(zip(TAB_LABELS, [
+    ["opp"],
+    ["mom"],
+    ["ret", "new"],
+    ["ret"],
+    ["industry"],
+    [],
+    ["top100"],
+    ["week"],
+    ["mom", "ret", "opp", "top100", "week", "industry", "country"],
+    [],
+]))
+
+# ------------- Tải dữ liệu (song song) -------------
+# KPI + dữ liệu của tab đang mở độc lập nhau -> chạy đồng thời,
+# thời gian chờ ~ query chậm nhất thay vì tổng các query.
+_needed = ["kpi"] + [n for tab in (TAB_LABELS if RENDER_ALL else [ACTIVE_TAB]) for n in TAB_DATASETS[tab]]
+_needed = list(dict.fromkeys(_needed))
+preload = run_sql_many_safe(
+    {n: (DATASETS[n][0], FILTER_PARAMS) for n in _needed},
+    subset_cols={n: DATASETS[n][1] for n in _needed if DATASETS[n][1]},
+)
+
+def _dataset(name: str) -> pd.DataFrame:
+    """Kết quả SQL chính của 1 bộ dữ liệu: lấy từ preload nếu đã chạy song song, không thì chạy ngay."""
+    if name in preload:
+        return preload[name]
+    sql, cols = DATASETS[name]
+    return run_sql_subset(sql, cols) if cols else run_sql_safe(sql, FILTER_PARAMS)
+
+# --------- KPI header ---------
+st.divider()
+colA, colB, colC, colD = st.columns(4)
+kpi = preload["kpi"]
+a = as_int(kpi.iloc[0]["uniq_hashtags"])   if not kpi.empty else 0
+b = as_int(kpi.iloc[0]["today_tags"])      if not kpi.empty else 0
+c = as_int(kpi.iloc[0]["uniq_countries"])  if not kpi.empty else 0
+d = as_int(kpi.iloc[0]["uniq_industries"]) if not kpi.empty else 0
+colA.metric("Hashtags trong phạm vi", f"{a:,}")
+colB.metric("Hashtags hôm mới nhất", f"{b:,}")
+colC.metric("Quốc gia", f"{c:,}")
+colD.metric("Ngành", f"{d:,}")
+st.caption("Các KPI phản ánh bộ lọc hiện tại trong sidebar."
+           + (" Số hashtag ước lượng từ sketch của gold.trend_daily_cube." if USE_CUBE else ""))
+st.divider()
+
+# ------------- Loaders (chỉ gọi khi tab cần) -------------
+# lru_cache: mỗi lượt chạy script định nghĩa lại hàm, nên chỉ nhớ trong lượt đó
+# (Tab 2 và Tab 9 dùng chung 1 kết quả khi chạy tất cả tab).
+@functools.lru_cache(maxsize=None)
+def load_momentum():
     """
-    df_opp = run_sql_safe(sql_opp)
-    
-    # Fallback nếu gold rỗng
+    Momentum ngày mới nhất (Tab 2, 9): chỉ các dòng lọt top :top_k (>= TOPN) của ít nhất 1 panel, tính trên server.
+    Trả (mom_top, latest_mom_dt); xem momentum_panel để lấy từng panel.
+    """
+    mom = _dataset("mom")
+    if mom.empty:
+        mom = run_sql_safe(momentum_top_sql(sql_m_fb), FILTER_PARAMS)
+    mom = uniquify_columns(dedup_cols(mom))
+    mom["view_delta"] = pd.to_numeric(mom.get("view_delta"), errors="coerce").fillna(0)
+    mom["rank_velocity"] = pd.to_numeric(mom.get("rank_velocity"), errors="coerce").fillna(0)
+    latest_mom_dt = (as_date(mom['dt'].max()) or "N/A") if not mom.empty else "N/A"
+    return mom, latest_mom_dt
+
+@functools.lru_cache(maxsize=None)
+def load_momentum_history() -> pd.DataFrame:
+    """Toàn bộ lịch sử momentum theo filter - chỉ tải khi người dùng chọn xem / xuất file ở Tab 2."""
+    mom = run_sql_subset(sql_m, ROW_COLS)
+    if mom.empty:
+        mom = run_sql_subset(sql_m_fb, ROW_COLS)
+    return uniquify_columns(dedup_cols(mom))
+
+def momentum_panel(mom_top: pd.DataFrame, rn_col: str, k: Optional[int] = None) -> pd.DataFrame:
+    """
+    1 panel của Tab 2 (rn_rising / rn_rank_rising / rn_fading), đúng thứ tự đã xếp trên server.
+    `k` dòng đầu (mặc định TOPN; Tab 9 lấy tới AI_MOMENTUM_POOL).
+    """
+    if mom_top.empty or rn_col not in mom_top.columns:
+        return pd.DataFrame()
+    rn = pd.to_numeric(mom_top[rn_col], errors="coerce")
+    return mom_top[(rn <= (k or TOPN)).fillna(False).astype(bool)].sort_values(rn_col)
+
+@functools.lru_cache(maxsize=None)
+def load_retention() -> pd.DataFrame:
+    """Retention (Tab 3, 4, 9): gold.trend_retention, fallback tính streak từ silver."""
+    df_ret = _dataset("ret")
+    if df_ret.empty:
+        sql_ret_fb = f"""
+          WITH s AS (
+            SELECT DISTINCT dt, hashtag FROM {HASHTAG_DIM} d
+          ),
+          g AS (
+            SELECT hashtag, dt,
+              DATEDIFF(dt, DATE'1970-01-01') - ROW_NUMBER() OVER (PARTITION BY hashtag ORDER BY dt) grp
+            FROM s
+          ),
+          streaks AS (
+            SELECT hashtag, MIN(dt) start_dt, MAX(dt) end_dt, COUNT(*) streak_days
+            FROM g GROUP BY hashtag, grp
+          ),
+          dim AS (
+            SELECT dt, hashtag, url, country_code, industry, hashtag_raw FROM {HASHTAG_DIM} d
+          )
+          SELECT r.hashtag, r.start_dt, r.end_dt, r.streak_days,
+                 d.url, d.country_code, d.industry, d.hashtag_raw
+          FROM streaks r
+          LEFT JOIN dim d ON r.hashtag=d.hashtag AND r.end_dt=d.dt
+          {build_where(dt_col='r.end_dt', country_col='d.country_code', industry_col='d.industry',
+                       hashtag_expr='COALESCE(d.hashtag_raw, r.hashtag)')}
+        """
+        df_ret = run_sql_subset(sql_ret_fb, RET_COLS)
+    df_ret = uniquify_columns(dedup_cols(df_ret))
+    return df_ret
+
+@functools.lru_cache(maxsize=None)
+def load_new_entries() -> pd.DataFrame:
+    """New Entries (Tab 3)."""
+    return _dataset("new")
+
+def combine_new_entries(df_ret: pd.DataFrame, df_new: pd.DataFrame) -> pd.DataFrame:
+    """
+    Mỗi chuỗi retention kèm số hashtag mới của ngày chuỗi bắt đầu (khoá start_dt = dt).
+    df_new có 1 dòng / ngày nên kết quả đúng bằng số chuỗi (thay cho cross join |ngày| x |chuỗi|).
+    """
+    if df_ret.empty or df_new.empty or "start_dt" not in df_ret.columns:
+        return df_ret
+    new_by_day = pd.Series(
+        pd.to_numeric(df_new["new_count"], errors="coerce").to_numpy(),
+        index=pd.to_datetime(df_new["dt"], errors="coerce").dt.normalize(),
+    )
+    new_by_day = new_by_day[~new_by_day.index.duplicated()]
+    start = pd.to_datetime(df_ret["start_dt"], errors="coerce").dt.normalize()
+    return df_ret.assign(new_count_on_start=start.map(new_by_day).to_numpy())
+
+@functools.lru_cache(maxsize=None)
+def load_opportunity() -> pd.DataFrame:
+    """Opportunity ngày mới nhất (Tab 1, 9): gold.trend_latest_top100, fallback từ silver."""
+    df_opp = _dataset("opp")
     if df_opp.empty:
         sql_opp_fb = f"""
-            WITH mx AS (SELECT MAX(DATE(dt)) AS mx FROM silver.silver_trend),
-            s AS (
+            WITH s AS (
                 SELECT *, ROW_NUMBER() OVER (PARTITION BY hashtag ORDER BY view_count DESC) rn
                 FROM silver.silver_trend
-                WHERE DATE(dt) = (SELECT mx FROM mx)
+                WHERE dt = DATE(:latest_dt)
             )
-            SELECT hashtag, view_count, video_count, industry, country_code, rank
-            FROM s WHERE rn = 1
+            SELECT hashtag, view_count, video_count, industry, country_code, rank, hashtag_raw
+            FROM s
             {build_where(dt_col=None, country_col='country_code', industry_col='industry',
-                         hashtag_expr='COALESCE(hashtag_raw, hashtag)')}
+                         hashtag_expr='COALESCE(hashtag_raw, hashtag)', extra=['rn = 1'])}
+        """
+        df_opp = run_sql_subset(sql_opp_fb, ROW_COLS)
+    return df_opp
+
+@functools.lru_cache(maxsize=None)
+def load_top100() -> pd.DataFrame:
+    """Top 100 ngày mới nhất (Tab 7, 9)."""
+    return uniquify_columns(dedup_cols(_dataset("top100")))
+
+@functools.lru_cache(maxsize=None)
+def load_weekly() -> pd.DataFrame:
+    """Weekly summary (Tab 8, 9): gold.trend_weekly_summary, fallback tính từ silver."""
+    dfw = _dataset("week")
+    if dfw.empty:
+        sql_fb = f"""
+          WITH base AS (
+            SELECT DATE(dt) dt, hashtag, COALESCE(rank,999) rank, view_count
+            FROM silver.silver_trend
+          ),
+          best AS (
+            SELECT * FROM (
+              SELECT base.*, ROW_NUMBER() OVER (PARTITION BY dt, hashtag ORDER BY rank, view_count DESC) rn
+              FROM base
+            ) x WHERE rn=1
+          ),
+          w AS (
+            SELECT DATE_TRUNC('week', dt) AS week, hashtag,
+                   MIN(rank) AS best_rank, AVG(rank) AS avg_rank,
+                   COUNT(*) AS new_days_count, MAX(view_count) AS max_views
+            FROM best GROUP BY 1,2
+          )
+          SELECT w.week, w.hashtag, w.best_rank, w.avg_rank, w.new_days_count, w.max_views,
+                 b.country_code, b.industry, b.hashtag_raw
+          FROM w LEFT JOIN {HASHTAG_DIM_WEEK} b ON DATE(w.week) = b.week AND w.hashtag = b.hashtag
+          {weekly_where}
+          ORDER BY w.week DESC, COALESCE(w.best_rank,999) ASC
         """
-        df_opp = run_sql_safe(sql_opp_fb)
+        dfw = run_sql_safe(sql_fb, FILTER_PARAMS)
+    return uniquify_columns(dedup_cols(dfw))
+
+@functools.lru_cache(maxsize=None)
+def load_industry_latest() -> pd.DataFrame:
+    """Tổng view/video ngày mới nhất theo (ngành, quốc gia) (Tab 5, 9)."""
+    return _dataset("industry")
+
+@functools.lru_cache(maxsize=None)
+def load_country_views() -> pd.DataFrame:
+    """View theo (ngày, quốc gia) từ silver (Tab 6 fallback, Tab 9)."""
+    return _dataset("country")
+
+# ------------- Tabs (Cấu trúc 10 Chức năng Sáng tạo) -------------
+st.radio("Chức năng", TAB_LABELS, horizontal=True, key="active_tab", label_visibility="collapsed")
+
+# ===== 🎯 1. Tìm Ngách (Niche Finder) =====
+def render_niche():
+    st.subheader("🎯 1. Phát hiện Cơ hội (Niche Finder)")
+    st.markdown("Chức năng: Tìm hashtag có **lượt xem (Demand) cao** nhưng **số video (Competition) thấp**."
+                " Hãy tìm các điểm ở **góc trên bên trái**.")
+
+    df_opp = load_opportunity()
 
     if not df_opp.empty and px is not None and "view_count" in df_opp.columns and "video_count" in df_opp.columns:
         df_opp_plot = df_opp.dropna(subset=["view_count", "video_count"])
@@ -366,24 +840,25 @@ with tabs[0]:
         st.info("Không có dữ liệu cho biểu đồ cơ hội.")
     
     show_data_expander(df_opp, "Xem dữ liệu cơ hội")
-    csv_download(df_opp, "opportunity_latest.csv")
+    file_download(df_opp, "opportunity_latest.csv")
 
 # ===== 🔥 2. Động lượng Trend (Momentum) =====
-with tabs[1]:
+def render_momentum():
+    mom_top, latest_mom_dt = load_momentum()
     st.subheader("🔥 2. Phân tích Động lượng Trend (Momentum)")
     st.markdown("Chức năng: Xem nhanh các hashtag 'Nóng', 'Ngôi sao' và 'Nguội' trong ngày."
                 f" (Dữ liệu ngày: **{latest_mom_dt}**)")
 
-    if not mom_latest.empty and px is not None:
+    if not mom_top.empty and px is not None:
         col1, col2, col3 = st.columns(3)
         
         with col1:
             st.markdown("#### 🔥 Trend Nóng (Views)")
-            df_rising = mom_latest.sort_values("view_delta", ascending=False).head(15)
+            df_rising = momentum_panel(mom_top, "rn_rising")
             if not df_rising.empty:
                 fig_rising = px.bar(
                     df_rising, x="view_delta", y="hashtag", orientation="h",
-                    title="Top 15 Tăng View",
+                    title=f"Top {TOPN} Tăng View",
                     labels={"view_delta": "Thay đổi Lượt xem (DoD)", "hashtag": "Hashtag"},
                     hover_data=["industry", "rank", "rank_velocity"]
                 )
@@ -394,11 +869,11 @@ with tabs[1]:
 
         with col2:
             st.markdown("#### ✨ Ngôi sao mới (Rank)")
-            df_rank_rising = mom_latest.sort_values("rank_velocity", ascending=False).head(15)
+            df_rank_rising = momentum_panel(mom_top, "rn_rank_rising")
             if not df_rank_rising.empty:
                 fig_rank_rising = px.bar(
                     df_rank_rising, x="rank_velocity", y="hashtag", orientation="h",
-                    title="Top 15 Tăng Hạng nhanh nhất",
+                    title=f"Top {TOPN} Tăng Hạng nhanh nhất",
                     labels={"rank_velocity": "Thay đổi Hạng (DoD)", "hashtag": "Hashtag"},
                     hover_data=["industry", "rank", "view_delta"]
                 )
@@ -409,11 +884,11 @@ with tabs[1]:
         
         with col3:
             st.markdown("#### ❄️ Trend Nguội (Fading)")
-            df_fading = mom_latest.sort_values("view_delta", ascending=True).head(15)
+            df_fading = momentum_panel(mom_top, "rn_fading")
             if not df_fading.empty:
                 fig_fading = px.bar(
                     df_fading, x="view_delta", y="hashtag", orientation="h",
-                    title="Top 15 Giảm View",
+                    title=f"Top {TOPN} Giảm View",
                     labels={"view_delta": "Thay đổi Lượt xem (DoD)", "hashtag": "Hashtag"},
                     hover_data=["industry", "rank", "rank_velocity"]
                 )
@@ -424,10 +899,15 @@ with tabs[1]:
     else:
         st.info("Không có dữ liệu Momentum cho ngày mới nhất.")
         
-    show_data_expander(mom, "Xem toàn bộ dữ liệu Momentum")
+    show_data_expander(mom_top, "Xem dữ liệu Momentum (top theo từng panel)")
+    if st.checkbox("Tải toàn bộ lịch sử Momentum theo filter", key="mom_history"):
+        mom = load_momentum_history()
+        show_data_expander(mom, "Xem toàn bộ dữ liệu Momentum")
+        file_download(mom, "momentum.csv")
 
 # ===== ⚡ 3. Chiến lược Trend Nhanh =====
-with tabs[2]:
+def render_short_term():
+    df_ret, df_new = load_retention(), load_new_entries()
     st.subheader("⚡ 3. Chiến lược Trend Nhanh (Short-term)")
     st.markdown("Chức năng: Hiểu tốc độ của trend. Hầu hết trend 'sống' bao lâu và mỗi ngày có bao nhiêu trend mới?")
     
@@ -441,7 +921,7 @@ with tabs[2]:
                 df_life, x="streak_days",
                 title="Phân bổ Vòng đời Xu hướng",
                 labels={"streak_days": "Số ngày liên tục (Streak)", "count": "Số lượng chuỗi (Count)"},
-                nbins=max(20, int(df_life["streak_days"].max())) 
+                nbins=max(20, as_int(df_life["streak_days"].max()))
             )
             plot_stretch(fig_life)
         elif px is None:
@@ -457,10 +937,11 @@ with tabs[2]:
         else:
             st.info("Không có dữ liệu Hashtag mới.")
 
-    show_data_expander(df_new.merge(df_ret, how='cross'), "Xem dữ liệu (Kết hợp)")
+    show_data_pages(combine_new_entries(df_ret, df_new), "Xem dữ liệu (Kết hợp: chuỗi + số hashtag mới ngày bắt đầu)")
 
 # ===== 🌳 4. Chiến lược Bền vững =====
-with tabs[3]:
+def render_long_term():
+    df_ret = load_retention()
     st.subheader("🌳 4. Chiến lược Bền vững (Long-term)")
     st.markdown("Chức năng: Tìm các chủ đề/hashtag 'evergreen' để xây dựng nội dung kênh dài hạn.")
 
@@ -494,59 +975,31 @@ with tabs[3]:
             st.info("Không có dữ liệu Retention.")
             
     show_data_expander(df_ret, "Xem dữ liệu Retention chi tiết")
-    csv_download(df_ret, "retention.csv")
+    file_download(df_ret, "retention.csv")
 
 # ===== 📊 5. Phân tích Bão hòa Ngành =====
-with tabs[4]:
+def render_industry():
     st.subheader("📊 5. Phân tích Bão hòa & Hiệu quả Ngành")
     st.markdown("Chức năng: Ngành nào đang có nhiều 'Thị phần' (Views) và ngành nào 'Hiệu quả' (dễ có view) nhất?")
     
-    mx = run_sql_safe("SELECT MAX(DATE(dt)) AS mx FROM silver.silver_trend")
-    latest = mx.iloc[0]["mx"] if not mx.empty else None
+    latest = META["latest_d"]
     
     if latest:
+        industry_base = load_industry_latest()
         col1, col2 = st.columns(2)
         
         with col1:
             st.markdown(f"#### Cơ cấu Thị phần (Views) - Ngày {latest}")
-            extra = ""
-            if COUNTRIES and COUNTRIES != ["ALL"]:
-                extra += f" AND country_code IN ({_in_list_sql([c for c in COUNTRIES if c!='ALL'])})"
-            if KEYWORD:
-                kw = str(KEYWORD).lower().replace("'", "''")
-                extra += f" AND LOWER(COALESCE(hashtag_raw, hashtag)) LIKE '%{kw}%'"
-            sql_ind = f"""
-            SELECT industry, SUM(view_count) AS total_views
-            FROM silver.silver_trend
-            WHERE DATE(dt)=DATE('{latest}') AND industry IS NOT NULL
-            {extra}
-            GROUP BY industry ORDER BY total_views DESC LIMIT 12
-            """
-            df_ind = run_sql_safe(sql_ind)
+            df_ind = top_industry_share(industry_base, 12)
             if not df_ind.empty and px is not None:
-                fig3 = px.pie(df_ind, names="industry", values="total_views", title=f"Cơ cấu view theo ngành")
+                fig3 = px.pie(df_ind, names="industry", values="total_views", title="Cơ cấu view theo ngành")
                 plot_stretch(fig3)
             else:
                 st.info("Không có dữ liệu cơ cấu ngành.")
 
         with col2:
             st.markdown(f"#### Hiệu quả Ngành (Views / Video) - Ngày {latest}")
-            sql_eff = f"""
-                SELECT 
-                    industry, 
-                    SUM(view_count) AS total_views, 
-                    SUM(video_count) AS total_videos,
-                    SUM(view_count) / NULLIF(SUM(video_count), 0) AS view_per_video
-                FROM silver.silver_trend
-                WHERE DATE(dt)=DATE('{latest}') 
-                  AND industry IS NOT NULL 
-                  AND video_count > 0
-                {extra}  
-                GROUP BY industry 
-                ORDER BY view_per_video DESC
-                LIMIT 15
-            """
-            df_eff = run_sql_safe(sql_eff)
+            df_eff = top_industry_efficiency(industry_base, 15)
             if not df_eff.empty and px is not None:
                 fig_eff = px.bar(
                     df_eff, x="view_per_video", y="industry", orientation="h",
@@ -571,7 +1024,7 @@ with tabs[4]:
         st.info("Không có dữ liệu cho ngày mới nhất.")
 
 # ===== 🌍 6. Phân tích Thị trường QG =====
-with tabs[5]:
+def render_country():
     st.subheader("🌍 6. Phân tích Thị trường Quốc gia")
     st.markdown("Chức năng: Xem tổng quan thị trường theo quốc gia. Thị trường nào đang phát triển nhanh nhất?")
 
@@ -585,47 +1038,27 @@ with tabs[5]:
             {build_where(dt_col='dt', country_col='country_code', industry_col=None, hashtag_expr=None)}
             ORDER BY dt, country_code
         """
-        df_ct = run_sql_safe(sql_country)
+        df_ct = run_sql_subset(sql_country, COUNTRY_DAY_COLS)
 
     if df_ct.empty:
-        sql_country_fb = f"""
-        SELECT DATE(dt) dt, country_code, SUM(view_count) AS total_views
-        FROM silver.silver_trend
-        {build_where(dt_col='dt', country_col='country_code', industry_col=None,
-                     hashtag_expr='COALESCE(hashtag_raw, hashtag)')}
-        GROUP BY 1,2 ORDER BY 1,2
-        """
-        df_ct = run_sql_safe(sql_country_fb)
+        df_ct = run_sql_subset(SQL_COUNTRY_VIEWS, COUNTRY_DAY_COLS)
 
     if not df_ct.empty and px is not None:
         fig_ct = px.area(df_ct, x="dt", y="total_views", color="country_code", title="Tổng view theo quốc gia (stacked)")
         plot_stretch(fig_ct)
     show_data_expander(df_ct, "Xem dữ liệu View theo Quốc gia")
-    csv_download(df_ct, "views_by_country.csv")
+    file_download(df_ct, "views_by_country.csv")
 
 # ===== 🏆 7. Top 100 Đã Kiểm chứng =====
-with tabs[6]:
+def render_top100():
     st.subheader("🏆 7. Top 100 Đã Kiểm chứng (Proven Winners)")
     st.markdown("Chức năng: Danh sách 100 hashtag hàng đầu đã được chứng minh hiệu quả."
                 " Dùng cho các chiến dịch cần sự an toàn, đã kiểm chứng (proven winners).")
     
-    df_top100 = run_sql_safe(f"""
-        WITH mx AS (SELECT MAX(dt) AS mx FROM silver.silver_trend)
-        SELECT
-          t.dt, t.hashtag, t.rank, t.view_count, t.video_count,
-          t.country_code, t.industry, t.category,
-          t.hashtag_raw, t.url
-        FROM gold.trend_latest_top100 t
-        JOIN mx ON t.dt = mx.mx
-        {build_where(dt_col='t.dt', country_col='t.country_code', industry_col='t.industry',
-                     hashtag_expr='COALESCE(t.hashtag_raw, t.hashtag)')}
-        ORDER BY COALESCE(t.rank, 999) ASC
-        LIMIT 100
-    """)
-    df_top100 = uniquify_columns(dedup_cols(df_top100))
+    df_top100 = load_top100()
     
     if not df_top100.empty and px is not None:
-        topn_val = min(20, len(df_top100))
+        topn_val = min(TOPN, len(df_top100))
         fig_top100_bar = px.bar(
             df_top100.head(topn_val),
             x="view_count", y="hashtag",
@@ -638,74 +1071,15 @@ with tabs[6]:
         plot_stretch(fig_top100_bar)
     
     show_data_expander(df_top100, "Xem dữ liệu Top 100 Mới nhất")
-    csv_download(df_top100, "latest_top100.csv")
+    file_download(df_top100, "latest_top100.csv")
 
 # ===== 📅 8. Lập kế hoạch Tuần =====
-with tabs[7]:
+def render_weekly():
     st.subheader("📅 8. Lập kế hoạch theo Tuần (Weekly Planner)")
     st.markdown("Chức năng: Xem xu hướng thứ hạng trung bình của hashtag theo tuần. "
                 "Dùng để lập kế hoạch nội dung hàng tuần.")
     
-    # SQL Builder riêng cho Weekly (vì dt_col là 'week')
-    where_parts: List[str] = []
-    if START_DATE and END_DATE:
-        where_parts.append(
-            "DATE(w.week) BETWEEN DATE(DATE_TRUNC('week', DATE('{s}'))) AND DATE(DATE_TRUNC('week', DATE('{e}')))"
-            .format(s=START_DATE, e=END_DATE)
-        )
-    if COUNTRIES and COUNTRIES != ["ALL"]:
-        where_parts.append(f"b.country_code IN ({_in_list_sql([c for c in COUNTRIES if c!='ALL'])})")
-    if INDUSTRIES and INDUSTRIES != ["ALL"]:
-        where_parts.append(f"b.industry IN ({_in_list_sql([i for i in INDUSTRIES if i!='ALL'])})")
-    if KEYWORD:
-        kw = str(KEYWORD).lower().replace("'", "''")
-        where_parts.append("LOWER(COALESCE(b.hashtag_raw, w.hashtag)) LIKE '%" + kw + "%'")
-    weekly_where = (" WHERE " + " AND ".join(where_parts)) if where_parts else ""
-
-    sql_week = f"""
-      WITH b AS (
-        SELECT DISTINCT DATE(dt) dt, hashtag, country_code, industry, hashtag_raw
-        FROM silver.silver_trend
-      )
-      SELECT w.week, w.hashtag, w.best_rank, w.avg_rank, w.new_days_count, w.max_views,
-             b.country_code, b.industry, b.hashtag_raw
-      FROM gold.trend_weekly_summary w
-      LEFT JOIN b ON w.hashtag = b.hashtag
-      {weekly_where}
-      ORDER BY w.week DESC, COALESCE(w.best_rank, 999) ASC
-    """
-    dfw = run_sql_safe(sql_week)
-    if dfw.empty:
-        sql_fb = f"""
-          WITH base AS (
-            SELECT DATE(dt) dt, hashtag, COALESCE(rank,999) rank, view_count
-            FROM silver.silver_trend
-          ),
-          best AS (
-            SELECT * FROM (
-              SELECT base.*, ROW_NUMBER() OVER (PARTITION BY dt, hashtag ORDER BY rank, view_count DESC) rn
-              FROM base
-            ) x WHERE rn=1
-          ),
-          w AS (
-            SELECT DATE_TRUNC('week', dt) AS week, hashtag,
-                   MIN(rank) AS best_rank, AVG(rank) AS avg_rank,
-                   COUNT(*) AS new_days_count, MAX(view_count) AS max_views
-            FROM best GROUP BY 1,2
-          ),
-          b AS (
-            SELECT DISTINCT DATE(dt) dt, hashtag, country_code, industry, hashtag_raw
-            FROM silver.silver_trend
-          )
-          SELECT w.week, w.hashtag, w.best_rank, w.avg_rank, w.new_days_count, w.max_views,
-                 b.country_code, b.industry, b.hashtag_raw
-          FROM w LEFT JOIN b ON w.hashtag=b.hashtag
-          {weekly_where}
-          ORDER BY w.week DESC, COALESCE(w.best_rank,999) ASC
-        """
-        dfw = run_sql_safe(sql_fb)
-
-    dfw = uniquify_columns(dedup_cols(dfw))
+    dfw = load_weekly()
     
     if not dfw.empty and px is not None and "hashtag" in dfw.columns and "avg_rank" in dfw.columns:
         top_tags = dfw.sort_values(["best_rank"]).dropna(subset=["best_rank"]).head(5)["hashtag"].unique().tolist()
@@ -722,10 +1096,10 @@ with tabs[7]:
             plot_stretch(fig)
             
     show_data_expander(dfw, "Xem dữ liệu Weekly Summary chi tiết")
-    csv_download(dfw, "weekly_summary.csv")
+    file_download(dfw, "weekly_summary.csv")
 
 # ===== 🤖 9. AI Phân tích Kênh =====
-with tabs[8]:  # Index 8 cho tab thứ 9
+def render_ai():
     import datetime as _dt
 
     st.subheader("🤖 9. AI Phân tích Kênh & Gợi ý Kịch bản (No URL, No Mock)")
@@ -752,11 +1126,16 @@ with tabs[8]:  # Index 8 cho tab thứ 9
         """)
 
     # ---------------- 1) Output options ----------------
-    col_lang, col_num = st.columns([1, 1])
+    col_lang, col_num, col_budget = st.columns([1, 1, 1])
     with col_lang:
         out_lang = st.selectbox("Ngôn ngữ đầu ra", ["Tiếng Việt", "English"], index=0)
     with col_num:
         idea_count = st.number_input("Số ý tưởng", min_value=1, max_value=10, value=3, step=1)
+    with col_budget:
+        ctx_budget = st.number_input(
+            "Ngân sách token cho context", min_value=300, max_value=20000, value=2000, step=100,
+            help="Context dữ liệu được gộp hashtag trùng, ghi dạng CSV và cắt dòng ít quan trọng cho vừa ngân sách.",
+        )
 
     # ---------------- 2) Prompt Builder ----------------
     st.markdown("### 🛠️ Prompt Builder")
@@ -802,18 +1181,21 @@ with tabs[8]:  # Index 8 cho tab thứ 9
         words = re.findall(r"[a-z0-9_]{3,}", txt)              # keyword ASCII
         return _dedup_ci_keep_order(tags + words)
 
-    # ---------------- 3) Gom nhóm hashtag từ data đã load ----------------
+    # ---------------- 3) Gom nhóm hashtag từ data của các tab ----------------
+    mom_top, _ = load_momentum()
+    df_ret, df_opp, df_top100, dfw = load_retention(), load_opportunity(), load_top100(), load_weekly()
+
     # Hot (Momentum)
     hot_hashtags = []
-    if 'mom_latest' in locals() and mom_latest is not None and not mom_latest.empty:
+    if not mom_top.empty:
         hot_hashtags = (
-            mom_latest.sort_values("view_delta", ascending=False)
+            momentum_panel(mom_top, "rn_rising", AI_MOMENTUM_POOL["rn_rising"])
             .dropna(subset=["hashtag"]).head(50)["hashtag"].astype(str).tolist()
         )
 
     # Evergreen (Retention)
     evergreen_hashtags = []
-    if 'df_ret' in locals() and df_ret is not None and not df_ret.empty:
+    if not df_ret.empty:
         evergreen_hashtags = (
             df_ret.sort_values("streak_days", ascending=False)
             .dropna(subset=["hashtag"]).head(50)["hashtag"].astype(str).tolist()
@@ -821,7 +1203,7 @@ with tabs[8]:  # Index 8 cho tab thứ 9
 
     # Opportunity (view/video cao)
     opportunity_hashtags = []
-    if 'df_opp' in locals() and df_opp is not None and not df_opp.empty:
+    if not df_opp.empty:
         tmp = df_opp.copy()
         if all(c in tmp.columns for c in ["view_count", "video_count"]):
             tmp["vv"] = pd.to_numeric(tmp["view_count"], errors="coerce") / pd.to_numeric(tmp["video_count"], errors="coerce").replace(0, pd.NA)
@@ -830,12 +1212,12 @@ with tabs[8]:  # Index 8 cho tab thứ 9
 
     # Proven winners (Top100)
     proven_hashtags = []
-    if 'df_top100' in locals() and df_top100 is not None and not df_top100.empty:
+    if not df_top100.empty:
         proven_hashtags = df_top100["hashtag"].dropna().astype(str).head(100).tolist()
 
     # Weekly top (best_rank tốt)
     weekly_hashtags = []
-    if 'dfw' in locals() and dfw is not None and not dfw.empty:
+    if not dfw.empty:
         weekly_hashtags = (
             dfw.sort_values(["week", "best_rank"])
             .dropna(subset=["hashtag", "best_rank"]).head(100)["hashtag"].astype(str).tolist()
@@ -862,9 +1244,9 @@ with tabs[8]:  # Index 8 cho tab thứ 9
 
     # Tránh: các tag đang giảm (fading) + không liên quan prompt
     avoid_auto = []
-    if 'mom_latest' in locals() and mom_latest is not None and not mom_latest.empty:
+    if not mom_top.empty:
         fading = (
-            mom_latest.sort_values("view_delta", ascending=True)
+            momentum_panel(mom_top, "rn_fading", AI_MOMENTUM_POOL["rn_fading"])
             .dropna(subset=["hashtag"]).head(30)["hashtag"].astype(str).tolist()
         )
         avoid_auto = _dedup_ci_keep_order([t for t in fading if not _matches_prompt(t)])[:20]
@@ -877,8 +1259,8 @@ with tabs[8]:  # Index 8 cho tab thứ 9
 
     # ---------------- 5) Tạo context tổng hợp (ép ngày -> chuỗi) ----------------
     trend_hot_df = pd.DataFrame()
-    if 'mom_latest' in locals() and mom_latest is not None and not mom_latest.empty:
-        trend_hot_df = mom_latest.sort_values("view_delta", ascending=False).head(10)[
+    if not mom_top.empty:
+        trend_hot_df = momentum_panel(mom_top, "rn_rising").head(10)[
             ["hashtag", "industry", "view_delta"]
         ].copy()
 
@@ -887,46 +1269,12 @@ with tabs[8]:  # Index 8 cho tab thứ 9
     industry_eff = pd.DataFrame()
     country_views = pd.DataFrame()
 
-    mx2 = run_sql_safe("SELECT MAX(DATE(dt)) AS mx FROM silver.silver_trend")
-    latest2 = mx2.iloc[0]["mx"] if not mx2.empty else None
+    latest2 = META["latest_d"]
     if latest2:
-        extra2 = ""
-        if COUNTRIES and COUNTRIES != ["ALL"]:
-            extra2 += f" AND country_code IN ({_in_list_sql([c for c in COUNTRIES if c!='ALL'])})"
-        if KEYWORD:
-            kw2 = str(KEYWORD).lower().replace("'", "''")
-            extra2 += f" AND LOWER(COALESCE(hashtag_raw, hashtag)) LIKE '%{kw2}%'"
-
-        industry_share = run_sql_safe(f"""
-            SELECT industry, SUM(view_count) AS total_views
-            FROM silver.silver_trend
-            WHERE DATE(dt)=DATE('{latest2}') AND industry IS NOT NULL
-            {extra2}
-            GROUP BY industry
-            ORDER BY total_views DESC
-            LIMIT 12
-        """)
-        industry_eff = run_sql_safe(f"""
-            SELECT 
-                industry, 
-                SUM(view_count) AS total_views, 
-                SUM(video_count) AS total_videos,
-                SUM(view_count) / NULLIF(SUM(video_count), 0) AS view_per_video
-            FROM silver.silver_trend
-            WHERE DATE(dt)=DATE('{latest2}') AND industry IS NOT NULL AND video_count > 0
-            {extra2}
-            GROUP BY industry
-            ORDER BY view_per_video DESC
-            LIMIT 15
-        """)
-        country_views = run_sql_safe(f"""
-            SELECT DATE(dt) dt, country_code, SUM(view_count) AS total_views
-            FROM silver.silver_trend
-            {build_where(dt_col='dt', country_col='country_code', industry_col=None,
-                         hashtag_expr='COALESCE(hashtag_raw, hashtag)')}
-            GROUP BY 1,2
-            ORDER BY 1,2
-        """)
+        industry_base2 = load_industry_latest()
+        industry_share = top_industry_share(industry_base2, 12)
+        industry_eff = top_industry_efficiency(industry_base2, 15)
+        country_views = load_country_views().copy()
         if not country_views.empty and "dt" in country_views.columns:
             country_views["dt"] = country_views["dt"].astype(str)  # tránh lỗi JSON date
 
@@ -957,14 +1305,14 @@ with tabs[8]:  # Index 8 cho tab thứ 9
             "evergreen_top20": (
                 df_ret.sort_values("streak_days", ascending=False)
                 .head(20)[["hashtag", "streak_days"]].to_dict("records")
-                if ('df_ret' in locals() and df_ret is not None and not df_ret.empty) else []
+                if (not df_ret.empty) else []
             ),
             "opportunity_top20": (
                 pd.DataFrame({"hashtag": opportunity_hashtags[:20]}).to_dict("records")
             ),
             "proven_top100": (
                 df_top100.head(100)[["hashtag", "rank", "view_count", "video_count"]].to_dict("records")
-                if ('df_top100' in locals() and df_top100 is not None and not df_top100.empty) else []
+                if (not df_top100.empty) else []
             ),
             "weekly_top": weekly_hashtags[:30]
         },
@@ -977,6 +1325,8 @@ with tabs[8]:  # Index 8 cho tab thứ 9
 
     def _json_default(o):
         # Chuyển mọi kiểu không serializable sang chuỗi an toàn
+        if o is pd.NA or o is pd.NaT:
+            return None
         if isinstance(o, (_dt.date, _dt.datetime)):
             return o.isoformat()
         try:
@@ -992,7 +1342,7 @@ with tabs[8]:  # Index 8 cho tab thứ 9
         return str(o)
 
     system_prompt = (
-        "Bạn là chiến lược gia TikTok. Hãy đọc kỹ JSON context (dữ liệu trend & cấu hình Prompt Builder) "
+        "Bạn là chiến lược gia TikTok. Hãy đọc kỹ context (dữ liệu trend dạng bảng CSV & cấu hình Prompt Builder) "
         "để đề xuất ý tưởng & kịch bản có tính hành động cao. "
         "Luôn gợi ý hashtag kết hợp giữa niche + trend, và nêu rõ vì sao lựa chọn đó phù hợp."
     )
@@ -1009,11 +1359,18 @@ with tabs[8]:  # Index 8 cho tab thứ 9
 - Ngôn ngữ đầu ra: {out_lang}
 """
 
-    context_json_str = json.dumps(context_payload, ensure_ascii=False, default=_json_default)
+    # Context gửi AI: bản gọn theo ngân sách token (bản JSON đầy đủ vẫn tải được ở nút bên dưới)
+    context_text, ctx_stats = compile_context(
+        json.loads(json.dumps(context_payload, ensure_ascii=False, default=_json_default)), int(ctx_budget)
+    )
+    st.caption(
+        f"🧮 Context ~{ctx_stats['tokens']:,} token (JSON đầy đủ ~{ctx_stats['raw_tokens']:,}) · "
+        f"giữ {ctx_stats['rows_kept']}/{ctx_stats['rows_total']} dòng, gộp {ctx_stats['duplicates']} hashtag trùng"
+    )
 
     final_user_prompt = f"""
-[Context JSON]
-{context_json_str}
+[Context]
+{context_text}
 
 [User Prompt]
 {builder_prompt}
@@ -1047,8 +1404,13 @@ Trình bày ngắn gọn, rõ ràng, có bullet.
         mime="application/json"
     )
 
-    # ---------------- 6) Gọi Gemini API qua requests ----------------
-    run_ai = st.button("🚀 Phân tích & Gợi ý bằng AI")
+    # ---------------- 6) Gọi Gemini API (stream SSE, hiện dần từng đoạn) ----------------
+    # Phản hồi được cache theo (model, system prompt, context, Builder, generation config, version dữ liệu):
+    # bấm lại với cùng filter + Builder khi dữ liệu chưa đổi -> trả ngay, không gọi API.
+    gen_config = {"temperature": 0.7, "topP": 0.95}
+    c_ai1, c_ai2 = st.columns([3, 2])
+    run_ai = c_ai1.button("🚀 Phân tích & Gợi ý bằng AI")
+    bypass_ai_cache = c_ai2.checkbox("Bỏ qua cache (gọi AI mới)", value=False)
     if run_ai:
         try:
             apiKey = None
@@ -1059,38 +1421,65 @@ Trình bày ngắn gọn, rõ ràng, có bullet.
                 st.error("Lỗi cấu hình: Không tìm thấy API Key Gemini hoặc key không hợp lệ.")
                 st.info("Kiểm tra `.streamlit/secrets.toml`:\n\n[gemini]\napi_key = \"AIza...\"")
             else:
-                MODEL_ID = "gemini-2.5-flash-preview-09-2025"
-                apiUrl = f"https://generativelanguage.googleapis.com/v1beta/models/{MODEL_ID}:generateContent?key={apiKey}"
-
-                payload = {
-                    "contents": [{"parts": [{"text": final_user_prompt}]}],
-                    "systemInstruction": {"parts": [{"text": system_prompt}]},
-                    "generationConfig": {"temperature": 0.7, "topP": 0.95}
-                }
-                headers = {'Content-Type': 'application/json'}
-
-                with st.spinner("Đang gọi AI…"):
-                    response = requests.post(apiUrl, headers=headers, json=payload, timeout=90)
-
-                if response.status_code == 200:
-                    result = response.json()
-                    text_response = "Không thể lấy được phản hồi từ AI."
-                    candidates = result.get("candidates")
-                    if candidates and len(candidates) > 0:
-                        content = candidates[0].get("content")
-                        if content and 'parts' in content and len(content['parts']) > 0:
-                            text_response = content['parts'][0].get('text', text_response)
-
-                    st.markdown("### 📤 Kết quả từ AI")
-                    st.markdown(text_response)
+                gemini_cfg = st.secrets["gemini"]
+                model_id = gemini_cfg.get("model", GEMINI_MODEL)
+                ai_cache = get_ai_cache()
+                key = ai_cache_key(
+                    model_id, system_prompt, {"context": context_text},
+                    context_payload["prompt_builder"], gen_config,
+                    data_versions(" ".join(DATASETS[n][0] for n in TAB_DATASETS[TAB_LABELS[8]])),
+                )
+                cached = None
+                if not bypass_ai_cache:
+                    try:
+                        raw = ai_cache.get(key)
+                        cached = json.loads(raw) if raw else None
+                    except Exception:
+                        cached = None  # cache lỗi (Redis mất kết nối, ...) -> gọi API như bình thường
+
+                st.markdown("### 📤 Kết quả từ AI")
+                if cached:
+                    st.markdown(cached["text"])
+                    st.caption(
+                        f"⚡ Lấy từ cache (tạo lúc {cached.get('created_at', '?')}, "
+                        f"lần gọi gốc mất {cached.get('latency', 0):.1f}s) · tick **Bỏ qua cache** để gọi AI mới"
+                    )
                 else:
-                    st.error(f"Lỗi khi gọi AI: {response.status_code} - {response.text}")
+                    payload = {
+                        "contents": [{"parts": [{"text": final_user_prompt}]}],
+                        "systemInstruction": {"parts": [{"text": system_prompt}]},
+                        "generationConfig": gen_config
+                    }
+                    stream = GeminiStream(
+                        apiKey,
+                        payload,
+                        model=model_id,
+                        base_url=gemini_cfg.get("base_url", GEMINI_BASE_URL),
+                    )
+                    st.write_stream(stream)
+                    if not stream.text:
+                        st.warning("Không thể lấy được phản hồi từ AI.")
+                    else:
+                        st.caption(
+                            f"⏱️ Đoạn text đầu tiên sau {stream.ttft:.2f}s · "
+                            f"hoàn tất sau {stream.latency:.2f}s ({stream.chunks} đoạn)"
+                        )
+                        try:
+                            ai_cache.put(key, json.dumps({
+                                "text": stream.text,
+                                "model": model_id,
+                                "created_at": _dt.datetime.now().strftime("%Y-%m-%d %H:%M"),
+                                "latency": stream.latency,
+                            }, ensure_ascii=False).encode("utf-8"))
+                        except Exception:
+                            pass
+        except GeminiError as e:
+            st.error(f"Lỗi khi gọi AI: {e}")
         except Exception as e:
             st.error(f"Lỗi trong quá trình gọi AI: {e}")
 
 # ===== 📣 10. Phân tích Promote =====
-# ===== 📣 10. Phân tích Promote =====
-with tabs[9]:
+def render_promote():
     st.subheader("📣 10. Phân tích Promote (Quảng bá trả phí)")
     st.markdown(
         "Chức năng: Đo **tỷ lệ hashtag được TikTok đánh dấu là promoted/ads** theo thời gian và theo quốc gia "
@@ -1144,9 +1533,23 @@ with tabs[9]:
             """
 
         if sql_prom:
-            df_prom = run_sql_safe(sql_prom)
+            df_prom = run_sql_safe(sql_prom, FILTER_PARAMS)
 
     # 2) Fallback: tính trực tiếp từ Silver nếu Gold không có / rỗng
+    if df_prom.empty and USE_CUBE:
+        sql_prom_fb = f"""
+        SELECT
+          dt,
+          country_code,
+          CAST(SUM(row_cnt) AS BIGINT) AS hashtag_cnt,
+          CAST(SUM(promoted_cnt) AS BIGINT) AS promoted_cnt,
+          SUM(promoted_cnt) / NULLIF(SUM(row_cnt), 0) AS promoted_share
+        FROM gold.trend_daily_cube
+        {build_where(dt_col='dt', country_col='country_code', industry_col=None, hashtag_expr=None)}
+        GROUP BY dt, country_code
+        ORDER BY dt, country_code
+        """
+        df_prom = run_sql_safe(sql_prom_fb, FILTER_PARAMS)
     if df_prom.empty:
         sql_prom_fb = f"""
         SELECT
@@ -1161,7 +1564,7 @@ with tabs[9]:
         GROUP BY DATE(dt), country_code
         ORDER BY dt, country_code
         """
-        df_prom = run_sql_safe(sql_prom_fb)
+        df_prom = run_sql_safe(sql_prom_fb, FILTER_PARAMS)
 
     df_prom = dedup_cols(df_prom)
     df_prom = uniquify_columns(df_prom)
@@ -1199,7 +1602,6 @@ with tabs[9]:
             global_share = total_promoted / total_hashtags
 
         latest_dt = df_prom["dt"].max() if "dt" in df_prom.columns else None
-        from datetime import timedelta
 
         last7_share = None
         df_last7 = pd.DataFrame()
@@ -1346,8 +1748,46 @@ with tabs[9]:
             st.write("\n".join(lines))
 
         show_data_expander(df_prom, "Xem dữ liệu Promote chi tiết")
-        csv_download(df_prom, "promoted_share_by_country.csv")
-
+        file_download(df_prom, "promoted_share_by_country.csv")
+
+
+TAB_RENDERERS = dict(zip(TAB_LABELS, [
+    render_niche, render_momentum, render_short_term, render_long_term, render_industry,
+    render_country, render_top100, render_weekly, render_ai, render_promote,
+]))
+
+# Chỉ chạy tab đang chọn (hoặc tất cả nếu bật chế độ so sánh); ghi lại số query / thời gian của từng tab.
+tab_stats = st.session_state.setdefault("tab_stats", {})
+for i, label in enumerate(TAB_LABELS if RENDER_ALL else [ACTIVE_TAB]):
+    if i:
+        st.divider()
+    t0, (n0, _) = time.perf_counter(), query_stats()
+    TAB_RENDERERS[label]()
+    tab_stats[label] = (query_stats()[0] - n0, time.perf_counter() - t0)
+
+# ---- Hiệu năng lượt chạy ----
+with st.sidebar.expander("⏱️ Hiệu năng lượt chạy"):
+    run_n, run_q_sec = (x - y for x, y in zip(query_stats(), RUN_STATS0))
+    st.caption(f"Lượt này: {run_n} query ({run_q_sec:.2f}s chạy query), tổng {time.perf_counter() - RUN_T0:.2f}s.")
+    st.caption("Query cache hit (bộ nhớ / subset / cache bền vững) không được tính.")
+    if tab_stats:
+        st.dataframe(
+            pd.DataFrame(
+                [(label, n, round(sec, 2)) for label, (n, sec) in tab_stats.items()],
+                columns=["Tab", "Query (lần gần nhất)", "Giây"],
+            ),
+            hide_index=True,
+        )
+    fp_rows = fingerprint_stats()
+    if fp_rows:
+        fp_df = pd.DataFrame(fp_rows)
+        lookups, hits = int(fp_df["lookups"].sum()), int(fp_df["hits"].sum())
+        st.caption(
+            f"Fingerprint (từ lúc khởi động): {int(fp_df['variants'].sum())} chuỗi SQL → {len(fp_df)} query chuẩn hoá; "
+            f"trúng cache {hits}/{lookups} ({hits / max(lookups, 1):.0%}), "
+            f"trong đó {int(fp_df['canonical_hits'].sum())} lượt nhờ chuẩn hoá SQL."
+        )
+        st.dataframe(fp_df.head(20), hide_index=True)
 
 # ---- Gợi ý cài plotly nếu thiếu ----
 if px is None:
@@ -0,0 +1,125 @@
+# tests/bench_fetch.py
+# So sánh đường fetch kết quả: fetchall() + DataFrame (cách cũ) với Arrow (util.db._fetch_arrow).
+# Cursor giả giữ kết quả dạng Arrow IPC nén LZ4 như server trả về; mỗi lần fetch giải nén / giải mã
+# (như connector), fetchall() dựng thêm tuple từng dòng. Dữ liệu được ghi ra file 1 lần, mỗi chế độ
+# chạy trong 1 process riêng chỉ đọc file đó -> peak RSS của các chế độ đo độc lập.
+#   python tests/bench_fetch.py --rows 1000000
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+MODES = ["fetchall", "arrow", "arrow_batches"]
+
+
+def make_table(n: int) -> pa.Table:
+    """Bảng giống silver.silver_trend (ngày, hashtag, quốc gia, ngành, hạng, view, video, promoted)."""
+    idx = pa.array(range(n), pa.int64())
+    days = [date(2025, 1, 1) + timedelta(days=i % 90) for i in range(n)]
+    tags = [f"tag{i % 5000}" for i in range(n)]
+    return pa.table({
+        "dt": pa.array(days, pa.date32()),
+        "hashtag": tags,
+        "hashtag_raw": [t.upper() for t in tags],
+        "country_code": [("VN", "US", "ID", "TH")[i % 4] for i in range(n)],
+        "industry": [("Food", "Tech", "Beauty", "Travel", "Game")[i % 5] for i in range(n)],
+        "rank": pa.compute.add(pa.compute.divide(idx, 1000), 1),
+        "view_count": pa.compute.multiply(idx, 37),
+        "video_count": pa.compute.add(pa.compute.divide(idx, 7), 1),
+        "is_promoted": [i % 5 == 0 for i in range(n)],
+    })
+
+
+def write_payload(table: pa.Table, path: str) -> None:
+    with pa.OSFile(path, "wb") as sink:
+        with pa.ipc.new_stream(sink, table.schema, options=pa.ipc.IpcWriteOptions(compression="lz4")) as writer:
+            writer.write_table(table, max_chunksize=100_000)
+
+
+def _ipc_db(payload: bytes, arrow: bool):
+    """StubDB mà `table` được giải mã từ `payload` (IPC) ở lần đọc đầu, như connector nhận từ server."""
+    from stubs import StubDB
+    from util.result_cache import table_from_bytes
+
+    class IpcDB(StubDB):
+        @property
+        def table(self):
+            if self._decoded is None:
+                self._decoded = table_from_bytes(payload)
+            return self._decoded
+
+        @table.setter
+        def table(self, value):
+            self._decoded = None
+
+    return IpcDB(arrow=arrow)
+
+
+def _peak_mb() -> float:
+    # VmHWM (Linux) thay vì ru_maxrss: ru_maxrss giữ nguyên qua exec -> process con "thừa kế" peak của cha
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_mode(mode: str, path: str) -> dict:
+    from util.db import _fetch_arrow, arrow_to_pandas
+
+    db = _ipc_db(Path(path).read_bytes(), arrow=(mode != "fetchall"))
+    conn = db.connect()
+    before = _peak_mb()
+    t0 = time.perf_counter()
+    if mode == "fetchall":
+        with conn.cursor() as cur:
+            cur.execute("SELECT * FROM silver.silver_trend")
+            rows = cur.fetchall()
+            cols = [c[0] for c in cur.description]
+        df = pd.DataFrame.from_records(rows, columns=cols)
+    else:
+        table = _fetch_arrow(conn, "SELECT * FROM silver.silver_trend",
+                             batch_size=100_000 if mode == "arrow_batches" else None)
+        df = arrow_to_pandas(table)
+    seconds = time.perf_counter() - t0
+    return {"mode": mode, "rows": len(df), "seconds": round(seconds, 3),
+            "rows_per_sec": round(len(df) / seconds), "peak_rss_delta_mb": round(_peak_mb() - before, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--mode", choices=MODES)
+    parser.add_argument("--payload", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.mode:
+        print(json.dumps(run_mode(args.mode, args.payload)))
+        return
+    with tempfile.TemporaryDirectory() as tmp:
+        path = f"{tmp}/result.arrows"
+        write_payload(make_table(args.rows), path)
+        print(f"{args.rows:,} dòng; {'mode':<14}{'rows/s':>12}{'giây':>8}{'peak RSS +MB':>14}")
+        for mode in MODES:
+            out = subprocess.run([sys.executable, __file__, "--mode", mode, "--payload", path],
+                                 check=True, capture_output=True, text=True).stdout
+            r = json.loads(out.strip().splitlines()[-1])
+            print(f"{'':<{len(f'{args.rows:,} dòng; ')}}{r['mode']:<14}{r['rows_per_sec']:>12,}"
+                  f"{r['seconds']:>8}{r['peak_rss_delta_mb']:>14}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,14 @@
+# tests/conftest.py
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from stubs import StubDB  # noqa: E402
+
+
+@pytest.fixture
+def stub_db():
+    return StubDB()
@@ -0,0 +1,105 @@
+# tests/stubs.py
+# Stand-in DB-API dùng chung cho test / benchmark: đếm số lần connect() và ghi lại mọi câu lệnh đã chạy.
+import threading
+import time
+
+import pyarrow as pa
+
+
+class StubCursor:
+    """Cursor DB-API thuần (chỉ fetchall / description)."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.description = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def execute(self, query, params=None):
+        db = self.conn.db
+        db.statements.append((query, dict(params or {})))
+        if self.conn.broken:
+            raise db.error("session expired")
+        with db.lock:
+            db.active += 1
+            db.peak = max(db.peak, db.active)
+        try:
+            time.sleep(db.delays.get(query, 0))
+        finally:
+            with db.lock:
+                db.active -= 1
+        if query in db.failing:
+            raise db.error(f"query failed: {query}")
+        self.description = [(name, None, None, None, None, None, None) for name in db.table.column_names]
+
+    def fetchall(self):
+        self.conn.db.fetches.append("fetchall")
+        table = self.conn.db.table
+        return list(zip(*(table.column(c).to_pylist() for c in table.column_names)))
+
+    def close(self):
+        pass
+
+
+class StubArrowCursor(StubCursor):
+    """Như cursor của databricks-sql-connector: có thêm fetchall_arrow / fetchmany_arrow."""
+
+    def execute(self, query, params=None):
+        super().execute(query, params)
+        self._pos = 0
+
+    def fetchall_arrow(self):
+        self.conn.db.fetches.append("fetchall_arrow")
+        return self.conn.db.table
+
+    def fetchmany_arrow(self, size):
+        self.conn.db.fetches.append("fetchmany_arrow")
+        chunk = self.conn.db.table.slice(self._pos, size)
+        self._pos += chunk.num_rows
+        return chunk
+
+
+class StubConnection:
+    def __init__(self, db):
+        self.db = db
+        self.broken = db.break_new  # True -> mọi câu lệnh lỗi (session hết hạn)
+        self.closed = False
+
+    def cursor(self):
+        return (StubArrowCursor if self.db.arrow else StubCursor)(self)
+
+    def close(self):
+        self.closed = True
+
+
+class StubDB:
+    """
+    "Server" giả: connect() trả StubConnection, mọi câu lệnh trả `table`.
+    connects / statements / fetches để test đếm kết nối, câu lệnh và đường fetch đã dùng.
+    delays: {sql: giây chạy}, failing: các sql raise `error`; peak = số câu lệnh chạy đồng thời nhiều nhất.
+    """
+
+    def __init__(self, table: pa.Table | None = None, arrow: bool = True, error: type = RuntimeError):
+        self.table = table if table is not None else pa.table({"x": [1]})
+        self.arrow = arrow
+        self.error = error
+        self.break_new = False
+        self.connects = 0
+        self.connections: list = []
+        self.statements: list = []
+        self.fetches: list = []
+        self.delays: dict = {}
+        self.failing: set = set()
+        self.lock = threading.Lock()
+        self.active = 0
+        self.peak = 0
+
+    def connect(self):
+        self.connects += 1
+        conn = StubConnection(self)
+        self.connections.append(conn)
+        return conn
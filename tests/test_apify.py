@@ -0,0 +1,299 @@
+# tests/test_apify.py
+# Helper Apify của notebook (util/apify.py) với session giả: phân trang, tải tiếp sau khi ghi dở, giới hạn RPS;
+# vòng ingest Cell 2 với server Apify giả (http.server): mỗi run / dataset tải 1 lần, lỗi không được nhớ.
+import gzip
+import json
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+import requests
+
+from util.apify import ApifyClient, Once, RateLimiter, download_dataset, ingest_dates
+
+ROWS = [json.dumps({"id": i, "name": f"tag{i}"}) for i in range(5000)]
+
+
+class StubResponse:
+    def __init__(self, status_code=200, lines=(), headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.lines = list(lines)
+        self.text = "\n".join(self.lines)
+        self.encoding = None
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(str(self.status_code))
+
+    def iter_lines(self, decode_unicode=False):
+        return iter(self.lines)
+
+
+class StubSession:
+    """Trả dataset ROWS theo offset/limit; fail_at: offset mà request lỗi mạng (như rớt kết nối giữa chừng)."""
+
+    def __init__(self, rows=ROWS, fail_at=None, responses=()):
+        self.rows = rows
+        self.fail_at = fail_at
+        self.responses = list(responses)
+        self.calls = []
+
+    def request(self, method, url, params=None, json=None, timeout=None, stream=False):
+        self.calls.append((method, url, dict(params or {})))
+        if self.responses:
+            return self.responses.pop(0)
+        offset, limit = int(params["offset"]), int(params["limit"])
+        if offset == self.fail_at:
+            raise requests.ConnectionError("connection reset")
+        return StubResponse(lines=self.rows[offset:offset + limit])
+
+
+def _client(session, **kwargs):
+    return ApifyClient("tok", "https://api.test/v2/", session=session, **kwargs)
+
+
+def _offsets(session):
+    return [c[2]["offset"] for c in session.calls]
+
+
+def test_iter_pages_walks_offsets_until_short_page():
+    session = StubSession(rows=ROWS[:2500])
+    pages = list(_client(session, page_size=1000).iter_pages("ds1"))
+    assert [off for off, _ in pages] == [1000, 2000, 2500]
+    assert [ln for _, lines in pages for ln in lines] == ROWS[:2500]
+    assert _offsets(session) == [0, 1000, 2000]
+    method, url, params = session.calls[0]
+    assert (method, url) == ("GET", "https://api.test/v2/datasets/ds1/items")
+    assert params["token"] == "tok" and params["format"] == "jsonl" and params["limit"] == 1000
+
+
+def test_iter_pages_stops_on_empty_page():
+    session = StubSession(rows=ROWS[:2000])
+    pages = list(_client(session, page_size=1000).iter_pages("ds1", offset=1000))
+    assert [off for off, _ in pages] == [2000]
+    assert _offsets(session) == [1000, 2000]
+
+
+def test_retries_429_with_retry_after():
+    limited, ok = StubResponse(429, headers={"Retry-After": "0"}), StubResponse(lines=ROWS[:3])
+    session = StubSession(responses=[limited, ok])
+    assert _client(session).request("GET", "https://api.test/v2/x", raw_lines=True) == ROWS[:3]
+    assert len(session.calls) == 2
+    assert limited.closed  # response stream lỗi được đóng trước khi thử lại
+
+
+def test_failed_stream_closed_on_every_attempt():
+    errors = [StubResponse(503, headers={"Retry-After": "0"}) for _ in range(2)]
+    session = StubSession(responses=list(errors))
+    with pytest.raises(RuntimeError, match="after 2 attempts"):
+        _client(session, max_retries=2).request("GET", "https://api.test/v2/x", raw_lines=True)
+    assert all(r.closed for r in errors)
+
+
+def _read_parts(stage: Path, state: dict, compress: bool) -> list:
+    opener = gzip.open if compress else open
+    out = []
+    for name in state["parts"]:
+        with opener(stage / name, "rt", encoding="utf-8") as f:
+            out += f.read().splitlines()
+    return out
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_download_resumes_after_partial_write(tmp_path, compress):
+    stage = tmp_path / "ds=ds1"
+    # Lỗi ở trang offset 3000: part 0 (2000 dòng) đã đóng, part 1 đang ghi dở 1000 dòng
+    broken = StubSession(fail_at=3000)
+    with pytest.raises(RuntimeError):
+        download_dataset(_client(broken, page_size=1000, max_retries=1), "ds1", str(stage), "s", 2000, compress)
+    progress = json.loads((stage / "_PROGRESS").read_text())
+    assert progress["offset"] == 2000 and not progress["done"]
+    assert len(progress["parts"]) == 1
+
+    # Chạy lại: tải tiếp từ offset đã lưu, part dở được ghi lại từ đầu
+    session = StubSession()
+    state = download_dataset(_client(session, page_size=1000), "ds1", str(stage), "s", 2000, compress)
+    assert _offsets(session) == [2000, 3000, 4000, 5000]
+    ext = ".json.gz" if compress else ".json"
+    assert state["parts"] == [f"s.part-0000{i}{ext}" for i in range(3)]
+    assert state["offset"] == 5000 and state["done"]
+    assert _read_parts(stage, state, compress) == ROWS
+    assert not list(stage.glob("_*.tmp"))
+
+    # Đã xong -> không gọi API nữa
+    again = StubSession()
+    assert download_dataset(_client(again), "ds1", str(stage), "s", 2000, compress) == state
+    assert again.calls == []
+
+
+def test_rate_limiter_caps_requests_per_second():
+    rate = 20
+    session = StubSession(rows=ROWS[:10])
+    client = _client(session, limiter=RateLimiter(rate), page_size=1000)
+    stamps = []
+
+    def worker():
+        for _ in range(3):
+            client.request("GET", "https://api.test/v2/x", params={"offset": 0, "limit": 10}, raw_lines=True)
+            stamps.append(time.monotonic())
+
+    t0 = time.monotonic()
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    # 12 request chung 1 limiter: request đầu dùng token sẵn có, 11 request sau cách nhau >= 1/rate
+    assert len(session.calls) == 12
+    assert time.monotonic() - t0 >= 11 / rate * 0.9
+    stamps.sort()
+    assert all(b - a >= 1 / rate * 0.8 for a, b in zip(stamps, stamps[1:]))
+
+
+def test_rate_limiter_zero_means_unlimited():
+    limiter = RateLimiter(0)
+    t0 = time.monotonic()
+    for _ in range(1000):
+        limiter.acquire()
+    assert time.monotonic() - t0 < 0.5
+
+
+class ApifyHandler(BaseHTTPRequestHandler):
+    """
+    /v2/actor-tasks/<task>/runs và /v2/datasets/<id>/items (offset / limit, JSONL) như Apify.
+    server.fail_runs: số lần /runs tiếp theo trả 500; mọi request được đếm theo path.
+    """
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, body: bytes, ctype="application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        q = {k: v[0] for k, v in parse_qs(url.query).items()}
+        srv = self.server
+        with srv.lock:
+            srv.hits[url.path] += 1
+            fail = srv.fail_runs > 0 and url.path.endswith("/runs")
+            if fail:
+                srv.fail_runs -= 1
+        time.sleep(0.05)  # đủ lâu để các thread ingest hỏi cùng run / dataset trong lúc đang tải
+        if q.get("token") != "tok":
+            self._reply(401, b'{"error": "token"}')
+        elif fail:
+            self._reply(500, b'{"error": "internal"}')
+        elif url.path == "/v2/actor-tasks/me~task/runs":
+            items = [{"id": "r2", "status": "RUNNING", "defaultDatasetId": "ds2"},
+                     {"id": "r1", "status": "SUCCEEDED", "defaultDatasetId": "ds1"}]
+            self._reply(200, json.dumps({"data": {"items": items}}).encode())
+        elif url.path == "/v2/datasets/ds1/items":
+            offset, limit = int(q["offset"]), int(q["limit"])
+            lines = ROWS[offset:offset + limit]
+            self._reply(200, "".join(ln + "\n" for ln in lines).encode(), "application/jsonl")
+        else:
+            self._reply(404, b'{"error": "not found"}')
+
+
+@pytest.fixture
+def apify_server():
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), ApifyHandler)
+    srv.lock, srv.hits, srv.fail_runs = threading.Lock(), Counter(), 0
+    thread = threading.Thread(target=srv.serve_forever, daemon=True)
+    thread.start()
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+
+
+def _ingest(srv, tmp_path, dates, memo, **kwargs):
+    client = ApifyClient("tok", f"http://127.0.0.1:{srv.server_address[1]}/v2", page_size=2000, max_retries=1)
+    published = []
+
+    def download(ds_id, stem):
+        return download_dataset(client, ds_id, str(tmp_path / f"ds={ds_id}"), stem, 2500)
+
+    def publish(d, state, stem):
+        published.append((d, stem, state and state["parts"]))
+        return f"dt={d}"
+
+    return ingest_dates(client, "me~task", dates, download, publish, memo=memo, **kwargs), published
+
+
+DATES = [f"2025-01-0{i}" for i in range(1, 7)]
+
+
+def test_ingest_fetches_each_run_and_dataset_once(apify_server, tmp_path):
+    memo = Once()
+    results, published = _ingest(apify_server, tmp_path, DATES, memo, workers=6, run_label="L1")
+    assert [r["dt"] for r in results] == DATES
+    assert all(r["status"] == "SUCCEEDED(FETCHED)" and r["run_id"] == "r1" for r in results), results
+    assert {(r["count"], r["parts"]) for r in results} == {(5000, 2)}
+    # 6 dt song song nhưng /runs gọi 1 lần, dataset tải 1 lượt (3 trang 2000 dòng)
+    assert apify_server.hits == Counter({"/v2/actor-tasks/me~task/runs": 1, "/v2/datasets/ds1/items": 3})
+    stem = "task_me_task_run_r1_L1"
+    assert sorted(published) == [(d, stem, [f"{stem}.part-00000.json", f"{stem}.part-00001.json"])
+                                 for d in DATES]
+    assert set(memo.results()) == {("run", "me~task"), ("dataset", "ds1")}
+
+    # Cùng memo: lượt sau không gọi API nữa
+    _ingest(apify_server, tmp_path, DATES[:2], memo)
+    assert sum(apify_server.hits.values()) == 4
+
+
+def test_failed_run_does_not_poison_memo(apify_server, tmp_path):
+    memo = Once()
+    apify_server.fail_runs = 1
+    results, published = _ingest(apify_server, tmp_path, DATES, memo, workers=6)
+    # Các dt đang chờ cùng lúc nhận chung 1 lỗi -> /runs chỉ bị gọi 1 lần, không dt nào publish
+    assert all(r["status"] == "ERROR" and "500" in r["error"] for r in results)
+    assert apify_server.hits["/v2/actor-tasks/me~task/runs"] == 1
+    assert published == [] and memo.results() == {}
+
+    results, published = _ingest(apify_server, tmp_path, DATES, memo, workers=6)
+    assert all(r["status"] == "SUCCEEDED(FETCHED)" for r in results)
+    assert apify_server.hits["/v2/actor-tasks/me~task/runs"] == 2
+    assert apify_server.hits["/v2/datasets/ds1/items"] == 3
+    assert len(published) == len(DATES)
+
+
+def test_once_waiters_share_error_then_retry():
+    memo, calls, gate = Once(), [], threading.Event()
+
+    def boom():
+        calls.append(1)
+        gate.wait(1)
+        raise ValueError("down")
+
+    errors = []
+
+    def worker():
+        try:
+            memo("k", boom)
+        except ValueError as ex:
+            errors.append(ex)
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for t in threads:
+        t.start()
+    time.sleep(0.1)
+    gate.set()
+    for t in threads:
+        t.join()
+    assert len(calls) == 1 and len(errors) == 4
+    assert memo("k", lambda: 42) == 42
+    assert memo("k", boom) == 42 and len(calls) == 1
@@ -0,0 +1,77 @@
+# tests/test_db_fetch.py
+# _fetch_arrow: đi đường Arrow khi cursor hỗ trợ, fallback fetchall() cho cursor DB-API thuần cho cùng kết quả.
+from datetime import date
+
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+from stubs import StubDB
+from util.db import _fetch_arrow, arrow_to_pandas
+
+TABLE = pa.table({
+    "dt": pa.array([date(2025, 1, 1), date(2025, 1, 2), None], pa.date32()),
+    "hashtag": ["food", None, "travel"],
+    "view_count": pa.array([10, 20, None], pa.int64()),
+    "is_promoted": [True, False, None],
+})
+
+
+def test_uses_fetchall_arrow_when_available():
+    db = StubDB(TABLE)
+    table = _fetch_arrow(db.connect(), "SELECT * FROM silver.silver_trend")
+    assert db.fetches == ["fetchall_arrow"]
+    assert table.equals(TABLE)
+
+
+def test_batches_through_fetchmany_arrow():
+    db = StubDB(TABLE)
+    table = _fetch_arrow(db.connect(), "SELECT * FROM silver.silver_trend", batch_size=2)
+    assert set(db.fetches) == {"fetchmany_arrow"}
+    assert "fetchall" not in db.fetches
+    assert table.equals(TABLE)
+
+
+def test_params_bound_only_when_given():
+    db = StubDB(TABLE)
+    conn = db.connect()
+    _fetch_arrow(conn, "SELECT * FROM t WHERE dt = DATE(:d)", {"d": "2025-01-01"})
+    _fetch_arrow(conn, "SELECT * FROM t")
+    assert db.statements == [("SELECT * FROM t WHERE dt = DATE(:d)", {"d": "2025-01-01"}), ("SELECT * FROM t", {})]
+
+
+def test_fetchall_fallback_matches_arrow_path():
+    rows_db, arrow_db = StubDB(TABLE, arrow=False), StubDB(TABLE)
+    fallback = _fetch_arrow(rows_db.connect(), "SELECT * FROM silver.silver_trend")
+    arrow = _fetch_arrow(arrow_db.connect(), "SELECT * FROM silver.silver_trend")
+    assert rows_db.fetches == ["fetchall"]
+    # Fallback = đường fetchall() cũ (DataFrame.from_records), cùng giá trị với đường Arrow
+    rows = list(zip(*(TABLE.column(c).to_pylist() for c in TABLE.column_names)))
+    pd.testing.assert_frame_equal(fallback.to_pandas(), pd.DataFrame.from_records(rows, columns=TABLE.column_names))
+    assert fallback.column_names == arrow.column_names
+    assert fallback.to_pylist() == arrow.to_pylist()
+    df = arrow_to_pandas(arrow)
+    assert str(df["view_count"].dtype) == "int64[pyarrow]"
+    assert df["view_count"].isna().tolist() == [False, False, True]
+
+
+def test_temporal_columns_become_datetime64():
+    table = TABLE.append_column("ts", pa.array([None, 1_700_000_000_000_000, 0], pa.timestamp("us")))
+    df = arrow_to_pandas(_fetch_arrow(StubDB(table).connect(), "SELECT * FROM silver.silver_trend"))
+    assert str(df["dt"].dtype) == "datetime64[ns]" and str(df["ts"].dtype) == "datetime64[ns]"
+    assert df["dt"].tolist()[:2] == [pd.Timestamp("2025-01-01"), pd.Timestamp("2025-01-02")]
+    assert df["dt"].isna().tolist() == [False, False, True]
+    assert str(df["hashtag"].dtype) == "string[pyarrow]"
+    # NULL của cột Arrow là pd.NA -> `x or 0` lỗi, pd.isna thì không
+    assert df["view_count"].iloc[2] is pd.NA
+    with pytest.raises(TypeError):
+        bool(df["view_count"].iloc[2])
+
+
+@pytest.mark.parametrize("chart", ["bar", "line", "area"])
+def test_fetched_dates_chart_with_plotly(chart):
+    px = pytest.importorskip("plotly.express")
+    db = StubDB(TABLE.filter(pa.compute.is_valid(TABLE["dt"])))
+    df = arrow_to_pandas(_fetch_arrow(db.connect(), "SELECT dt, view_count FROM silver.silver_trend"))
+    fig = getattr(px, chart)(df, x="dt", y="view_count")  # Tab 3 / 6 / 8: x là cột DATE
+    assert [pd.Timestamp(x) for x in fig.data[0].x] == [pd.Timestamp("2025-01-01"), pd.Timestamp("2025-01-02")]
@@ -0,0 +1,132 @@
+# tests/test_db_pool.py
+# ConnectionPool: số kết nối thật sự mở (tái dùng, đóng khi rảnh lâu, ping, thử lại đúng 1 lần).
+import threading
+import time
+
+import pytest
+
+from util.db import ConnectionPool
+
+
+class SessionExpired(Exception):
+    pass
+
+
+def _select(conn):
+    with conn.cursor() as cur:
+        cur.execute("SELECT x FROM t")
+        return cur.fetchall()
+
+
+def test_reuses_one_connection_for_sequential_queries(stub_db):
+    pool = ConnectionPool(stub_db.connect, size=4)
+    for _ in range(5):
+        assert pool.run(_select) == [(1,)]
+    assert stub_db.connects == 1
+    assert pool.connects == 1
+
+
+def test_context_manager_returns_connection_to_pool(stub_db):
+    pool = ConnectionPool(stub_db.connect)
+    with pool.connection() as first:
+        _select(first)
+    with pool.connection() as second:
+        _select(second)
+    assert first is second
+    assert stub_db.connects == 1
+
+
+def test_concurrent_checkouts_bounded_by_size(stub_db):
+    pool = ConnectionPool(stub_db.connect, size=2)
+    active, peak = [0], [0]
+    lock = threading.Lock()
+
+    def slow(conn):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        time.sleep(0.05)
+        with lock:
+            active[0] -= 1
+        return _select(conn)
+
+    threads = [threading.Thread(target=pool.run, args=(slow,)) for _ in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert peak[0] == 2
+    assert stub_db.connects == 2
+
+
+def test_idle_connection_is_closed_and_replaced(stub_db):
+    pool = ConnectionPool(stub_db.connect, idle_seconds=0.05)
+    pool.run(_select)
+    time.sleep(0.1)
+    pool.run(_select)
+    assert stub_db.connects == 2
+    assert stub_db.connections[0].closed
+    assert not stub_db.connections[1].closed
+
+
+def test_no_ping_within_ping_after(stub_db):
+    pool = ConnectionPool(stub_db.connect, ping_after=60)
+    pool.run(_select)
+    pool.run(_select)
+    assert [q for q, _ in stub_db.statements].count("SELECT 1") == 0
+
+
+def test_ping_after_idle_keeps_healthy_connection(stub_db):
+    pool = ConnectionPool(stub_db.connect, ping_after=0.01)
+    pool.run(_select)
+    time.sleep(0.03)
+    pool.run(_select)
+    assert [q for q, _ in stub_db.statements].count("SELECT 1") == 1
+    assert stub_db.connects == 1
+
+
+def test_failed_ping_opens_new_connection(stub_db):
+    pool = ConnectionPool(stub_db.connect, ping_after=0.01)
+    pool.run(_select)
+    stub_db.connections[0].broken = True
+    time.sleep(0.03)
+    assert pool.run(_select) == [(1,)]
+    assert stub_db.connects == 2
+    assert stub_db.connections[0].closed
+
+
+def test_retries_reused_connection_exactly_once(stub_db):
+    db = stub_db
+    db.error = SessionExpired
+    pool = ConnectionPool(db.connect, ping_after=60, retry_on=(SessionExpired,))
+    pool.run(_select)
+    db.connections[0].broken = True  # session hết hạn phía server, pool chưa biết
+    assert pool.run(_select) == [(1,)]
+    assert db.connects == 2
+
+    # Kết nối mới cũng lỗi -> chỉ thử lại 1 lần rồi báo lỗi
+    db.connections[1].broken = True
+    db.break_new = True
+    with pytest.raises(SessionExpired):
+        pool.run(_select)
+    assert db.connects == 3
+
+
+def test_no_retry_on_fresh_connection_or_other_errors(stub_db):
+    db = stub_db
+    db.error = SessionExpired
+    db.break_new = True
+    pool = ConnectionPool(db.connect, retry_on=(SessionExpired,))
+    with pytest.raises(SessionExpired):
+        pool.run(_select)
+    assert db.connects == 1
+
+    db.break_new = False
+    pool.run(_select)
+
+    def boom(conn):
+        raise ValueError("bad query")
+
+    with pytest.raises(ValueError):
+        pool.run(boom)
+    assert db.connects == 2  # lỗi không thuộc retry_on: đóng kết nối, không mở lại để thử
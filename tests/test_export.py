@@ -0,0 +1,30 @@
+# tests/test_export.py
+# Xuất CSV / Parquet: ghi theo khối vào file tạm, đọc lại đúng dữ liệu.
+import io
+
+import pandas as pd
+
+from util.export import export_file, iter_csv_chunks
+
+DF = pd.DataFrame({"hashtag": ["food", 'say "hi"', "a,b\nc"] * 5, "views": range(15)})
+
+
+def test_csv_chunks_have_one_header():
+    chunks = list(iter_csv_chunks(DF, chunk_rows=4))
+    assert len(chunks) == 4
+    assert sum(c.count(b"hashtag,views") for c in chunks) == 1
+    pd.testing.assert_frame_equal(pd.read_csv(io.BytesIO(b"".join(chunks))), DF)
+
+
+def test_export_writes_temp_file():
+    for fmt, reader in [("CSV", pd.read_csv), ("Parquet", pd.read_parquet)]:
+        buf, name, _ = export_file(DF, "top100.csv", fmt)
+        assert isinstance(buf, io.RawIOBase)  # kiểu file st.download_button nhận trực tiếp
+        assert name == "top100" + (".csv" if fmt == "CSV" else ".parquet")
+        pd.testing.assert_frame_equal(reader(io.BytesIO(buf.read())), DF)
+        buf.close()
+
+
+def test_empty_frame_keeps_header():
+    buf, _, _ = export_file(DF.iloc[:0], "empty.csv")
+    assert buf.read() == b"hashtag,views\n"
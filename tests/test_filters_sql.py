@@ -0,0 +1,104 @@
+# tests/test_filters_sql.py
+# Đổi filter chỉ đổi tham số bind: SQL text và số câu lệnh gửi tới warehouse giữ nguyên.
+import itertools
+import re
+
+import pytest
+
+from util.db import ConnectionPool, _fetch_arrow, bind_params
+from util.filters import build_where, filter_params, in_param_sql, keyword_sql
+
+# Các bộ dữ liệu dựng giống app.py (cùng cách gọi build_where / helper)
+DATASETS = {
+    "country": f"""
+    SELECT DATE(dt) dt, country_code, SUM(view_count) AS total_views
+    FROM silver.silver_trend
+    {build_where(dt_col='dt', country_col='country_code', industry_col=None,
+                 hashtag_expr='COALESCE(hashtag_raw, hashtag)')}
+    GROUP BY 1,2 ORDER BY 1,2
+    """,
+    "industry": f"""
+    SELECT industry, country_code, SUM(view_count) AS total_views
+    FROM silver.silver_trend
+    WHERE dt = DATE(:latest_dt) AND industry IS NOT NULL
+      AND {in_param_sql('country_code', 'f_countries')}
+      AND {keyword_sql('COALESCE(hashtag_raw, hashtag)')}
+    GROUP BY industry, country_code
+    """,
+    "top100": f"""
+    SELECT * FROM gold.trend_latest_top100 t
+    {build_where(dt_col=None, country_col='t.country_code', industry_col='t.industry',
+                 hashtag_expr='COALESCE(t.hashtag_raw, t.hashtag)', extra=["t.dt = DATE(:latest_dt)"])}
+    """,
+    "ret": f"""
+    SELECT * FROM gold.trend_retention j
+    {build_where(dt_col='j.end_dt', country_col='j.country_code', industry_col='j.industry',
+                 hashtag_expr='COALESCE(j.hashtag_raw, j.hashtag)')}
+    """,
+}
+
+COMBOS = list(itertools.product(
+    [("2025-01-01", "2025-01-31"), ("2025-03-01", "2025-03-07")],
+    [["ALL"], [], ["VN"], ["VN", "US"]],
+    [["ALL"], ["Food"], ["Food", "Tech"]],
+    ["", "dance", "Ăn Uống"],
+))
+
+
+def _params(combo) -> dict:
+    (start, end), countries, industries, keyword = combo
+    return filter_params(start, end, countries, industries, keyword, latest_dt="2025-03-07", top_k=20)
+
+
+def test_sql_text_does_not_depend_on_filter_values():
+    # build_where không nhận giá trị filter -> dựng lại cho mọi bộ filter vẫn cùng chuỗi
+    first = build_where(dt_col="dt")
+    assert all(build_where(dt_col="dt") == first for _ in COMBOS)
+    for combo in COMBOS:
+        params = _params(combo)
+        for sql in DATASETS.values():
+            for value in params.values():
+                if value not in (None, "", "[]"):
+                    assert str(value) not in sql
+
+
+@pytest.mark.parametrize("name", list(DATASETS))
+def test_bind_params_keeps_only_referenced_markers(name):
+    sql = DATASETS[name]
+    markers = set(re.findall(r"(?<![:\w]):([A-Za-z_]\w*)", sql))
+    for combo in (COMBOS[0], COMBOS[-1]):
+        assert set(bind_params(sql, _params(combo))) == markers
+
+
+def test_one_statement_per_dataset_with_identical_text(stub_db):
+    pool = ConnectionPool(stub_db.connect, size=2)
+    texts = set()
+    bound_sets = set()
+    for combo in COMBOS:
+        before = len(stub_db.statements)
+        params = _params(combo)
+        for sql in DATASETS.values():
+            pool.run(lambda conn, sql=sql: _fetch_arrow(conn, sql, bind_params(sql, params)))
+        sent = stub_db.statements[before:]
+        assert len(sent) == len(DATASETS)
+        texts.update(q for q, _ in sent)
+        bound_sets.add(tuple(tuple(sorted(p.items())) for _, p in sent))
+    assert texts == set(DATASETS.values())
+    # Chỉ tham số khác nhau giữa các bộ filter (["ALL"] và [] cùng là "không lọc")
+    distinct = {tuple(sorted(_params(c).items(), key=lambda kv: kv[0])) for c in COMBOS}
+    assert len(bound_sets) == len(distinct)
+    assert stub_db.connects == 1
+
+
+def test_empty_selection_means_all():
+    p_all = filter_params("2025-01-01", "2025-01-31", ["ALL"], [], "", top_k=20)
+    assert p_all["f_countries"] == "[]" and p_all["f_industries"] == "[]"
+    p = filter_params("2025-01-01", "2025-01-31", ["VN", "ALL", "US", "VN"], ["Food"], "Dance", top_k=20)
+    assert p["f_countries"] == '["US", "VN"]'
+    assert p["f_keyword"] == "dance"
+    assert p["f_end_excl"] == "2025-02-01"
+
+
+def test_date_clause_only_with_both_dates():
+    assert "f_start" in build_where(dt_col="dt")
+    assert "f_start" not in build_where(dt_col="dt", date_range=False)
@@ -0,0 +1,89 @@
+# tests/test_fingerprint.py
+# Khoá cache theo SQL dạng chuẩn (result_cache.canonical_sql) và thống kê fingerprint (util.db):
+# chỉ từ khoá / tên hàm đổi hoa-thường, tên cột giữ nguyên; cache lồng nhau ghi đúng 1 kết quả / lượt tra.
+import pytest
+
+from util import db
+from util.db import fingerprint_lookup, fingerprint_stats, mark_miss
+from util.result_cache import canonical_sql, fingerprint
+
+
+def test_canonical_sql_normalises_layout_keywords_and_in_lists():
+    a = """
+    select country_code, sum(view_count) as total  -- tổng view
+    from silver.silver_trend
+    where country_code in ('VN', 'US', 'VN') and dt >= DATE(:f_start)
+    group by country_code
+    """
+    b = "SELECT country_code,SUM( view_count )AS total FROM silver.silver_trend /* x */ " \
+        "WHERE country_code IN ('US','VN') AND dt>=date(:f_start) GROUP BY country_code"
+    assert canonical_sql(a) == canonical_sql(b)
+    assert canonical_sql(a) == ("SELECT country_code, SUM(view_count) AS total FROM silver.silver_trend "
+                                "WHERE country_code IN('US', 'VN') AND dt >= DATE(:f_start) GROUP BY country_code")
+    assert fingerprint(a, {"f_start": "2025-01-01"}) == fingerprint(b, {"f_start": "2025-01-01"})
+    assert fingerprint(a, {"f_start": "2025-01-01"}) != fingerprint(a, {"f_start": "2025-01-02"})
+
+
+@pytest.mark.parametrize("col", ["day", "week", "month", "year", "first", "last"])
+def test_column_names_that_look_like_keywords_keep_their_case(col):
+    sql = f"SELECT {col}, DATE_TRUNC('week', dt) AS {col}_start FROM t ORDER BY {col}"
+    out = canonical_sql(sql)
+    assert f"SELECT {col}, DATE_TRUNC('week', dt) AS {col}_start FROM t ORDER BY {col}" == out
+    # Cùng tên dạng hàm thì vẫn là tên hàm
+    assert canonical_sql(f"SELECT {col}(dt) AS {col} FROM t") == f"SELECT {col.upper()}(dt) AS {col} FROM t"
+
+
+def test_literals_and_identifiers_untouched():
+    sql = "select `Select`, 'from x' as s from t where tag in (`b`, 'a')"
+    assert canonical_sql(sql) == "SELECT `Select`, 'from x' AS s FROM t WHERE tag IN(`b`, 'a')"
+
+
+@pytest.fixture
+def stats(monkeypatch):
+    monkeypatch.setattr(db, "_FINGERPRINT_STATS", {})
+    return lambda: {k: v for k, v in fingerprint_stats()[0].items() if k in ("lookups", "hits", "variants")}
+
+
+def _layers():
+    """2 lớp cache như app.py: _run_sql_safe (ngoài) bọc run_sql (trong)."""
+    outer, inner, executed = {}, {}, []
+
+    def inner_fn(key):
+        if key not in inner:
+            mark_miss()
+            executed.append(key)
+            inner[key] = f"result:{key}"
+        return inner[key]
+
+    def outer_fn(key, query):
+        if key not in outer:
+            mark_miss()
+            outer[key] = fingerprint_lookup(key, query, inner_fn, key)
+        return outer[key]
+
+    return outer, inner, executed, lambda key, q: fingerprint_lookup(key, q, outer_fn, key, q)
+
+
+def test_nested_lookup_records_one_outcome(stats):
+    outer, _, executed, lookup = _layers()
+    assert lookup("k", "SELECT 1") == "result:k"  # cả 2 lớp trượt -> query chạy
+    assert stats() == {"lookups": 1, "hits": 0, "variants": 1}
+    outer.clear()  # VD bấm Làm mới chỉ xoá cache ngoài
+    lookup("k", "SELECT 1")  # ngoài trượt, run_sql trúng -> 1 lượt trúng
+    assert stats() == {"lookups": 2, "hits": 1, "variants": 1}
+    lookup("k", "select  1")  # ngoài trúng, chuỗi SQL khác
+    assert stats() == {"lookups": 3, "hits": 2, "variants": 2}
+    assert fingerprint_stats()[0]["canonical_hits"] == 1
+    assert executed == ["k"]
+
+
+def test_failed_lookup_does_not_leave_nesting_state(stats):
+    def boom(key):
+        mark_miss()
+        raise RuntimeError("warehouse down")
+
+    with pytest.raises(RuntimeError):
+        fingerprint_lookup("k", "SELECT 1", boom, "k")
+    assert fingerprint_stats() == []
+    fingerprint_lookup("k", "SELECT 1", lambda key: key, "k")
+    assert stats() == {"lookups": 1, "hits": 1, "variants": 1}
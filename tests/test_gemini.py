@@ -0,0 +1,125 @@
+# tests/test_gemini.py
+# Stream Gemini (util/gemini.py) với server SSE giả: event bị cắt giữa chừng, nhiều event trong 1 lần gửi,
+# event nhiều dòng "data:", [DONE] -> text ghép lại đúng, có ttft / latency / chunks.
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from util.gemini import GeminiError, GeminiStream, iter_sse
+
+
+def _event(text: str) -> str:
+    return json.dumps({"candidates": [{"content": {"parts": [{"text": text}]}}]}, ensure_ascii=False)
+
+
+EV1, EV2, EV3 = _event("Kịch bản "), _event("cho #food"), _event(": mở đầu 3 giây.")
+MULTI = _event("\nCảnh 2").replace(', "', ',\ndata: "', 1)  # 1 event, JSON tách trên 2 dòng "data:"
+
+# Các lần ghi của server (mỗi phần tử = 1 lần gửi + flush)
+FRAMES = [
+    b": keep-alive comment\n\n",
+    f"data: {EV1[:20]}".encode(),                      # event 1 bị cắt giữa dòng ...
+    f"{EV1[20:]}\n\n".encode(),                         # ... phần còn lại tới sau
+    f"data: {EV2}\n\ndata: {EV3}\n\n".encode(),         # 2 event trong 1 lần gửi
+    f"data: {MULTI}\n\n".encode()[:-9],                 # event nhiều dòng, cắt giữa ký tự UTF-8
+    f"data: {MULTI}\n\n".encode()[-9:],
+    b"data: [DONE]\n\n",
+    b"data: {not json\n\n",                             # sau [DONE] -> không được đọc
+]
+EXPECTED = ["Kịch bản ", "cho #food", ": mở đầu 3 giây.", "\nCảnh 2"]
+DELAY = 0.05
+
+
+class SSEHandler(BaseHTTPRequestHandler):
+    # Như API thật: HTTP/1.1 chunked, mỗi lần gửi là 1 chunk. iter_lines(chunk_size=None) chỉ nhận dần
+    # theo chunk; response HTTP/1.0 không độ dài thì urllib3 đọc tới EOF rồi mới trả.
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.requests.append((self.path, body))
+        if "bad" in self.path:
+            msg = b'{"error": {"code": 400, "message": "API key not valid"}}'
+            self.send_response(400)
+            self.send_header("Connection", "close")
+            self.send_header("Content-Length", str(len(msg)))
+            self.end_headers()
+            self.wfile.write(msg)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        for frame in self.server.frames:
+            time.sleep(DELAY)
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(frame), frame))
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+
+@pytest.fixture
+def sse_server():
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), SSEHandler)
+    srv.requests, srv.frames = [], FRAMES
+    thread = threading.Thread(target=srv.serve_forever, daemon=True)
+    thread.start()
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+
+
+def _base(srv) -> str:
+    return f"http://127.0.0.1:{srv.server_address[1]}/v1beta"
+
+
+def test_iter_sse_joins_data_lines_per_event():
+    lines = [": comment", "data: a", "data: b", "", "", "event: x", "data: c", "", "data: [DONE]"]
+    assert list(iter_sse(lines)) == ["a\nb", "c", "[DONE]"]
+
+
+def test_stream_reassembles_split_frames(sse_server):
+    stream = GeminiStream("k1", {"contents": []}, model="m", base_url=_base(sse_server),
+                          session=requests.Session())
+    assert stream.ttft is None and stream.latency is None
+    assert list(stream) == EXPECTED
+    assert stream.text == "".join(EXPECTED)
+    assert stream.chunks == len(EXPECTED)
+    # ttft: tới đoạn text đầu (sau 3 lần gửi); latency: tới [DONE] (sau 7 lần gửi)
+    assert 2 * DELAY <= stream.ttft < stream.latency
+    assert stream.latency >= 6 * DELAY
+    path, body = sse_server.requests[0]
+    assert path.startswith("/v1beta/models/m:streamGenerateContent?")
+    assert "alt=sse" in path and "key=k1" in path
+    assert body == {"contents": []}
+
+
+def test_stream_yields_incrementally(sse_server):
+    stream = GeminiStream("k1", {}, base_url=_base(sse_server))
+    it = iter(stream)
+    t0 = time.perf_counter()
+    assert next(it) == EXPECTED[0]
+    first = time.perf_counter() - t0
+    rest = list(it)
+    assert rest == EXPECTED[1:]
+    # Đoạn đầu tới trước khi server gửi xong (không chờ cả response)
+    assert first < stream.latency - 3 * DELAY
+
+
+def test_error_status_and_error_event(sse_server):
+    with pytest.raises(GeminiError, match="400"):
+        list(GeminiStream("k", {}, model="bad", base_url=_base(sse_server)))
+
+    sse_server.frames = [f"data: {EV1}\n\n".encode(),
+                         b'data: {"error": {"code": 503, "message": "overloaded"}}\n\n']
+    stream = GeminiStream("k", {}, base_url=_base(sse_server))
+    with pytest.raises(GeminiError, match="503 - overloaded"):
+        list(stream)
+    assert stream.text == "Kịch bản " and stream.chunks == 1
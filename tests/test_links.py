@@ -0,0 +1,113 @@
+# tests/test_links.py
+# Kiểm tra link (util/links.py) với server HTTP cục bộ: giới hạn request đồng thời / host,
+# HEAD bị chặn (405) -> GET, lỗi mạng không được cache.
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from util.links import NETWORK_ERROR, LinkChecker, cache_rows
+
+
+class Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, headers=None):
+        self.send_response(status)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def _slow(self):
+        # Đếm request đang xử lý theo Host; giảm trước khi trả lời -> client chỉ nhận được response
+        # (và nhả semaphore) sau khi request đã rời khỏi bộ đếm
+        stats = self.server.stats
+        host = self.headers["Host"].split(":")[0]
+        with stats["lock"]:
+            stats["active"][host] = stats["active"].get(host, 0) + 1
+            stats["peak"][host] = max(stats["peak"].get(host, 0), stats["active"][host])
+        time.sleep(0.2)
+        with stats["lock"]:
+            stats["active"][host] -= 1
+        self._reply(200)
+
+    def _route(self):
+        with self.server.stats["lock"]:
+            self.server.stats["methods"].append((self.command, self.path))
+        if self.path.startswith("/slow"):
+            self._slow()
+        elif self.path == "/nohead" and self.command == "HEAD":
+            self._reply(405)
+        elif self.path == "/redirect":
+            self._reply(302, {"Location": "/ok"})
+        elif self.path == "/broken":
+            self._reply(500)
+        else:
+            self._reply(200)
+
+    do_HEAD = do_GET = _route
+
+
+@pytest.fixture
+def server():
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    srv.stats = {"lock": threading.Lock(), "methods": [], "active": {}, "peak": {}}
+    thread = threading.Thread(target=srv.serve_forever, daemon=True)
+    thread.start()
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+
+
+def _url(server, path, host="127.0.0.1"):
+    return f"http://{host}:{server.server_address[1]}{path}"
+
+
+def _closed_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def test_per_host_concurrency_limit(server):
+    checker = LinkChecker(per_host=2)
+    urls = [_url(server, f"/slow/{i}", host) for i in range(6) for host in ("127.0.0.1", "localhost")]
+    t0 = time.monotonic()
+    results = checker.check_many(urls, workers=12)
+    elapsed = time.monotonic() - t0
+    assert all(r == (200, u, 0, True) for u, r in results.items())
+    # 12 thread nhưng mỗi host tối đa 2 request cùng lúc; 2 host độc lập nhau
+    assert server.stats["peak"] == {"127.0.0.1": 2, "localhost": 2}
+    assert elapsed >= 3 * 0.2 * 0.9  # 6 URL / host, 2 luồng / host -> >= 3 lượt 0.2s
+
+
+def test_head_blocked_falls_back_to_get(server):
+    checker = LinkChecker()
+    url = _url(server, "/nohead")
+    assert checker.check(url) == (200, url, 0, True)
+    assert server.stats["methods"] == [("HEAD", "/nohead"), ("GET", "/nohead")]
+
+
+def test_head_ok_skips_get_and_counts_redirects(server):
+    checker = LinkChecker()
+    assert checker.check(_url(server, "/redirect")) == (200, _url(server, "/ok"), 1, True)
+    assert {m for m, _ in server.stats["methods"]} == {"HEAD"}
+
+
+def test_network_errors_are_not_cached(server):
+    checker = LinkChecker(head_timeout=1, get_timeout=1)
+    dead = f"http://127.0.0.1:{_closed_port()}/x"
+    ok, broken = _url(server, "/ok"), _url(server, "/broken")
+    results = checker.check_many([dead, ok, broken, ok])
+    assert results[dead] == NETWORK_ERROR
+    assert results[broken] == (500, broken, 0, False)
+    # HTTP 5xx vẫn là kết quả hợp lệ -> cache; lỗi mạng thì lần chạy sau kiểm tra lại
+    assert sorted(cache_rows(results)) == [(broken, 500, broken, 0, False), (ok, 200, ok, 0, True)]
+
+
+def test_check_many_empty():
+    assert LinkChecker().check_many([]) == {}
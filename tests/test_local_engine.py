@@ -0,0 +1,206 @@
+# tests/test_local_engine.py
+# Engine local (util/local_engine.py): SQL Databricks của app.py dịch sang DuckDB và chạy trên snapshot
+# Parquet nhỏ; LocalEngine.open chỉ snapshot lại khi version Delta đổi.
+import ast
+import functools
+import json
+from datetime import date, timedelta
+from pathlib import Path
+
+import pyarrow as pa
+import pytest
+
+from util import filters
+from util.db import bind_params
+from util.local_engine import LocalEngine, build_snapshot, to_duckdb_sql
+
+pytest.importorskip("duckdb")  # phụ thuộc tuỳ chọn của engine local
+
+APP = Path(__file__).resolve().parents[1] / "app.py"
+
+
+@functools.lru_cache(maxsize=None)
+def _app_tree() -> ast.Module:
+    return ast.parse(APP.read_text(encoding="utf-8"))
+
+
+def _assigned(name: str) -> ast.expr:
+    """Biểu thức gán cho `name` trong app.py (kể cả trong thân hàm)."""
+    for node in ast.walk(_app_tree()):
+        if isinstance(node, ast.Assign) and any(getattr(t, "id", None) == name for t in node.targets):
+            return node.value
+    raise LookupError(name)
+
+
+def _app_sql(name: str, **env) -> str:
+    """
+    Dựng SQL đúng như app.py (không chạy streamlit): eval f-string của app với build_where thật
+    (lọc theo ngày) và HASHTAG_DIM dạng tính từ silver (snapshot không có gold.hashtag_dim).
+    """
+    hashtag_dim = _assigned("HASHTAG_DIM").orelse.value
+    ns = {"build_where": functools.partial(filters.build_where, date_range=True),
+          "in_param_sql": filters.in_param_sql, "HASHTAG_DIM": hashtag_dim, **env}
+    expr = ast.Expression(_assigned(name))
+    return eval(compile(expr, str(APP), "eval"), ns)
+
+
+def _momentum_top_sql(base_sql: str) -> str:
+    fn = next(n for n in ast.walk(_app_tree()) if isinstance(n, ast.FunctionDef) and n.name == "momentum_top_sql")
+    ns = {}
+    exec(compile(ast.Module([fn], type_ignores=[]), str(APP), "exec"), ns)
+    return ns["momentum_top_sql"](base_sql)
+
+
+D0 = date(2025, 3, 1)
+# tag_a: 3 ngày liên tiếp + 1 ngày rời; tag_b: 2 ngày liên tiếp + 1 ngày rời; tag_c chỉ ở US, ngành Tech,
+# hashtag_raw có ký tự đặc biệt của LIKE
+ROWS = [
+    # (ngày, hashtag, hashtag_raw, country, industry, rank, views, videos)
+    (0, "tag_a", "Tag_A", "VN", "Food", 1, 100, 10),
+    (1, "tag_a", "Tag_A", "VN", "Food", 2, 150, 12),
+    (2, "tag_a", "Tag_A", "VN", "Food", 1, 300, 20),
+    (5, "tag_a", "Tag_A", "VN", "Food", 3, 310, 21),
+    (1, "tag_b", "Tag_B", "VN", "Food", 5, 500, 30),
+    (2, "tag_b", "Tag_B", "VN", "Food", 4, 400, 31),
+    (5, "tag_b", "Tag_B", "VN", "Food", 2, 100, 32),
+    (4, "tag_c", "50%_off", "US", "Tech", 9, 70, 3),
+    (5, "tag_c", "50%_off", "US", "Tech", 1, 90, 4),
+]
+
+
+def _silver() -> pa.Table:
+    cols = list(zip(*ROWS))
+    return pa.table({
+        "dt": pa.array([D0 + timedelta(days=d) for d in cols[0]], pa.date32()),
+        "hashtag": pa.array(cols[1]),
+        "hashtag_raw": pa.array(cols[2]),
+        "country_code": pa.array(cols[3]),
+        "industry": pa.array(cols[4]),
+        "category": pa.array(["c"] * len(ROWS)),
+        "url": pa.array([f"https://t/{h}" for h in cols[1]]),
+        "rank": pa.array(cols[5], pa.int32()),
+        "view_count": pa.array(cols[6], pa.int64()),
+        "video_count": pa.array(cols[7], pa.int64()),
+        "is_promoted": pa.array([False] * len(ROWS)),
+    })
+
+
+class Warehouse:
+    """fetch(sql) giả cho build_snapshot: chỉ có silver.silver_trend, bảng khác raise như chưa tạo."""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, sql: str) -> pa.Table:
+        self.queries.append(sql)
+        table = sql.split(" FROM ")[-1]
+        if table != "silver.silver_trend":
+            raise RuntimeError(f"TABLE_OR_VIEW_NOT_FOUND {table}")
+        data = _silver()
+        cols = sql[len("SELECT "):sql.index(" FROM ")]
+        return data if cols == "*" else data.select([c.strip() for c in cols.split(",")])
+
+
+@pytest.fixture
+def engine(tmp_path):
+    build_snapshot(Warehouse(), str(tmp_path), {"silver.silver_trend": 7})
+    return LocalEngine(str(tmp_path))
+
+
+def _params(start="2025-03-01", end="2025-03-06", countries=(), industries=(), keyword="", top_k=20) -> dict:
+    return filters.filter_params(start, end, list(countries) or ["ALL"], list(industries) or ["ALL"],
+                                 keyword, latest_dt="2025-03-06", top_k=top_k)
+
+
+def _run(engine, sql: str, params: dict = None) -> list:
+    return engine.query(sql, bind_params(sql, params)).to_pylist()
+
+
+def test_to_duckdb_sql_rewrites():
+    sql = ("SELECT DATE(dt), DATEDIFF(DATE(:f_end), dt), collect_set(x), "
+           "from_json(:f_countries, 'array<string>'), 'DATE(:not_a_param)' FROM t")
+    assert to_duckdb_sql(sql) == (
+        "SELECT CAST(dt AS DATE), datediff('day', dt, CAST($f_end AS DATE)), list_distinct(list(x)), "
+        "from_json($f_countries, '[\"VARCHAR\"]'), 'DATE(:not_a_param)' FROM t")
+    assert "information_schema.columns" in to_duckdb_sql("SHOW COLUMNS IN silver.silver_trend")
+
+
+def test_build_snapshot_skips_missing_tables(tmp_path):
+    wh = Warehouse()
+    done = build_snapshot(wh, str(tmp_path), {"silver.silver_trend": 7, "gold.trend_momentum": None})
+    assert done == ["silver.silver_trend"]
+    assert json.loads((tmp_path / "_versions.json").read_text()) == {"silver.silver_trend": 7,
+                                                                   "gold.trend_momentum": None}
+    # silver lấy đúng danh sách cột, gold thử cột rồi SELECT * trước khi bỏ qua
+    assert wh.queries[0].startswith("SELECT dt, hashtag, hashtag_raw")
+    assert LocalEngine(str(tmp_path)).tables == ["silver.silver_trend"]
+
+
+def test_meta_sql(engine):
+    sql = _app_sql("META_SQL")
+    (row,) = _run(engine, sql, {"data_version": 7})
+    assert row["min_d"] == D0 and row["max_d"] == row["latest_d"] == D0 + timedelta(days=5)
+    assert row["countries"] == ["US", "VN"] and row["industries"] == ["Food", "Tech"]
+    assert row["row_cnt"] == len(ROWS) and row["data_version"] == 7
+
+
+@pytest.mark.parametrize("kwargs, expected", [
+    ({}, len(ROWS)),
+    ({"start": "2025-03-02", "end": "2025-03-03"}, 4),
+    ({"countries": ["US"]}, 2),
+    ({"countries": ["VN", "US"], "industries": ["Tech"]}, 2),
+    ({"keyword": "TAG_"}, 7),     # keyword đã hạ chữ thường, so với COALESCE(hashtag_raw, hashtag)
+    ({"keyword": "50%_off"}, 2),
+])
+def test_build_where_with_bound_params(engine, kwargs, expected):
+    sql = f"SELECT * FROM silver.silver_trend {filters.build_where()}"
+    assert len(_run(engine, sql, _params(**kwargs))) == expected
+
+
+def test_in_param_sql(engine):
+    sql = (f"SELECT DISTINCT country_code FROM silver.silver_trend "
+           f"WHERE {filters.in_param_sql('country_code', 'f_countries')} ORDER BY 1")
+    assert [r["country_code"] for r in _run(engine, sql, _params(countries=["US"]))] == ["US"]
+    assert [r["country_code"] for r in _run(engine, sql, _params())] == ["US", "VN"]
+
+
+def test_datediff_streak_query(engine):
+    sql = _app_sql("sql_ret_fb")
+    assert "DATEDIFF(dt, DATE'1970-01-01')" in sql
+    rows = _run(engine, sql + " ORDER BY 1, 2", _params())
+    streaks = [(r["hashtag"], r["start_dt"].day, r["end_dt"].day, r["streak_days"]) for r in rows]
+    assert streaks == [("tag_a", 1, 3, 3), ("tag_a", 6, 6, 1), ("tag_b", 2, 3, 2), ("tag_b", 6, 6, 1),
+                       ("tag_c", 5, 6, 2)]
+    vn = _run(engine, sql, _params(countries=["VN"], start="2025-03-06", end="2025-03-06"))
+    assert sorted(r["hashtag"] for r in vn) == ["tag_a", "tag_b"]
+
+
+def test_qualify_momentum_query(engine):
+    sql = _momentum_top_sql(_app_sql("sql_m_fb"))
+    assert "QUALIFY" in sql
+    rows = _run(engine, sql, _params(top_k=1))
+    # Ngày mới nhất (06/03): tag_a +10 view, tag_b -300 view, tag_c +20 view và tăng 8 hạng
+    top = {col: next(r["hashtag"] for r in rows if r[col] == 1) for col in ("rn_rising", "rn_rank_rising",
+                                                                           "rn_fading")}
+    assert top == {"rn_rising": "tag_c", "rn_rank_rising": "tag_c", "rn_fading": "tag_b"}
+    assert {r["dt"] for r in rows} == {D0 + timedelta(days=5)}
+    assert len(rows) == 2  # tag_c đứng đầu 2 panel -> chỉ 2 dòng
+    assert len(_run(engine, sql, _params(top_k=20))) == 3
+
+
+def test_open_resnapshots_only_when_versions_change(tmp_path):
+    wh = Warehouse()
+    LocalEngine.open(str(tmp_path), {"silver.silver_trend": 1}, fetch=wh)
+    first = len(wh.queries)
+    assert first > 0
+
+    eng = LocalEngine.open(str(tmp_path), {"silver.silver_trend": 1}, fetch=wh)
+    assert len(wh.queries) == first and eng.tables == ["silver.silver_trend"]
+
+    LocalEngine.open(str(tmp_path), {"silver.silver_trend": 2}, fetch=wh)
+    assert len(wh.queries) == 2 * first
+    assert json.loads((tmp_path / "_versions.json").read_text()) == {"silver.silver_trend": 2}
+
+    # Không biết version (VD offline) -> dùng snapshot đang có
+    LocalEngine.open(str(tmp_path), {"silver.silver_trend": None}, fetch=wh)
+    assert len(wh.queries) == 2 * first
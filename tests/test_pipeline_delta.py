@@ -0,0 +1,375 @@
+# tests/test_pipeline_delta.py
+# Chạy các cell pipeline của main.ipynb (Cell 1, A, B, PATCH, 4, 4b, 4c, 4d) trên Spark + Delta cục bộ:
+#   - Cell B: nạp cùng file RAW 2 lần -> Bronze / ledger không đổi; file bị ghi đè hoặc lần trước lỗi
+#     giữa append và ghi ledger -> dòng cũ của file đó được thay, không nhân đôi
+#   - BUILD_MODE=INCREMENTAL (REPLACE WHERE / MERGE từ mốc build_since) ra đúng kết quả như FULL
+# Cần pyspark, delta-spark và JAR Delta (xem README, mục 3.3): DELTA_JARS=<jar,...> hoặc để
+# configure_spark_with_delta_pip tải từ Maven. Thiếu thì các test bị bỏ qua.
+import gzip
+import itertools
+import json
+import os
+import time
+from collections import namedtuple
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("pyspark")
+from pyspark.sql import functions as F  # noqa: E402
+
+NOTEBOOK = Path(__file__).resolve().parents[1] / "main.ipynb"
+
+CONFIG, CELL_A, CELL_B = "# ===== CO5173 — Cell 1 ", "# === Cell A ===", "# === Cell B "
+PATCH, CELL_4, CELL_4B, CELL_4C, CELL_4D = ("# ==== PATCH", "# Cell 4 — ", "# Cell 4b — ", "# Cell 4c — ",
+                                            "# Cell 4d — ")
+PIPELINE = (CONFIG, CELL_A, CELL_B, PATCH, CELL_4, CELL_4B, CELL_4C, CELL_4D)
+
+BRONZE_DDL = """
+CREATE TABLE IF NOT EXISTS raw.bronze_tiktok_raw (
+  t_id STRING, id STRING, name STRING, url STRING, countryCode STRING, industryName STRING, type STRING,
+  rank BIGINT, rankDiff BIGINT, videoCount BIGINT, viewCount BIGINT, isPromoted BOOLEAN, markedAsNew BOOLEAN,
+  trendingHistogram STRING, relatedCreators STRING,
+  _ingest_time TIMESTAMP, _source_file STRING, dt DATE
+) USING DELTA
+"""
+
+# Bảng Cell PATCH / 4 / 4b / 4c dựng ra -> so sánh INCREMENTAL với FULL
+BUILT_TABLES = [
+    "silver.silver_trend_base", "silver.silver_trend_with_quality", "silver.silver_trend_quarantine",
+    "silver.silver_trend", "gold.trend_by_day_topk", "gold.trend_latest_top100",
+    "gold.trend_country_summary", "gold.hashtag_dim", "gold.trend_daily_cube",
+]
+
+
+# ------------- Spark + Delta -------------
+@pytest.fixture(scope="module")
+def spark(tmp_path_factory):
+    from pyspark.sql import SparkSession
+
+    builder = (SparkSession.builder.master("local[2]").appName("pipeline-delta-test")
+               .config("spark.sql.warehouse.dir", str(tmp_path_factory.mktemp("warehouse")))
+               .config("spark.sql.shuffle.partitions", "2")
+               .config("spark.ui.enabled", "false")
+               .config("spark.sql.extensions", "io.delta.sql.DeltaSparkSessionExtension")
+               .config("spark.sql.catalog.spark_catalog", "org.apache.spark.sql.delta.catalog.DeltaCatalog"))
+    jars = os.environ.get("DELTA_JARS")
+    if jars:
+        builder = builder.config("spark.jars", jars)
+    else:
+        delta = pytest.importorskip("delta")
+        builder = delta.configure_spark_with_delta_pip(builder)
+    try:
+        session = builder.getOrCreate()
+        session.range(1).write.format("delta").save(str(tmp_path_factory.mktemp("probe") / "t"))
+    except Exception as e:  # không có Java / không tải được JAR Delta
+        pytest.skip(f"Không tạo được Spark + Delta: {str(e).splitlines()[0][:200]}")
+    yield session
+    session.stop()
+
+
+@pytest.fixture
+def lake(spark):
+    """Catalog sạch cho mỗi test."""
+    for schema in ("raw", "silver", "gold"):
+        spark.sql(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+    return spark
+
+
+# ------------- dbutils giả + chạy cell -------------
+FileInfo = namedtuple("FileInfo", "path name size modificationTime")
+
+
+class FakeFs:
+    """dbutils.fs.ls trên thư mục local; path dạng file:/... giống _metadata.file_path của Spark."""
+
+    @staticmethod
+    def ls(path: str):
+        local = Path(path[len("file:"):] if path.startswith("file:") else path)
+        if not local.is_dir():
+            raise FileNotFoundError(path)
+        return [FileInfo(f"file:{f}", f.name, f.stat().st_size, int(f.stat().st_mtime * 1000))
+                for f in sorted(local.iterdir()) if f.is_file()]
+
+
+class FakeWidgets:
+    """Giá trị truyền vào như tham số job: ghi đè default của widget, giữ nguyên qua removeAll()."""
+
+    def __init__(self, values: dict):
+        self.values, self.defaults = values, {}
+
+    def removeAll(self):
+        self.defaults.clear()
+
+    def text(self, name, default, label=None):
+        self.defaults[name] = default
+
+    def dropdown(self, name, default, choices, label=None):
+        self.defaults[name] = default
+
+    def get(self, name):
+        return self.values.get(name, self.defaults[name])
+
+
+class FakeSecrets:
+    @staticmethod
+    def get(scope, key):
+        raise KeyError(f"{scope}/{key}")
+
+
+class FakeDbutils:
+    def __init__(self, widgets: dict):
+        self.widgets, self.fs, self.secrets = FakeWidgets(widgets), FakeFs(), FakeSecrets()
+
+
+def _cell(title: str) -> str:
+    nb = json.loads(NOTEBOOK.read_text(encoding="utf-8"))
+    found = ["".join(c["source"]) for c in nb["cells"]
+             if c["cell_type"] == "code" and "".join(c["source"]).startswith(title)]
+    assert len(found) == 1, title
+    return found[0]
+
+
+class Notebook:
+    """Namespace chung cho các cell như 1 notebook Databricks (spark, dbutils, display)."""
+
+    def __init__(self, spark, raw: Path):
+        self.spark, self.raw = spark, raw
+        self.ns = {"spark": spark, "display": lambda *args, **kwargs: None}
+
+    def run(self, *titles, dates, mode="INCREMENTAL"):
+        """Chạy lại từ Cell 1 với tham số job: BACKFILL các ngày `dates`, BUILD_MODE = mode."""
+        self.ns["dbutils"] = FakeDbutils({
+            "RUN_MODE": "BACKFILL", "FROM_DT": min(dates), "TO_DT": max(dates), "BUILD_MODE": mode,
+            "RAW_PATH": f"file:{self.raw}", "APIFY_TOKEN": "test-token",
+        })
+        for title in titles:
+            exec(compile(_cell(title), f"main.ipynb[{title.strip('# =')}]", "exec"), self.ns)
+            if title == CONFIG:
+                self.spark.sql(BRONZE_DDL)  # Bronze có sẵn từ trước, notebook không tạo
+
+
+@pytest.fixture
+def notebook(lake, tmp_path):
+    return Notebook(lake, tmp_path / "raw")
+
+
+# ------------- Dữ liệu RAW -------------
+_MTIME = itertools.count(1)
+
+
+def _rec(tag, rank, views, country="VN", industry="Food", name=None, **extra):
+    rec = {
+        "t_id": f"{tag}-{country}-{rank}", "id": tag, "name": tag.title() if name is None else name,
+        "url": f"https://www.tiktok.com/tag/{tag}", "countryCode": country, "industryName": industry,
+        "type": "hashtag", "rank": rank, "rankDiff": 1, "videoCount": views // 100, "viewCount": views,
+        "isPromoted": rank == 2, "markedAsNew": False, "trendingHistogram": [{"d": 1, "v": 0.5}],
+        "relatedCreators": [],
+    }
+    rec.update(extra)
+    return rec
+
+
+def _day(day: int, drop=(), bump=0) -> list:
+    """
+    1 ngày RAW: rank khác nhau trong ngày (ROW_NUMBER không hoà), 1 khoá (dt, hashtag, QG, ngành) có
+    2 dòng, industry NULL, rank NULL, rank 0 (quarantine), tên không ra hashtag, dòng không có name/id/url.
+    """
+    tags = [("food", "VN", "Food"), ("dance", "VN", None), ("travel", "US", "Travel"), ("tech", "US", "Tech"),
+            ("food", "US", "Food")]
+    recs = [_rec(tag, i + 1, 10_000 * day - 100 * i + bump, country, industry)
+            for i, (tag, country, industry) in enumerate(tags) if tag not in drop]
+    recs += [
+        _rec("food", 9, 50 * day, "VN", "Food"),
+        _rec("oops", 0, 10 * day),
+        _rec("late", None, 5 * day),
+        _rec("sym", 7, 7 * day, name="###", id=None),
+        {"t_id": "x", "type": "hashtag", "viewCount": 1},
+    ]
+    return recs
+
+
+def _write_raw(raw: Path, day: str, name: str, records, items=False, extra_lines=()) -> Path:
+    """Ghi file RAW như Cell 2 (JSONL, .gz nén); items=True: dạng cũ {"items": [...]} trên 1 dòng."""
+    d = raw / f"dt={day}"
+    d.mkdir(parents=True, exist_ok=True)
+    lines = [json.dumps({"items": records})] if items else [json.dumps(r) for r in records]
+    text = "\n".join(lines + list(extra_lines)) + "\n"
+    path = d / name
+    if name.endswith(".gz"):
+        with gzip.open(path, "wt", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        path.write_text(text, encoding="utf-8")
+    # Ghi đè trong cùng 1 giây vẫn đổi modificationTime (như dbutils.fs)
+    mtime = time.time() + next(_MTIME)
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+D1, D2, D3, D4, D5 = (f"2025-03-0{i}" for i in range(1, 6))
+
+
+# ------------- Helper so sánh -------------
+def _rows(spark, table: str, drop=()) -> list:
+    df = spark.table(table)
+    if "hashtag_sketch" in df.columns:  # sketch HLL: so số distinct ước lượng, không so bytes
+        df = df.withColumn("hashtag_sketch", F.expr("hll_sketch_estimate(hashtag_sketch)"))
+    df = df.drop(*drop)
+    return sorted((tuple(r) for r in df.collect()), key=repr)
+
+
+def _snapshot(spark) -> dict:
+    return {t: _rows(spark, t) for t in BUILT_TABLES}
+
+
+def _ledger(spark) -> list:
+    return sorted((r.path, r.size, r.modification_time, str(r.dt))
+                  for r in spark.table("raw.bronze_file_ledger").collect())
+
+
+def _listing(raw: Path) -> list:
+    return sorted((f.path, f.size, f.modificationTime, d.name[len("dt="):])
+                  for d in sorted(raw.iterdir()) for f in FakeFs.ls(str(d)) if ".json" in f.name
+                  and not f.name.startswith(("_", ".")))
+
+
+def _history(spark, table: str) -> list:
+    return spark.sql(f"DESCRIBE HISTORY {table}").orderBy("version").collect()
+
+
+def _full_rebuild(notebook, dates) -> dict:
+    """FULL từ đầu trên cùng Bronze: xoá silver / gold rồi chạy lại pipeline với BUILD_MODE=FULL."""
+    for schema in ("silver", "gold"):
+        notebook.spark.sql(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+    notebook.run(*PIPELINE, dates=dates, mode="FULL")
+    return _snapshot(notebook.spark)
+
+
+# ------------- Cell B -------------
+def test_bronze_load_is_idempotent(notebook, capsys):
+    spark, raw = notebook.spark, notebook.raw
+    a = _write_raw(raw, D1, "a.json", _day(1)[:3], extra_lines=["{not json"])
+    _write_raw(raw, D1, "b.json.gz", _day(1)[3:5], items=True)
+    c = _write_raw(raw, D2, "c.json", _day(2)[:2])
+    _write_raw(raw, D2, "_c.json.tmp", _day(2))  # part đang ghi dở của Cell 2 -> bỏ qua
+
+    notebook.run(CONFIG, CELL_A, CELL_B, dates=[D1, D2])
+    out = capsys.readouterr().out
+    assert "RAW files: 3 | mới / đổi: 3" in out
+    assert "Raw lines read: 7 | corrupt: 1 (bỏ 1 dòng hỏng hoàn toàn) | rows appended: 7" in out
+    bronze = _rows(spark, "raw.bronze_tiktok_raw", drop=["_ingest_time"])
+    per_file = spark.sql("SELECT _source_file, dt, COUNT(*) c FROM raw.bronze_tiktok_raw GROUP BY 1, 2").collect()
+    assert sorted((Path(r._source_file).name, str(r.dt), r.c) for r in per_file) == [
+        ("a.json", D1, 3), ("b.json.gz", D1, 2), ("c.json", D2, 2)]
+    assert _ledger(spark) == _listing(raw)
+    versions = len(_history(spark, "raw.bronze_tiktok_raw"))
+
+    # Nạp lại cùng file: không đọc, không ghi gì
+    notebook.run(CONFIG, CELL_A, CELL_B, dates=[D1, D2])
+    assert "mới / đổi: 0" in capsys.readouterr().out
+    assert _rows(spark, "raw.bronze_tiktok_raw", drop=["_ingest_time"]) == bronze
+    assert len(_history(spark, "raw.bronze_tiktok_raw")) == versions
+    assert _ledger(spark) == _listing(raw)
+
+    # Lần trước lỗi sau khi append, trước khi ghi ledger -> file nạp lại, dòng cũ của file bị xoá trước
+    spark.sql(f"DELETE FROM raw.bronze_file_ledger WHERE path = 'file:{c}'")
+    notebook.run(CONFIG, CELL_A, CELL_B, dates=[D1, D2])
+    assert "mới / đổi: 1" in capsys.readouterr().out
+    assert _rows(spark, "raw.bronze_tiktok_raw", drop=["_ingest_time"]) == bronze
+    assert _ledger(spark) == _listing(raw)
+
+    # Cell 2 ghi đè file (đổi size / modificationTime) -> chỉ dòng của file đó được thay
+    _write_raw(raw, D1, "a.json", [_rec("fresh", 1, 123)])
+    notebook.run(CONFIG, CELL_A, CELL_B, dates=[D1, D2])
+    assert "mới / đổi: 1" in capsys.readouterr().out
+    now = _rows(spark, "raw.bronze_tiktok_raw", drop=["_ingest_time"])
+    src = spark.table("raw.bronze_tiktok_raw").columns.index("_source_file") - 1  # sau khi bỏ _ingest_time
+    assert [r for r in now if r[src] != f"file:{a}"] == [r for r in bronze if r[src] != f"file:{a}"]
+    assert [r[2] for r in now if r[src] == f"file:{a}"] == ["Fresh"]
+    assert _ledger(spark) == _listing(raw)
+    assert len(_ledger(spark)) == 3
+
+
+# ------------- INCREMENTAL == FULL -------------
+REPLACED = ["silver.silver_trend_base", "silver.silver_trend", "gold.trend_by_day_topk", "gold.trend_daily_cube"]
+
+
+def _versions(spark) -> dict:
+    return {t: _history(spark, t)[-1].version for t in REPLACED}
+
+
+def _assert_replaced_from(spark, before: dict, day: str):
+    """Từ version `before`, mỗi bảng chỉ được ghi bằng INSERT ... REPLACE WHERE dt >= day (không CREATE OR REPLACE)."""
+    for t, version in before.items():
+        ops = [h for h in _history(spark, t) if h.version > version]
+        writes = [h for h in ops if h.operation == "WRITE"]
+        assert writes, (t, [h.operation for h in ops])
+        assert all(day in str(h.operationParameters) for h in writes), (t, writes)
+        assert not [h for h in ops if "CREATE" in h.operation], t
+
+
+def test_incremental_build_matches_full(notebook, capsys):
+    spark, raw = notebook.spark, notebook.raw
+
+    # Lượt 1: bảng chưa có -> build_since None, dựng toàn bộ
+    _write_raw(raw, D1, "part-0.json", _day(1))
+    _write_raw(raw, D2, "part-0.json.gz", _day(2))
+    notebook.run(*PIPELINE, dates=[D1, D2])
+    out = capsys.readouterr().out
+    assert "silver.silver_trend: FULL" in out and "gold.trend_daily_cube: FULL" in out
+    # rank 0 mỗi ngày -> quarantine (quality_issues không được NULL)
+    quarantine = spark.table("silver.silver_trend_quarantine").select("quality_issues").collect()
+    assert [r.quality_issues for r in quarantine] == [["rank_invalid"]] * 2
+
+    # Lượt 2: 2 dt mới + D2 ingest lại (dữ liệu về muộn: bớt 1 hashtag, đổi view) -> tính lại từ D2
+    _write_raw(raw, D2, "part-0.json.gz", _day(2, drop=("travel",), bump=7))
+    _write_raw(raw, D3, "part-0.json", _day(3))
+    _write_raw(raw, D4, "part-0.json", _day(4, drop=("dance",)), items=True)
+    before = _versions(spark)
+    notebook.run(*PIPELINE, dates=[D2, D3, D4])
+    out = capsys.readouterr().out
+    for table in REPLACED:
+        assert f"{table}: dt >= {D2}" in out
+    _assert_replaced_from(spark, before, D2)
+    assert f"merged from {D2}" in out
+    incremental = _snapshot(spark)
+    assert {str(r[0]) for r in _rows(spark, "gold.hashtag_dim")} == {D1, D2, D3, D4}
+    assert not [r for r in incremental["gold.hashtag_dim"] if str(r[0]) == D2 and r[1] == "travel"]
+    assert incremental == _full_rebuild(notebook, [D2, D3, D4])
+
+    # Lượt 3: dòng Bronze cũ có dt NULL ở D1 (loader cũ) + dt mới D5 -> PATCH lùi mốc về D1
+    capsys.readouterr()
+    retro = [_rec("retro", 4, 999, trendingHistogram="[]", relatedCreators="[]"),
+             _rec("retro", 3, 998, country="US", trendingHistogram="[]", relatedCreators="[]")]
+    legacy = (spark.createDataFrame(retro,
+                                    "t_id STRING, id STRING, name STRING, url STRING, countryCode STRING, "
+                                    "industryName STRING, type STRING, rank BIGINT, rankDiff BIGINT, "
+                                    "videoCount BIGINT, viewCount BIGINT, isPromoted BOOLEAN, "
+                                    "markedAsNew BOOLEAN, trendingHistogram STRING, relatedCreators STRING")
+              .selectExpr("*", "current_timestamp() AS _ingest_time",
+                          f"'file:{raw}/dt={D1}/legacy.json' AS _source_file", "CAST(NULL AS DATE) AS dt"))
+    legacy.write.mode("append").saveAsTable("raw.bronze_tiktok_raw")
+    _write_raw(raw, D5, "part-0.json", _day(5))
+    before = _versions(spark)
+    notebook.run(*PIPELINE, dates=[D5])
+    out = capsys.readouterr().out
+    for table in REPLACED:
+        assert f"{table}: dt >= {D1}" in out
+    _assert_replaced_from(spark, before, D1)
+    incremental = _snapshot(spark)
+    assert ("retro", "US") in {(r[1], r[2]) for r in incremental["gold.hashtag_dim"] if str(r[0]) == D1}
+    assert spark.sql("SELECT COUNT(*) c FROM raw.bronze_tiktok_raw WHERE dt IS NULL").first().c == 0
+    assert incremental == _full_rebuild(notebook, [D5])
+
+
+def test_cluster_cell_covers_every_built_table(notebook, capsys):
+    _write_raw(notebook.raw, D1, "part-0.json", _day(1))
+    notebook.run(*PIPELINE, dates=[D1])
+    out = capsys.readouterr().out
+    # Cell 4d: mọi bảng trong CLUSTER_KEYS đã có đều được xử lý (Cluster by / Skip khi runtime không hỗ trợ)
+    existing = [t for t in notebook.ns["CLUSTER_KEYS"] if notebook.spark.catalog.tableExists(t)]
+    assert "silver.silver_trend" in existing and "gold.hashtag_dim" in existing
+    for t in existing:
+        assert f": {t}" in out or f"Skip: {t}" in out
+    assert "Skip (chưa có): gold.trend_momentum" in out
@@ -0,0 +1,59 @@
+# tests/test_prompt_context.py
+# Context Tab 9 (util/prompt_context.py): CSV đúng với giá trị có dấu phẩy / nháy / xuống dòng,
+# gộp hashtag không phân biệt hoa thường nhưng giữ nguyên cách viết khi hiển thị, cắt theo ngân sách.
+import csv
+import io
+
+import numpy as np
+import pandas as pd
+
+from util.prompt_context import _csv_lines, compile_context, merge_hashtags
+
+
+def test_csv_lines_one_entry_per_record():
+    df = pd.DataFrame({
+        "industry": ["Food, Drink", 'Say "hi"', "line1\nline2", None],
+        "share": [0.123456, 0.5, np.nan, 1.0],
+        "views": [1.0, np.nan, 3.0, 4.0],  # float vì NaN -> ghi lại số nguyên
+    })
+    lines = _csv_lines(df)
+    assert len(lines) == len(df) + 1
+    assert lines[0] == "industry,share,views"
+    assert lines[1] == '"Food, Drink",0.1235,1'
+    assert lines[3] == '"line1\nline2",,3'
+    parsed = list(csv.reader(io.StringIO("\n".join(lines))))
+    assert parsed[1:] == [["Food, Drink", "0.1235", "1"], ['Say "hi"', "0.5", ""],
+                          ["line1\nline2", "", "3"], ["", "1", "4"]]
+
+
+def test_merge_is_case_insensitive_but_keeps_spelling():
+    df, duplicates = merge_hashtags({
+        "prefer": ["#FoodTok", " AnVat "],
+        "hot_top10": [{"hashtag": "foodtok", "view_delta": 120, "rank": 3}],
+        "weekly_top": ["FOODTOK", "#", {"hashtag": pd.NA}],  # NULL từ cột Arrow
+    })
+    assert df["hashtag"].tolist() == ["FoodTok", "AnVat"]
+    assert df.loc[0, "groups"] == "prefer|hot|weekly"
+    assert df.loc[0, "view_delta"] == 120
+    assert duplicates == 2
+
+
+def test_compile_context_avoid_and_budget():
+    payload = {
+        "filters_active": {"countries": ["VN"]},
+        "hashtags": {
+            "avoid": ["#OldTrend", "oldtrend", "Bye"],
+            "prefer": [f"Tag{i}" for i in range(200)],
+        },
+        "market": {"industry_share_latest": [{"industry": "Food, Drink\nSnacks", "share": 0.4}]},
+    }
+    text, stats = compile_context(payload, budget_tokens=10_000)
+    assert "## avoid (hashtag đang giảm, hạn chế dùng)\nOldTrend,Bye" in text
+    assert "\nTag0,prefer\n" in text
+    assert '"Food, Drink\nSnacks",0.4' in text
+    assert stats["rows_kept"] == stats["rows_total"] == 201
+
+    small, small_stats = compile_context(payload, budget_tokens=300)
+    assert small_stats["tokens"] <= 300
+    assert 0 < small_stats["rows_kept"] < small_stats["rows_total"]
+    assert "hashtag,groups" in small and "Tag0,prefer" in small
@@ -0,0 +1,119 @@
+# tests/test_result_cache.py
+# Backend cache kết quả bền vững: đọc / ghi lại đúng bảng, LRU theo dung lượng, chọn backend theo [cache].
+import time
+import types
+
+import pyarrow as pa
+import pytest
+
+from util import result_cache
+from util.result_cache import DiskCache, MemoryCache, RedisCache, from_config, response_cache_from_config
+
+fakeredis = pytest.importorskip("fakeredis")
+
+TABLE = pa.table({"hashtag": ["food", "travel"], "view_count": [10, 20]})
+BLOB = b"x" * 100
+
+
+@pytest.fixture
+def redis_client():
+    return fakeredis.FakeRedis()
+
+
+@pytest.fixture(params=["memory", "disk", "redis"])
+def make_cache(request, tmp_path, redis_client):
+    def make(max_bytes=10_000, ttl=None):
+        if request.param == "memory":
+            return MemoryCache(max_bytes=max_bytes, ttl=ttl)
+        if request.param == "disk":
+            return DiskCache(str(tmp_path / "results"), max_bytes=max_bytes, ttl=ttl)
+        return RedisCache(redis_client, prefix="test", max_bytes=max_bytes, ttl=ttl)
+    return make
+
+
+def test_table_round_trip(make_cache):
+    cache = make_cache()
+    assert cache.get_table("k") is None
+    cache.put_table("k", TABLE)
+    assert cache.get_table("k").equals(TABLE)
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_lru_eviction_by_size(make_cache):
+    cache = make_cache(max_bytes=250)  # vừa 2 blob 100 byte
+    for key in ["a", "b"]:
+        cache.put(key, BLOB)
+        time.sleep(0.01)
+    assert cache.get("a") == BLOB  # "a" vừa dùng -> "b" là ít dùng gần đây nhất
+    time.sleep(0.01)
+    cache.put("c", BLOB)
+    assert cache.get("b") is None
+    assert cache.get("a") == BLOB
+    assert cache.get("c") == BLOB
+    assert cache.stats()["evictions"] == 1
+
+
+def test_overwrite_does_not_double_count_size(make_cache):
+    cache = make_cache(max_bytes=250)
+    for _ in range(5):
+        cache.put("a", BLOB)
+    cache.put("b", BLOB)
+    assert cache.get("a") == BLOB and cache.get("b") == BLOB
+    assert cache.stats()["evictions"] == 0
+
+
+def test_clear(make_cache):
+    cache = make_cache()
+    cache.put("a", BLOB)
+    cache.clear()
+    assert cache.get("a") is None
+
+
+def test_redis_keys_are_namespaced(redis_client):
+    RedisCache(redis_client, prefix="p1").put("k", BLOB)
+    assert RedisCache(redis_client, prefix="p2").get("k") is None
+    assert redis_client.get("p1:r:k") == BLOB
+
+
+def test_redis_ttl_expiry_cleans_metadata(redis_client):
+    cache = RedisCache(redis_client, prefix="t", ttl=60)
+    cache.put("k", BLOB)
+    assert 0 < redis_client.ttl("t:r:k") <= 60
+    redis_client.delete("t:r:k")  # như key đã hết hạn
+    assert cache.get("k") is None
+    assert redis_client.zcard("t:lru") == 0
+    assert redis_client.hlen("t:size") == 0
+
+
+def test_from_config_selects_backend(tmp_path, monkeypatch, redis_client):
+    assert from_config({}) is None
+    assert from_config({"backend": "memory"}) is None
+
+    disk = from_config({"backend": "disk", "dir": str(tmp_path / "r"), "max_size": "1MB", "ttl_seconds": 30})
+    assert isinstance(disk, DiskCache)
+    assert disk.max_bytes == 1024 ** 2 and disk.ttl == 30
+
+    urls = []
+
+    def from_url(url):
+        urls.append(url)
+        return redis_client
+
+    monkeypatch.setattr(result_cache, "redis", types.SimpleNamespace(Redis=types.SimpleNamespace(from_url=from_url)))
+    cache = from_config({"backend": "Redis", "url": "redis://cache:6379/1", "prefix": "tt", "max_size": "2m"})
+    assert isinstance(cache, RedisCache)
+    assert urls == ["redis://cache:6379/1"]
+    assert cache.prefix == "tt" and cache.max_bytes == 2 * 1024 ** 2
+    cache.put_table("k", TABLE)
+    assert cache.get_table("k").equals(TABLE)
+
+    monkeypatch.setattr(result_cache, "redis", None)
+    with pytest.raises(RuntimeError):
+        from_config({"backend": "redis"})
+
+
+def test_response_cache_from_config(tmp_path):
+    assert isinstance(response_cache_from_config({}), MemoryCache)
+    disk = response_cache_from_config({"backend": "disk", "dir": str(tmp_path), "ai_max_size": "1k"})
+    assert disk.directory == str(tmp_path / "ai") and disk.suffix == ".json" and disk.max_bytes == 1024
@@ -0,0 +1,64 @@
+# tests/test_run_sql_many.py
+# run_sql_many (util/db.py) trên pool + DB giả: các query chạy song song, timeout tính từ lúc submit,
+# query lỗi / quá hạn chỉ nằm trong errors, các query khác vẫn trả kết quả.
+import time
+
+import pytest
+
+from util import db
+from util.db import ConnectionPool, _fetch_arrow, run_sql_many
+
+
+@pytest.fixture
+def pool(stub_db, monkeypatch):
+    """run_sql / get_pool của util.db chạy thẳng trên stub_db (không Streamlit cache, không warehouse)."""
+    pool = ConnectionPool(stub_db.connect, size=4)
+    monkeypatch.setattr(db, "get_pool", lambda: pool)
+    monkeypatch.setattr(db, "run_sql", lambda query, params=None, engine="warehouse":
+                        pool.run(lambda conn: _fetch_arrow(conn, query, params, None)))
+    return pool
+
+
+def test_queries_run_concurrently(stub_db, pool):
+    queries = {f"q{i}": f"SELECT {i}" for i in range(4)}
+    stub_db.delays = {sql: 0.3 for sql in queries.values()}
+    t0 = time.monotonic()
+    results, errors = run_sql_many(queries)
+    elapsed = time.monotonic() - t0
+    assert errors == {} and set(results) == set(queries)
+    assert stub_db.peak == 4  # mặc định max_workers = cỡ pool
+    assert elapsed < 2 * 0.3  # ~ query chậm nhất, không phải tổng 1.2s
+
+
+def test_max_workers_bounds_concurrency(stub_db, pool):
+    queries = {f"q{i}": f"SELECT {i}" for i in range(4)}
+    stub_db.delays = {sql: 0.1 for sql in queries.values()}
+    results, errors = run_sql_many(queries, max_workers=2)
+    assert len(results) == 4 and errors == {}
+    assert stub_db.peak == 2
+
+
+def test_failing_query_is_isolated(stub_db, pool):
+    stub_db.failing = {"SELECT bad"}
+    stub_db.delays = {"SELECT slow": 0.2}
+    results, errors = run_sql_many({"bad": "SELECT bad", "ok": "SELECT 1", "slow": ("SELECT slow", {"p": 1})})
+    assert set(results) == {"ok", "slow"} and set(errors) == {"bad"}
+    assert isinstance(errors["bad"], RuntimeError) and "SELECT bad" in str(errors["bad"])
+    assert results["ok"].num_rows == 1
+
+
+def test_timeout_counts_from_submission(stub_db, pool):
+    # 1 thread: "hang" giữ thread quá hạn, "queued" phải chờ sau nó -> cũng quá hạn, không chờ mãi
+    stub_db.delays = {"SELECT hang": 1.0, "SELECT fast": 0.05}
+    t0 = time.monotonic()
+    results, errors = run_sql_many({"fast": "SELECT fast", "hang": "SELECT hang", "queued": "SELECT queued"},
+                                   max_workers=1, timeout=0.3)
+    elapsed = time.monotonic() - t0
+    assert set(results) == {"fast"}
+    assert set(errors) == {"hang", "queued"}
+    assert all(isinstance(e, TimeoutError) for e in errors.values())
+    assert elapsed < 0.3 + 0.2  # trả về ngay khi hết hạn, không chờ query treo chạy xong
+
+
+def test_empty_batch():
+    assert run_sql_many({}) == ({}, {})
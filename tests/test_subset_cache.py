@@ -0,0 +1,166 @@
+# tests/test_subset_cache.py
+# Subset cache (util/subset_cache.py): khi nào kết quả rộng bao trùm filter hẹp hơn, lọc lại trên pandas
+# giữ đúng nghĩa SQL (LIKE, NULL), LRU và thay kết quả con bằng kết quả cha trong put.
+import re
+
+import pandas as pd
+import pytest
+
+from util.filters import filter_params
+from util.subset_cache import DIMS, SubsetCache, _like_regex, covers, filter_spec, narrow
+
+COLS = {"date": "dt", "country": "country_code", "industry": "industry", "keyword": ("hashtag_raw", "hashtag")}
+
+
+def _spec(start="2025-03-01", end="2025-03-31", countries=("ALL",), industries=("ALL",), keyword=""):
+    return filter_spec(filter_params(start, end, list(countries), list(industries), keyword))
+
+
+@pytest.fixture
+def df():
+    return pd.DataFrame({
+        "dt": pd.to_datetime(["2025-03-01", "2025-03-02", "2025-03-03", None, "2025-03-05", "2025-03-06"]),
+        "country_code": ["VN", "US", None, "VN", "VN", "US"],
+        "industry": ["Food", None, "Food", "Tech", "Food", "Tech"],
+        "hashtag_raw": ["FoodTok", None, "50%_off", "Tag.x", None, "TagYx"],
+        "hashtag": ["foodtok", "dance", "50_off", "tag.x", None, "tagyx"],
+    })
+
+
+def test_filter_spec_from_bound_params():
+    spec = _spec(countries=["VN", "ALL"], keyword="FoOd")
+    assert spec == {"date": (pd.Timestamp("2025-03-01"), pd.Timestamp("2025-03-31")),
+                    "country": frozenset({"VN"}), "industry": None, "keyword": "food"}
+    # Chỉ có cận trên loại trừ -> ngày cuối = f_end_excl - 1
+    assert filter_spec({"f_end_excl": "2025-04-01"})["date"] == (None, pd.Timestamp("2025-03-31"))
+
+
+@pytest.mark.parametrize("outer, inner, expected", [
+    ({}, {"start": "2025-03-05", "end": "2025-03-10"}, True),
+    ({"start": "2025-03-05"}, {}, False),                    # hẹp hơn về đầu
+    ({"end": "2025-03-10"}, {"end": "2025-03-11"}, False),   # hẹp hơn về cuối
+    ({"start": None, "end": None}, {}, True),                # không lọc ngày bao trùm mọi khoảng
+    ({}, {"start": None}, False),
+])
+def test_covers_date_range(outer, inner, expected):
+    assert covers(_spec(**outer), _spec(**inner), DIMS) is expected
+
+
+@pytest.mark.parametrize("outer, inner, expected", [
+    ({"countries": ["ALL"]}, {"countries": ["VN"]}, True),
+    ({"countries": ["VN", "US"]}, {"countries": ["VN"]}, True),
+    ({"countries": ["VN"]}, {"countries": ["VN", "US"]}, False),
+    ({"countries": ["VN"]}, {"countries": ["ALL"]}, False),
+    ({"industries": ["Food", "Tech"]}, {"industries": ["Tech"], "countries": ["US"]}, True),
+    ({"industries": ["Food"]}, {"industries": ["Tech"]}, False),
+])
+def test_covers_country_industry_subsets(outer, inner, expected):
+    assert covers(_spec(**outer), _spec(**inner), DIMS) is expected
+
+
+@pytest.mark.parametrize("outer, inner, expected", [
+    ("", "food", True),
+    ("foo", "food", True),       # mọi chuỗi chứa "food" đều chứa "foo"
+    ("ood", "food", True),
+    ("food", "foo", False),
+    ("fo_d", "food", False),     # không phải chuỗi con -> không suy ra được, query lại
+    ("50%", "50%_off", True),
+])
+def test_covers_keyword_substring(outer, inner, expected):
+    assert covers(_spec(keyword=outer), _spec(keyword=inner), DIMS) is expected
+
+
+def test_covers_requires_exact_match_on_dims_not_narrowable():
+    # Keyword không lọc lại được (VD bảng đã GROUP BY) -> phải khớp tuyệt đối
+    assert not covers(_spec(keyword="foo"), _spec(keyword="food"), {"date", "country", "industry"})
+    assert covers(_spec(keyword="foo", countries=["ALL"]), _spec(keyword="foo", countries=["VN"]),
+                  {"date", "country", "industry"})
+
+
+@pytest.mark.parametrize("keyword, text, expected", [
+    ("50%off", "50% off", True),   # % = chuỗi bất kỳ
+    ("50%off", "50off", True),
+    ("a_c", "abc", True),          # _ = đúng 1 ký tự
+    ("a_c", "ac", False),
+    ("a_c", "abbc", False),
+    ("tag.x", "tagyx", False),     # ký tự đặc biệt của regex được escape
+    ("(x)+", "(x)+", True),
+    ("(x)+", "xx", False),
+])
+def test_like_regex(keyword, text, expected):
+    assert bool(re.search(_like_regex(keyword), text)) is expected
+
+
+def test_narrow_matches_sql_semantics_for_nulls(df):
+    out = narrow(df, _spec(start="2025-03-02", end="2025-03-06"), COLS)
+    assert out["dt"].dt.day.tolist() == [2, 3, 5, 6]           # dt NULL bị loại như trong SQL
+    out = narrow(df, _spec(countries=["VN"]), COLS)
+    assert out["hashtag"].tolist() == ["foodtok", None]         # country NULL không thuộc IN (...)
+    out = narrow(df, _spec(industries=["Food", "Tech"]), COLS)
+    assert len(out) == 4                                        # NULL industry loại, dt NULL cũng loại (khoảng ngày)
+    # Không lọc chiều nào ngoài ngày -> giữ dòng có country / industry NULL
+    assert len(narrow(df, _spec(), COLS)) == 5
+
+
+def test_narrow_keyword_coalesce_and_like(df):
+    spec = _spec(start=None, end=None, keyword="DAN")
+    # hashtag_raw NULL -> dùng hashtag (COALESCE); cả 2 NULL -> không khớp
+    assert narrow(df, spec, COLS)["hashtag"].tolist() == ["dance"]
+    assert narrow(df, _spec(start=None, end=None, keyword="50%_o"), COLS)["hashtag"].tolist() == ["50_off"]
+    assert narrow(df, _spec(start=None, end=None, keyword="tag.x"), COLS)["hashtag"].tolist() == ["tag.x"]
+    assert narrow(df, _spec(start=None, end=None, keyword="tag_x"), COLS)["hashtag"].tolist() == ["tag.x", "tagyx"]
+
+
+def test_get_narrows_from_cached_superset(df):
+    cache = SubsetCache()
+    cache.put("k", _spec(), COLS, set(DIMS), df)
+    hit = cache.get("k", _spec(countries=["US"]), COLS, set(DIMS))
+    assert hit["hashtag"].tolist() == ["dance", "tagyx"]
+    assert cache.get("k", _spec(start="2025-02-01"), COLS, set(DIMS)) is None
+    assert (cache.hits, cache.misses) == (1, 1)
+    # Bản sao: sửa kết quả trả về không làm hỏng cache
+    hit.loc[0, "hashtag"] = "x"
+    assert cache.get("k", _spec(countries=["US"]), COLS, set(DIMS))["hashtag"].tolist() == ["dance", "tagyx"]
+
+
+def test_get_ignores_dims_the_query_does_not_filter(df):
+    cache = SubsetCache()
+    cache.put("k", _spec(countries=["VN"]), COLS, {"date"}, df)
+    # Query không lọc country -> filter country khác vẫn dùng lại kết quả, không lọc lại theo country
+    assert len(cache.get("k", _spec(countries=["US"]), COLS, {"date"})) == 5
+
+
+def test_put_replaces_entries_covered_by_new_superset(df):
+    cache = SubsetCache()
+    cache.put("k", _spec(countries=["VN"]), COLS, set(DIMS), df[df["country_code"] == "VN"])
+    cache.put("k", _spec(countries=["US"]), COLS, set(DIMS), df[df["country_code"] == "US"])
+    assert cache._count() == 2
+    cache.put("k", _spec(), COLS, set(DIMS), df)
+    assert cache._count() == 1
+    # Kết quả hẹp hơn thêm sau không thay kết quả cha; get chọn kết quả nhỏ nhất bao trùm
+    narrow_df = df[df["country_code"] == "VN"]
+    cache.put("k", _spec(countries=["VN"]), COLS, set(DIMS), narrow_df)
+    assert cache._count() == 2
+    assert len(cache.get("k", _spec(countries=["VN"], keyword="food"), COLS, set(DIMS))) == 1
+    assert len(cache.get("k", _spec(countries=["US"]), COLS, set(DIMS))) == 2
+
+
+def test_put_evicts_least_recently_used_key(df):
+    cache = SubsetCache(max_entries=2)
+    cache.put("a", _spec(), COLS, set(DIMS), df)
+    cache.put("b", _spec(), COLS, set(DIMS), df)
+    assert cache.get("a", _spec(), COLS, set(DIMS)) is not None  # "a" vừa dùng -> "b" cũ nhất
+    cache.put("c", _spec(), COLS, set(DIMS), df)
+    assert cache.get("b", _spec(), COLS, set(DIMS)) is None
+    assert cache.get("a", _spec(), COLS, set(DIMS)) is not None
+    assert cache.get("c", _spec(), COLS, set(DIMS)) is not None
+
+
+def test_put_skips_results_missing_filter_columns(df):
+    cache = SubsetCache()
+    cache.put("k", _spec(), COLS, set(DIMS), pd.DataFrame())  # VD query lỗi -> DataFrame rỗng
+    cache.put("k", _spec(), COLS, set(DIMS), df.drop(columns=["industry"]))
+    assert cache._count() == 0
+    # Cột của chiều query không lọc thì không cần
+    cache.put("k", _spec(), COLS, {"date", "country"}, df.drop(columns=["industry", "hashtag_raw"]))
+    assert cache._count() == 1
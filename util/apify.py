@@ -0,0 +1,310 @@
+# util/apify.py
+# Gọi Apify API cho Cell 1 / Cell 2 của main.ipynb: rate limit dùng chung giữa các thread ingest,
+# retry 429 / 5xx, duyệt dataset theo trang và tải dataset thành part file JSONL có thể chạy tiếp,
+# vòng ingest song song theo dt (mỗi run / dataset chỉ tải 1 lần).
+# Không phụ thuộc Spark / dbutils -> test được với server Apify giả (tests/test_apify.py).
+import gzip
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import requests
+
+DEFAULT_BASE_URL = "https://api.apify.com/v2"
+
+
+class RateLimiter:
+    """Token bucket: tối đa `rate` request / giây, dùng chung giữa các thread ingest."""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.ts = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return  # 0 = không giới hạn
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.ts) * self.rate)
+                self.ts = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class ApifyClient:
+    """
+    Client Apify dùng chung cho cả lượt ingest: 1 session (keep-alive), 1 rate limiter,
+    token tự gắn vào mọi request. session / limiter truyền vào được (VD session giả khi test).
+    """
+
+    def __init__(self, token: str, base_url: str = DEFAULT_BASE_URL, session=None,
+                 limiter: RateLimiter = None, page_size: int = 1000, max_retries: int = 6):
+        self.token = token
+        self.base_url = base_url.rstrip("/")
+        self.session = session or requests.Session()
+        self.limiter = limiter or RateLimiter(0)
+        self.page_size = page_size
+        self.max_retries = max_retries
+
+    def request(self, method, url, params=None, json_body=None,
+                max_retries=None, timeout=60, raw_lines=False):
+        """
+        Wrapper gọi Apify:
+          - Tự gắn ?token= nếu thiếu.
+          - Retry cho lỗi tạm thời (5xx, 429 - ưu tiên header Retry-After).
+          - Mọi lần gọi (kể cả retry) đi qua limiter.
+          - Trả về JSON / list từ JSONL nếu có thể.
+          - raw_lines=True: đọc stream từng dòng, trả list dòng JSONL (chưa parse) - dùng cho từng trang
+            dataset; lỗi giữa chừng -> retry cả trang.
+        """
+        params = dict(params or {})
+        max_retries = max_retries or self.max_retries
+
+        # Gắn token nếu chưa có
+        if "token" not in params and "token=" not in url:
+            params["token"] = self.token
+
+        last_err = None
+
+        for i in range(max_retries):
+            retry_after = None
+            resp = None
+            try:
+                self.limiter.acquire()
+                resp = self.session.request(
+                    method,
+                    url,
+                    params=params,
+                    json=json_body,
+                    timeout=timeout,
+                    stream=raw_lines,
+                )
+
+                # Retry nếu bị rate limit / 5xx
+                if resp.status_code == 429:
+                    retry_after = resp.headers.get("Retry-After")
+                    raise RuntimeError(f"429 rate limited: {resp.text[:200]}")
+                if resp.status_code >= 500:
+                    raise RuntimeError(f"5xx {resp.status_code}: {resp.text[:200]}")
+                resp.raise_for_status()
+
+                if raw_lines:
+                    resp.encoding = "utf-8"
+                    return [ln for ln in resp.iter_lines(decode_unicode=True) if ln and ln.strip()]
+
+                ctype = (resp.headers.get("content-type") or "").lower()
+
+                # JSON chuẩn
+                if "application/json" in ctype:
+                    return resp.json()
+
+                # JSON stream / JSONL
+                if "application/x-json-stream" in ctype:
+                    lines = [ln for ln in resp.text.splitlines() if ln.strip()]
+                    return [json.loads(ln) for ln in lines]
+
+                # Fallback: thử parse JSON, không được thì trả text
+                try:
+                    return resp.json()
+                except Exception:
+                    return resp.text
+
+            except Exception as ex:
+                last_err = ex
+                if resp is not None:
+                    resp.close()  # stream=True: trả kết nối về pool trước khi chờ / thử lại
+                if i == max_retries - 1:
+                    raise RuntimeError(f"Apify request failed after {max_retries} attempts: {ex}")
+                try:
+                    wait = float(retry_after) if retry_after else min(2**i, 30)
+                except ValueError:
+                    wait = min(2**i, 30)
+                time.sleep(wait)
+
+        raise last_err or RuntimeError("Unknown Apify error")
+
+    def iter_pages(self, ds_id: str, offset: int = 0, page_size: int = None):
+        """
+        Duyệt {base_url}/datasets/{ds_id}/items theo trang offset/limit (format=jsonl).
+        yield (offset sau trang, [dòng JSONL]) - bộ nhớ chỉ giữ 1 trang, không phụ thuộc cỡ dataset.
+        """
+        page_size = page_size or self.page_size
+        while True:
+            lines = self.request(
+                "GET",
+                f"{self.base_url}/datasets/{ds_id}/items",
+                params={"clean": "true", "format": "jsonl", "offset": offset, "limit": page_size},
+                raw_lines=True,
+            )
+            if not lines:
+                return
+            offset += len(lines)
+            yield offset, lines
+            if len(lines) < page_size:
+                return
+
+
+def _save_progress(marker: str, state: dict):
+    tmp = marker + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp, marker)
+
+
+def download_dataset(client: ApifyClient, ds_id: str, stage: str, stem: str, part_rows: int,
+                     compress: bool = False, local_stage: str = None) -> dict:
+    """
+    Tải dataset về thư mục `stage` thành các part file `{stem}.part-00000.json[.gz]`,
+    mỗi part tối đa `part_rows` dòng. Part chỉ được công nhận (ghi vào _PROGRESS cùng offset)
+    khi đã đóng file -> chạy lại sau lỗi sẽ bỏ part dở và tải tiếp từ offset đã lưu.
+    local_stage: đường dẫn ghi file thật của `stage` (VD dbfs:/... -> /dbfs/...), mặc định = stage.
+    Trả về state: {"stage", "offset", "parts", "done"}.
+    """
+    local_stage = local_stage or stage
+    os.makedirs(local_stage, exist_ok=True)
+    marker = f"{local_stage}/_PROGRESS"
+    state = {"stage": stage, "offset": 0, "parts": [], "done": False}
+    if os.path.exists(marker):
+        with open(marker) as f:
+            state.update(json.load(f))
+    if state["done"]:
+        return state
+
+    ext = ".json.gz" if compress else ".json"
+    part = None
+
+    def close_part(offset):
+        name, tmp, fh = part
+        fh.close()
+        os.replace(tmp, f"{local_stage}/{name}")
+        state["parts"].append(name)
+        state["offset"] = offset
+        _save_progress(marker, state)
+
+    offset, rows = state["offset"], 0
+    try:
+        for offset, lines in client.iter_pages(ds_id, state["offset"]):
+            if part is None:
+                name = f"{stem}.part-{len(state['parts']):05d}{ext}"
+                tmp = f"{local_stage}/_{name}.tmp"
+                fh = gzip.open(tmp, "wt", encoding="utf-8") if compress else open(tmp, "w", encoding="utf-8")
+                part, rows = (name, tmp, fh), 0
+            part[2].write("\n".join(lines) + "\n")
+            rows += len(lines)
+            if rows >= part_rows:
+                close_part(offset)
+                part = None
+    except BaseException:
+        if part is not None:
+            part[2].close()  # part dở: đóng file, không ghi vào _PROGRESS -> lần sau ghi lại từ offset đã lưu
+        raise
+    if part is not None:
+        close_part(offset)
+
+    state["done"] = True
+    _save_progress(marker, state)
+    return state
+
+
+class Once:
+    """
+    Memo cho 1 lượt ingest: fn() của mỗi key chỉ chạy 1 lần dù nhiều thread hỏi cùng lúc,
+    thread đến sau chờ kết quả của thread đang chạy. Lỗi không được nhớ: các thread đang chờ nhận
+    cùng lỗi (không retry/backoff lặp lại), nhưng lần hỏi sau chạy lại fn().
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._futures = {}  # key -> Future
+
+    def __call__(self, key, fn):
+        with self._lock:
+            fut = self._futures.get(key)
+            owner = fut is None
+            if owner:
+                fut = self._futures[key] = Future()
+        if owner:
+            try:
+                fut.set_result(fn())
+            except BaseException as ex:
+                with self._lock:
+                    del self._futures[key]
+                fut.set_exception(ex)
+        return fut.result()
+
+    def results(self) -> dict:
+        """{key: kết quả} của các key đã chạy xong không lỗi."""
+        with self._lock:
+            futures = list(self._futures.items())
+        return {k: f.result() for k, f in futures if f.done() and f.exception() is None}
+
+
+def fetch_latest_succeeded_run(client: ApifyClient, task_ref: str):
+    """Run SUCCEEDED gần nhất của task -> (run_id, dataset_id)."""
+    runs = client.request(
+        "GET",
+        f"{client.base_url}/actor-tasks/{task_ref}/runs",
+        params={"limit": 10, "desc": 1}
+    )
+
+    data = runs.get("data", {}) if isinstance(runs, dict) else {}
+    items = data.get("items", data if isinstance(data, list) else [])
+
+    if not isinstance(items, list):
+        raise RuntimeError(f"Response /runs không đúng format: {runs}")
+
+    chosen = next((it for it in items if it.get("status") == "SUCCEEDED"), None)
+    if not chosen:
+        raise RuntimeError(f"Không tìm thấy run SUCCEEDED cho task {task_ref}.")
+
+    return chosen.get("id"), chosen.get("defaultDatasetId")
+
+
+def ingest_dates(client: ApifyClient, task_ref: str, dates, download, publish,
+                 workers: int = 4, run_label: str = "", memo: Once = None) -> list:
+    """
+    Cell 2: ghi run SUCCEEDED mới nhất của task vào từng dt, các dt song song trên `workers` thread.
+    Run và dataset đi qua `memo` -> mỗi run / dataset chỉ gọi API 1 lần cho cả lượt, dù nhiều dt.
+      download(ds_id, stem) -> state của download_dataset
+      publish(dt, state, stem) -> đường dẫn đã ghi; state None = run không có dataset (ghi file rỗng)
+    stem = task_<task>_run_<run_id>[_<run_label>] (run_label để trace lần chạy); lỗi của 1 dt nằm trong kết quả (status ERROR), không dừng dt khác.
+    Trả list kết quả theo thứ tự `dates`.
+    """
+    memo = memo if memo is not None else Once()
+
+    def ingest_one(d: str) -> dict:
+        try:
+            run_id, ds_id = memo(("run", task_ref), lambda: fetch_latest_succeeded_run(client, task_ref))
+            stem = f"task_{task_ref.replace('~', '_')}_run_{run_id or 'NA'}"
+            if run_label:
+                stem += f"_{run_label}"
+            if not ds_id:
+                return {"dt": d, "status": "SUCCEEDED(FETCHED)", "run_id": run_id, "count": 0,
+                        "out_path": publish(d, None, stem)}
+
+            state = memo(("dataset", ds_id), lambda: download(ds_id, stem))
+            return {
+                "dt": d,
+                "status": "SUCCEEDED(FETCHED)",
+                "run_id": run_id,
+                "count": state["offset"],
+                "parts": len(state["parts"]),
+                "out_path": publish(d, state, stem),
+            }
+        except Exception as ex:
+            return {"dt": d, "status": "ERROR", "error": str(ex)}
+
+    dates = list(dates)
+    if not dates:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(dates)))) as pool:
+        return list(pool.map(ingest_one, dates))
@@ -1,22 +1,507 @@
+import hashlib
+import re
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+
 import pandas as pd
+import pyarrow as pa
 from databricks import sql
+from databricks.sql import exc as sql_exc
 import streamlit as st
 
-@st.cache_data(ttl=600, show_spinner=False)
-def run_sql(query: str, params: dict | None = None) -> pd.DataFrame:
+from util import local_engine, result_cache
+
+try:
+    from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+except Exception:
+    add_script_run_ctx = get_script_run_ctx = None
+
+
+class ConnectionPool:
+    """
+    Pool kết nối DB-API dùng chung cho cả process.
+      - Tối đa `size` kết nối được check-out cùng lúc.
+      - Kết nối rảnh quá `idle_seconds` sẽ bị đóng.
+      - Kết nối rảnh quá `ping_after` giây được kiểm tra bằng `SELECT 1` trước khi dùng lại.
+    `connect` là hàm không tham số trả về 1 kết nối DB-API (dễ thay bằng stand-in khi test).
+    """
+
+    def __init__(self, connect, size: int = 4, idle_seconds: float = 300.0,
+                 ping_after: float = 30.0, retry_on: tuple = ()):
+        self._connect = connect
+        self.size = max(1, int(size))
+        self.idle_seconds = float(idle_seconds)
+        self.ping_after = float(ping_after)
+        self.retry_on = tuple(retry_on)
+        self.connects = 0
+        self._idle: list = []  # [(conn, last_used)]
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.size)
+
+    def _open(self):
+        conn = self._connect()
+        with self._lock:
+            self.connects += 1
+        return conn
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    @staticmethod
+    def _alive(conn) -> bool:
+        try:
+            cur = conn.cursor()
+            try:
+                cur.execute("SELECT 1")
+                cur.fetchall()
+            finally:
+                cur.close()
+            return True
+        except Exception:
+            return False
+
+    def _checkout(self):
+        now = time.monotonic()
+        with self._lock:
+            expired = [c for c, ts in self._idle if now - ts > self.idle_seconds]
+            self._idle = [(c, ts) for c, ts in self._idle if now - ts <= self.idle_seconds]
+            item = self._idle.pop() if self._idle else None
+        for conn in expired:
+            self._close(conn)
+        if item is not None:
+            conn, ts = item
+            if now - ts <= self.ping_after or self._alive(conn):
+                return conn, True
+            self._close(conn)
+        return self._open(), False
+
+    def _checkin(self, conn):
+        with self._lock:
+            self._idle.append((conn, time.monotonic()))
+
+    @contextmanager
+    def connection(self):
+        self._slots.acquire()
+        try:
+            conn, _ = self._checkout()
+            try:
+                yield conn
+            except Exception:
+                self._close(conn)
+                raise
+            self._checkin(conn)
+        finally:
+            self._slots.release()
+
+    def run(self, fn):
+        """
+        Chạy fn(conn) trên 1 kết nối của pool.
+        Nếu kết nối tái sử dụng bị hỏng (session hết hạn, lỗi thuộc `retry_on`)
+        thì mở kết nối mới và thử lại đúng 1 lần.
+        """
+        self._slots.acquire()
+        try:
+            conn, reused = self._checkout()
+            try:
+                result = fn(conn)
+            except self.retry_on:
+                self._close(conn)
+                if not reused:
+                    raise
+                conn = self._open()
+                try:
+                    result = fn(conn)
+                except Exception:
+                    self._close(conn)
+                    raise
+            except Exception:
+                self._close(conn)
+                raise
+            self._checkin(conn)
+            return result
+        finally:
+            self._slots.release()
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._close(conn)
+
+
+def _db_config() -> dict:
     cfg = st.secrets.get("databricks", {})
     host = cfg.get("server_hostname")
     http_path = cfg.get("http_path")
     token = cfg.get("access_token")
     assert host and http_path and token, "Missing Databricks secrets in .streamlit/secrets.toml"
-    if params:
-        query = query.format(**params)
-    with sql.connect(server_hostname=host, http_path=http_path, access_token=token) as conn:
-        with conn.cursor() as cur:
+    return cfg
+
+
+@st.cache_resource(show_spinner=False)
+def get_pool() -> ConnectionPool:
+    """Pool dùng chung cho mọi session Streamlit (cấu hình trong [databricks] của secrets.toml)."""
+    cfg = _db_config()
+    return ConnectionPool(
+        lambda: sql.connect(
+            server_hostname=cfg.get("server_hostname"),
+            http_path=cfg.get("http_path"),
+            access_token=cfg.get("access_token"),
+        ),
+        size=cfg.get("pool_size", 4),
+        idle_seconds=cfg.get("pool_idle_seconds", 300),
+        ping_after=cfg.get("pool_ping_after_seconds", 30),
+        retry_on=(sql_exc.OperationalError,),
+    )
+
+
+_PARAM_RE = re.compile(r"(?<![:\w]):([A-Za-z_]\w*)")
+
+
+def bind_params(query: str, params: dict | None) -> dict:
+    """
+    Chỉ giữ các tham số thực sự xuất hiện trong query dưới dạng marker `:tên`.
+    Nhờ vậy cùng 1 câu SQL luôn đi kèm cùng 1 bộ khoá tham số (cache key ổn định),
+    và server không nhận tham số thừa.
+    """
+    if not params:
+        return {}
+    names = set(_PARAM_RE.findall(query))
+    return {k: v for k, v in params.items() if k in names}
+
+
+def _fetch_arrow(conn, query: str, params: dict | None = None,
+                 batch_size: int | None = None) -> pa.Table:
+    """Lấy kết quả dưới dạng pyarrow.Table (fetchall_arrow / fetchmany_arrow), không box từng dòng."""
+    with conn.cursor() as cur:
+        if params:
+            # Native parameter binding (marker `:tên`), SQL text không đổi theo giá trị filter
+            cur.execute(query, params)
+        else:
             cur.execute(query)
+        if not hasattr(cur, "fetchall_arrow"):
+            # Cursor DB-API thuần (không có Arrow) -> đi đường cũ
             rows = cur.fetchall()
             cols = [c[0] for c in cur.description] if cur.description else []
-    return pd.DataFrame.from_records(rows, columns=cols)
+            return pa.Table.from_pandas(pd.DataFrame.from_records(rows, columns=cols), preserve_index=False)
+        if not batch_size:
+            return cur.fetchall_arrow()
+        chunks = []
+        while True:
+            chunk = cur.fetchmany_arrow(batch_size)
+            if chunk.num_rows == 0:
+                break
+            chunks.append(chunk)
+        return pa.concat_tables(chunks) if chunks else chunk
+
+
+def _pandas_dtype(arrow_type: pa.DataType):
+    # Ngày / thời điểm -> datetime64[ns] của numpy (mapper trả None = chuyển mặc định): plotly, .dt,
+    # so sánh với Timestamp chưa hỗ trợ date32[pyarrow] / timestamp[pyarrow]
+    if pa.types.is_date(arrow_type) or pa.types.is_timestamp(arrow_type):
+        return None
+    return pd.ArrowDtype(arrow_type)
+
+
+def arrow_to_pandas(table: pa.Table) -> pd.DataFrame:
+    """
+    DataFrame dùng dtype Arrow (int64[pyarrow], string[pyarrow], ...) thay vì cột object;
+    cột DATE / TIMESTAMP thành datetime64[ns] (NULL -> NaT).
+    Giá trị NULL của cột Arrow là pd.NA: kiểm tra bằng pd.isna, không dùng `x or 0` / `if x:`.
+    """
+    return table.to_pandas(types_mapper=_pandas_dtype, date_as_object=False, coerce_temporal_nanoseconds=True)
+
+
+# ------------- Đếm query thực sự chạy (theo session Streamlit) -------------
+_QUERY_STATS: dict = {}  # session_id -> [số query, tổng giây]
+_QUERY_STATS_LOCK = threading.Lock()
+
+
+def _session_id() -> str:
+    ctx = get_script_run_ctx() if get_script_run_ctx else None
+    return getattr(ctx, "session_id", "") or ""
+
+
+def _record_query(seconds: float) -> None:
+    with _QUERY_STATS_LOCK:
+        stats = _QUERY_STATS.setdefault(_session_id(), [0, 0.0])
+        stats[0] += 1
+        stats[1] += seconds
+
+
+def query_stats() -> tuple[int, float]:
+    """
+    (số query đã chạy thật, tổng giây chạy) của session hiện tại - cộng dồn, không tính cache hit.
+    Lấy hiệu số đầu/cuối 1 lượt chạy script để biết lượt đó tốn bao nhiêu query.
+    """
+    with _QUERY_STATS_LOCK:
+        n, seconds = _QUERY_STATS.get(_session_id(), [0, 0.0])
+    return n, seconds
+
+
+# ------------- Thống kê theo fingerprint (dùng chung cả process, như các cache) -------------
+# fingerprint = SQL dạng chuẩn + tham số + engine + version dữ liệu (result_cache.fingerprint).
+# Đếm số lượt tra, số lượt trúng cache và số chuỗi SQL khác nhau gộp về cùng 1 fingerprint
+# -> thấy tỉ lệ dedupe thật sau khi chuẩn hoá.
+_FINGERPRINT_STATS: dict = {}  # fingerprint -> {"sql", "variants", "lookups", "hits", "canonical_hits"}
+_FINGERPRINT_LOCK = threading.Lock()
+_LOOKUP = threading.local()
+
+
+def sql_fingerprint(query: str, params: dict | None, engine: str = "warehouse", versions: tuple = ()) -> str:
+    """Khoá cache của 1 lần chạy query (params đã qua bind_params)."""
+    return result_cache.fingerprint(query, params, f"{engine}|{versions}")
+
+
+def record_fingerprint(key: str, query: str, hit: bool) -> None:
+    variant = hashlib.sha1(query.encode("utf-8")).hexdigest()
+    with _FINGERPRINT_LOCK:
+        stats = _FINGERPRINT_STATS.get(key)
+        if stats is None:
+            stats = _FINGERPRINT_STATS[key] = {"sql": result_cache.canonical_sql(query), "variants": set(),
+                                               "lookups": 0, "hits": 0, "canonical_hits": 0}
+        new_variant = variant not in stats["variants"]
+        stats["variants"].add(variant)
+        stats["lookups"] += 1
+        if hit:
+            stats["hits"] += 1
+            # Trúng cache với chuỗi SQL chưa từng gặp: chỉ có được nhờ chuẩn hoá
+            stats["canonical_hits"] += new_variant
+
+
+def mark_miss() -> None:
+    """Gọi đầu thân hàm được cache (trước khi gọi lớp cache bên trong, nếu có): lượt tra hiện tại trượt."""
+    _LOOKUP.miss = True
+
+
+def fingerprint_lookup(key: str, query: str, fn, *args):
+    """
+    fn(*args) (hàm có cache, thân hàm gọi mark_miss) rồi ghi thống kê cho `key`.
+    Lồng nhau (cache của app bọc run_sql): chỉ lượt tra ngoài cùng ghi, đúng 1 kết quả / lượt.
+    Kết quả = lớp trong cùng được gọi tới: ngoài trượt nhưng run_sql trúng -> vẫn là trúng cache
+    (không chạy query); lớp nào vào lại fingerprint_lookup thì đặt lại cờ trượt cho lớp đó.
+    """
+    depth = getattr(_LOOKUP, "depth", 0)
+    _LOOKUP.depth = depth + 1
+    _LOOKUP.miss = False
+    try:
+        out = fn(*args)
+    finally:
+        _LOOKUP.depth = depth
+    if depth == 0:
+        record_fingerprint(key, query, hit=not _LOOKUP.miss)
+    return out
+
+
+def fingerprint_stats() -> list[dict]:
+    """1 dòng / fingerprint, nhiều lượt tra nhất trước."""
+    with _FINGERPRINT_LOCK:
+        rows = [{"fingerprint": key[:12], "sql": s["sql"], "variants": len(s["variants"]), "lookups": s["lookups"],
+                 "hits": s["hits"], "canonical_hits": s["canonical_hits"]}
+                for key, s in _FINGERPRINT_STATS.items()]
+    return sorted(rows, key=lambda r: -r["lookups"])
+
+
+def _execute(query: str, params: dict | None = None) -> pa.Table:
+    """Chạy query qua pool, không cache."""
+    params = bind_params(query, params)
+    batch_size = st.secrets.get("databricks", {}).get("arrow_batch_size")
+    t0 = time.perf_counter()
+    try:
+        return get_pool().run(lambda conn: _fetch_arrow(conn, query, params, batch_size))
+    finally:
+        _record_query(time.perf_counter() - t0)
+
+
+@st.cache_resource(show_spinner=False)
+def get_result_cache():
+    """Backend cache kết quả bền vững theo [cache] trong secrets.toml; None = chỉ cache trong RAM."""
+    return result_cache.from_config(dict(st.secrets.get("cache", {})))
+
+
+@st.cache_resource(show_spinner=False)
+def get_ai_cache():
+    """Cache phản hồi AI (Tab 9) theo [cache] trong secrets.toml; không bật backend bền vững -> RAM."""
+    return result_cache.response_cache_from_config(dict(st.secrets.get("cache", {})))
+
+
+def _execute_cached(query: str, params: dict | None = None, versions: tuple = ()) -> pa.Table:
+    """
+    _execute qua cache bền vững (disk / Redis) nếu được bật; khoá gồm version các bảng phụ thuộc.
+    Cache lỗi (Redis mất kết nối, đĩa đầy, ...) không làm hỏng query: chạy thẳng warehouse.
+    """
+    cache = get_result_cache()
+    if cache is None:
+        return _execute(query, params)
+    params = bind_params(query, params)
+    key = sql_fingerprint(query, params, "warehouse", versions)
+    try:
+        table = cache.get_table(key)
+    except Exception:
+        table = None
+    if table is None:
+        table = _execute(query, params)
+        try:
+            cache.put_table(key, table)
+        except Exception:
+            pass
+    return table
+
+
+def engine_config() -> dict:
+    """[engine] trong secrets.toml: mode = "warehouse" | "local", snapshot_dir = thư mục Parquet."""
+    return dict(st.secrets.get("engine", {}))
+
+
+@st.cache_resource(show_spinner="Đang tạo snapshot local…", max_entries=2)
+def get_local_engine(versions: tuple) -> "local_engine.LocalEngine":
+    """
+    1 engine DuckDB cho mỗi bộ version Delta của các bảng snapshot.
+    Version đổi -> snapshot Parquet được tải lại từ warehouse; không kết nối được
+    (version None) -> dùng snapshot sẵn có trên đĩa (chạy offline).
+    """
+    snapshot_dir = engine_config().get("snapshot_dir", ".cache/local_engine")
+    fetch = None if all(v is None for _, v in versions) else _execute
+    return local_engine.LocalEngine.open(snapshot_dir, dict(versions), fetch=fetch)
+
+
+def _local_engine() -> "local_engine.LocalEngine":
+    return get_local_engine(tuple((t, table_version(t)) for t in local_engine.SNAPSHOT_TABLES))
+
+
+@st.cache_data(ttl=60, show_spinner=False)
+def table_version(table: str) -> int | None:
+    """
+    Version Delta mới nhất của bảng (DESCRIBE HISTORY, chỉ đọc metadata, không scan dữ liệu).
+    Trả None nếu không lấy được (view, thiếu quyền, ...).
+    Memo 60s = chu kỳ phát hiện pipeline vừa ghi dữ liệu mới.
+    """
+    try:
+        hist = _execute(f"DESCRIBE HISTORY {table} LIMIT 1")
+    except Exception:
+        return None
+    if hist.num_rows == 0 or "version" not in hist.column_names:
+        return None
+    return hist.column("version")[0].as_py()
+
+
+_TABLE_RE = re.compile(r"\b((?:raw|bronze|silver|gold)\.\w+)", re.IGNORECASE)
+UNVERSIONED_TTL = 600  # giây; bảng không có version Delta (view, ...) -> hết hạn theo thời gian như cũ
+
+
+def referenced_tables(query: str) -> tuple:
+    """Các bảng lakehouse (raw/bronze/silver/gold.<bảng>) mà query đọc."""
+    return tuple(sorted({t.lower() for t in _TABLE_RE.findall(query)}))
+
+
+def data_versions(query: str) -> tuple:
+    """
+    ((bảng, version), ...) của các bảng query đọc - dùng làm 1 phần cache key.
+    Kết quả giữ nguyên giá trị cho tới khi 1 bảng phụ thuộc có version mới;
+    bảng không đọc được version -> mốc thời gian UNVERSIONED_TTL.
+    """
+    out = []
+    for t in referenced_tables(query):
+        v = table_version(t)
+        out.append((t, v if v is not None else f"t{int(time.time() // UNVERSIONED_TTL)}"))
+    return tuple(out)
+
+
+def run_sql(query: str, params: dict | None = None, as_arrow: bool = False,
+            engine: str = "warehouse") -> pd.DataFrame | pa.Table:
+    """
+    Chạy query, kết quả đi theo đường Arrow.
+      - params: tham số bind cho các marker `:tên` trong query
+      - as_arrow=True  -> trả pyarrow.Table
+      - as_arrow=False -> trả DataFrame Arrow-backed (cột có kiểu)
+      - engine="warehouse" -> Databricks SQL; "local" -> DuckDB trên snapshot silver/gold
+    Cache theo fingerprint (SQL dạng chuẩn + tham số + version Delta của các bảng trong query),
+    không hết hạn theo thời gian.
+    """
+    params = bind_params(query, params)
+    versions = data_versions(query)
+    key = sql_fingerprint(query, params, engine, versions)
+    return fingerprint_lookup(key, query, _run_sql_versioned, key, as_arrow, query, params, engine, versions)
+
+
+@st.cache_data(max_entries=1024, show_spinner=False)
+def _run_sql_versioned(key: str, as_arrow: bool, _query: str, _params: dict, _engine: str,
+                       _versions: tuple) -> pd.DataFrame | pa.Table:
+    # Tham số "_..." không vào khoá cache của Streamlit: `key` đã gồm SQL dạng chuẩn, params, engine, version
+    mark_miss()
+    query, params, engine, versions = _query, _params, _engine, _versions
+    if engine == "local":
+        engine_obj = _local_engine()
+        t0 = time.perf_counter()
+        try:
+            table = engine_obj.query(query, params)
+        finally:
+            _record_query(time.perf_counter() - t0)
+    else:
+        table = _execute_cached(query, params, versions)
+    return table if as_arrow else arrow_to_pandas(table)
+
+
+def run_sql_many(queries: dict, max_workers: int | None = None,
+                 timeout: float | None = None, engine: str = "warehouse") -> tuple[dict, dict]:
+    """
+    Chạy nhiều query độc lập song song trên thread pool có giới hạn.
+      - queries: {tên: sql} hoặc {tên: (sql, params)}
+      - max_workers: mặc định = pool_size (không giành kết nối quá sức pool); engine local: 4
+      - timeout: giây cho mỗi query, tính từ lúc submit (kể cả thời gian chờ thread trống): query
+        quá hạn vẫn giữ thread tới khi xong, nếu tính từ lúc bắt đầu thì query xếp hàng sau nó có thể
+        không bao giờ bắt đầu -> chờ mãi
+      - engine: như run_sql
+    Trả (results, errors): query lỗi/quá hạn chỉ nằm trong `errors`, không ảnh hưởng query khác.
+    Query quá hạn vẫn chạy nốt ở nền (kết quả bị bỏ qua).
+    """
+    results: dict = {}
+    errors: dict = {}
+    if not queries:
+        return results, errors
+
+    ctx = get_script_run_ctx() if get_script_run_ctx else None
+
+    def _job(query, params):
+        if ctx is not None:
+            add_script_run_ctx(threading.current_thread(), ctx)
+        return run_sql(query, bind_params(query, params), engine=engine)
+
+    if not max_workers:
+        # Engine local không dùng kết nối warehouse -> không phụ thuộc pool (chạy được offline)
+        max_workers = 4 if engine == "local" else get_pool().size
+    workers = max(1, min(max_workers, len(queries)))
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="run_sql_many")
+    pending, submitted = {}, {}
+    for name, q in queries.items():
+        query, params = q if isinstance(q, tuple) else (q, None)
+        submitted[name] = time.monotonic()
+        pending[name] = executor.submit(_job, query, params)
+
+    try:
+        while pending:
+            wait(list(pending.values()), timeout=0.05, return_when=FIRST_COMPLETED)
+            now = time.monotonic()
+            for name, fut in list(pending.items()):
+                if fut.done():
+                    try:
+                        results[name] = fut.result()
+                    except Exception as e:
+                        errors[name] = e
+                    del pending[name]
+                elif timeout and now - submitted[name] > timeout:
+                    fut.cancel()
+                    errors[name] = TimeoutError(f"Query '{name}' chạy quá {timeout}s")
+                    del pending[name]
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    return results, errors
 
 def sql_list(values: list[str]) -> str:
     if not values:
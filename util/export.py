@@ -0,0 +1,63 @@
+# util/export.py
+# Xuất DataFrame ra file tải về (CSV / Parquet) - chỉ gọi khi người dùng bấm nút.
+# File được ghi ra 1 file tạm trên đĩa: CSV theo từng khối dòng (iter_csv_chunks), Parquet theo
+# row group -> lúc dựng file, RAM chỉ giữ ~1 khối chứ không giữ cả file.
+# Lưu ý: st.download_button (Streamlit 1.39) vẫn đọc toàn bộ file vào media store 1 lần khi phục vụ tải về.
+import io
+import tempfile
+from typing import Iterator
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+CSV_CHUNK_ROWS = 50_000
+PARQUET_ROW_GROUP = 100_000
+
+FORMATS = {
+    "CSV": (".csv", "text/csv"),
+    "Parquet": (".parquet", "application/vnd.apache.parquet"),
+}
+
+
+def _temp_file() -> io.FileIO:
+    """
+    File tạm nhị phân không buffer, tự xoá khi đóng / bị thu gom.
+    io.FileIO (RawIOBase) là kiểu file st.download_button nhận trực tiếp.
+    """
+    tmp = tempfile.TemporaryFile(buffering=0)
+    raw = getattr(tmp, "file", tmp)  # Windows: wrapper bọc FileIO
+    if raw is not tmp:
+        raw._owner = tmp  # wrapper bị thu gom sẽ đóng file -> giữ sống cùng FileIO
+    return raw
+
+
+def iter_csv_chunks(df: pd.DataFrame, chunk_rows: int = CSV_CHUNK_ROWS) -> Iterator[bytes]:
+    """CSV UTF-8 (header ở khối đầu) theo từng khối `chunk_rows` dòng; mỗi lần chỉ 1 khối nằm trong RAM."""
+    for start in range(0, max(len(df), 1), chunk_rows):
+        yield df.iloc[start:start + chunk_rows].to_csv(index=False, header=(start == 0)).encode("utf-8")
+
+
+def to_csv_buffer(df: pd.DataFrame, chunk_rows: int = CSV_CHUNK_ROWS) -> io.FileIO:
+    """CSV ghi từng khối vào file tạm; trả file đã tua về đầu."""
+    buf = _temp_file()
+    for chunk in iter_csv_chunks(df, chunk_rows):
+        buf.write(chunk)
+    buf.seek(0)
+    return buf
+
+
+def to_parquet_buffer(df: pd.DataFrame, row_group_size: int = PARQUET_ROW_GROUP) -> io.FileIO:
+    """Parquet (nén snappy) ghi theo row group vào file tạm; cột dtype Arrow chuyển sang pyarrow.Table không cần copy."""
+    buf = _temp_file()
+    pq.write_table(pa.Table.from_pandas(df, preserve_index=False), buf, row_group_size=row_group_size)
+    buf.seek(0)
+    return buf
+
+
+def export_file(df: pd.DataFrame, filename: str, fmt: str = "CSV") -> tuple[io.FileIO, str, str]:
+    """(buffer, tên file theo định dạng, mime) cho st.download_button."""
+    ext, mime = FORMATS[fmt]
+    stem = filename.rsplit(".", 1)[0] if "." in filename else filename
+    buf = to_parquet_buffer(df) if fmt == "Parquet" else to_csv_buffer(df)
+    return buf, stem + ext, mime
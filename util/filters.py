@@ -1,6 +1,8 @@
 # util/filters.py
+import json
 import streamlit as st
-from datetime import date, datetime
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional
 
 def _coerce_date_obj(x):
     """Đưa x về datetime.date hoặc None."""
@@ -45,3 +47,60 @@ def sidebar_filters(min_d, max_d, countries: list[str], industries: list[str]):
         end_d.isoformat()   if isinstance(end_d,   date) else "",
         country, industry, keyword.strip().lower(), int(topn)
     )
+
+# ------------- WHERE-builder -------------
+# Giá trị filter không nối vào SQL mà đi qua tham số bind phía server (marker :f_*).
+# SQL text giữ nguyên khi đổi ngày / quốc gia / ngành / keyword -> warehouse tái dùng plan,
+# cache chỉ khác nhau ở bộ tham số.
+def selected(values: List[str]) -> List[str]:
+    return sorted({str(v) for v in (values or []) if v != "ALL"})
+
+def filter_params(start: str, end: str, countries: List[str], industries: List[str], keyword: str,
+                  latest_dt=None, top_k: int = 20) -> Dict[str, Optional[str]]:
+    """Bộ tham số bind cho mọi query dùng build_where (giá trị trả về của sidebar_filters)."""
+    return {
+        "f_start": start or None,
+        "f_end": end or None,
+        # Cận trên loại trừ (end + 1 ngày) cho predicate khoảng trên cột dt gốc
+        "f_end_excl": (date.fromisoformat(end) + timedelta(days=1)).isoformat() if end else None,
+        "f_countries": json.dumps(selected(countries), ensure_ascii=False),
+        "f_industries": json.dumps(selected(industries), ensure_ascii=False),
+        "f_keyword": str(keyword or "").lower(),
+        "latest_dt": str(latest_dt) if latest_dt else None,
+        "top_k": top_k,
+    }
+
+def in_param_sql(col: str, param: str) -> str:
+    """`col` thuộc danh sách JSON trong tham số `param`; danh sách rỗng = không lọc (ALL)."""
+    return f"(:{param} = '[]' OR array_contains(from_json(:{param}, 'array<string>'), {col}))"
+
+def keyword_sql(hashtag_expr: str) -> str:
+    return f"(:f_keyword = '' OR LOWER({hashtag_expr}) LIKE CONCAT('%', :f_keyword, '%'))"
+
+def build_where(
+    dt_col: Optional[str] = "dt",
+    country_col: Optional[str] = "country_code",
+    industry_col: Optional[str] = "industry",
+    hashtag_expr: Optional[str] = "COALESCE(hashtag_raw, hashtag)",
+    extra: Optional[List[str]] = None,
+    date_range: bool = True,
+) -> str:
+    """
+    Xây WHERE clause theo filter global (dùng kèm params=filter_params(...)).
+    Lưu ý:
+      - Nếu hashtag_expr=None thì sẽ bỏ qua filter KEYWORD (dùng cho bảng không có hashtag).
+      - `extra`: điều kiện bổ sung, VD ngày mới nhất "t.dt = DATE(:latest_dt)".
+      - `date_range`: False khi chưa chọn đủ ngày bắt đầu / kết thúc -> không lọc theo ngày.
+      - Khoảng ngày so sánh thẳng trên cột dt (không bọc DATE(...)) -> engine prune được theo
+        partition / thống kê file; nửa mở [f_start, f_end_excl) đúng cả khi dt là timestamp.
+    """
+    clauses: List[str] = list(extra or [])
+    if dt_col and date_range:
+        clauses.append(f"{dt_col} >= DATE(:f_start) AND {dt_col} < DATE(:f_end_excl)")
+    if country_col:
+        clauses.append(in_param_sql(country_col, "f_countries"))
+    if industry_col:
+        clauses.append(in_param_sql(industry_col, "f_industries"))
+    if hashtag_expr:
+        clauses.append(keyword_sql(hashtag_expr))
+    return (" WHERE " + " AND ".join(clauses)) if clauses else ""
@@ -0,0 +1,117 @@
+# util/gemini.py
+# Gọi Gemini (Generative Language API) dạng stream: streamGenerateContent?alt=sse trả về từng event
+# "data: {...}" (Server-Sent Events) -> hiển thị dần từng đoạn text thay vì chờ cả kịch bản.
+# base_url đổi được (VD server SSE giả lập khi test).
+import hashlib
+import json
+import time
+
+import requests
+
+DEFAULT_BASE_URL = "https://generativelanguage.googleapis.com/v1beta"
+DEFAULT_MODEL = "gemini-2.5-flash-preview-09-2025"
+
+
+class GeminiError(RuntimeError):
+    """API trả lỗi (HTTP != 200 hoặc event có trường "error")."""
+
+
+def _canonical(value):
+    """Chuỗi gộp khoảng trắng, dict sắp theo khoá -> 2 yêu cầu chỉ khác khoảng trắng / thứ tự cho cùng khoá."""
+    if isinstance(value, str):
+        return " ".join(value.split())
+    if isinstance(value, dict):
+        return {str(k): _canonical(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_canonical(v) for v in value]
+    return value
+
+
+def cache_key(model: str, system_prompt: str, context: dict, builder: dict,
+              generation_config: dict, versions: tuple = ()) -> str:
+    """Khoá cache phản hồi: sha256 của (model, system prompt, context, Prompt Builder, generation config, version dữ liệu)."""
+    payload = json.dumps(
+        _canonical({"model": model, "system": system_prompt, "context": context, "builder": builder,
+                    "generation": generation_config, "versions": [list(v) for v in versions]}),
+        sort_keys=True, ensure_ascii=False, default=str, separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _chunk_text(event: dict) -> str:
+    """Text trong 1 event GenerateContentResponse (candidate đầu tiên)."""
+    candidates = event.get("candidates") or []
+    if not candidates:
+        return ""
+    parts = (candidates[0].get("content") or {}).get("parts") or []
+    return "".join(p.get("text", "") for p in parts)
+
+
+def iter_sse(lines):
+    """
+    Gom các dòng của 1 response SSE thành payload từng event
+    (nhiều dòng "data:" liên tiếp nối bằng '\\n', event kết thúc ở dòng trống).
+    """
+    data = []
+    for line in lines:
+        if not line:
+            if data:
+                yield "\n".join(data)
+                data = []
+            continue
+        if line.startswith("data:"):
+            data.append(line[5:].lstrip())
+    if data:
+        yield "\n".join(data)
+
+
+class GeminiStream:
+    """
+    Iterator các đoạn text của 1 lần gọi streamGenerateContent - dùng thẳng với st.write_stream.
+    Duyệt xong thì có: .text (toàn bộ), .ttft (giây tới đoạn text đầu), .latency (tổng), .chunks.
+    """
+
+    def __init__(self, api_key: str, payload: dict, model: str = DEFAULT_MODEL,
+                 base_url: str = DEFAULT_BASE_URL, timeout=(10, 90), session=None):
+        self.api_key = api_key
+        self.payload = payload
+        self.model = model
+        self.base_url = (base_url or DEFAULT_BASE_URL).rstrip("/")
+        self.timeout = timeout  # (connect, đọc giữa 2 chunk)
+        self.session = session
+        self.parts: list[str] = []
+        self.ttft = None
+        self.latency = None
+
+    @property
+    def text(self) -> str:
+        return "".join(self.parts)
+
+    @property
+    def chunks(self) -> int:
+        return len(self.parts)
+
+    def __iter__(self):
+        t0 = time.perf_counter()
+        url = f"{self.base_url}/models/{self.model}:streamGenerateContent"
+        http = self.session or requests
+        with http.post(url, params={"alt": "sse", "key": self.api_key}, json=self.payload,
+                       stream=True, timeout=self.timeout) as resp:
+            if resp.status_code != 200:
+                raise GeminiError(f"{resp.status_code} - {resp.text[:500]}")
+            resp.encoding = "utf-8"
+            # chunk_size=None: nhận dữ liệu ngay khi tới (mặc định 512 byte sẽ gom nhiều event rồi mới trả)
+            for data in iter_sse(resp.iter_lines(chunk_size=None, decode_unicode=True)):
+                if data == "[DONE]":
+                    break
+                event = json.loads(data)
+                if "error" in event:
+                    err = event["error"]
+                    raise GeminiError(f"{err.get('code', '')} - {err.get('message', err)}")
+                text = _chunk_text(event)
+                if text:
+                    if self.ttft is None:
+                        self.ttft = time.perf_counter() - t0
+                    self.parts.append(text)
+                    yield text
+        self.latency = time.perf_counter() - t0
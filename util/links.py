@@ -0,0 +1,74 @@
+# util/links.py
+# Kiểm tra link cho Cell 5 của main.ipynb (gold.hashtag_link_health): HEAD→GET, không tải nội dung,
+# song song nhiều thread nhưng tối đa `per_host` request đồng thời / host, session keep-alive theo thread.
+# Không phụ thuộc Spark -> test được với server HTTP cục bộ (tests/test_links.py).
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import requests
+
+DEFAULT_HEADERS = {"User-Agent": "Mozilla/5.0 (compatible; DatabricksLinkHealth/1.0)"}
+
+# Kết quả khi lỗi mạng (timeout, DNS, connection refused...): status_code None
+NETWORK_ERROR = (None, None, None, False)
+
+
+class LinkChecker:
+    """
+    check(url) -> (status_code, final_url, redirects, is_ok).
+    HEAD trước; HEAD lỗi / bị chặn (status >= 400, VD 405) thì GET stream=True (chỉ đọc status, bỏ body).
+    """
+
+    def __init__(self, per_host: int = 4, head_timeout: float = 8, get_timeout: float = 10, headers: dict = None):
+        self.per_host = max(1, per_host)
+        self.head_timeout = head_timeout
+        self.get_timeout = get_timeout
+        self.headers = dict(headers or DEFAULT_HEADERS)
+        self._tls = threading.local()
+        self._host_sems = {}
+        self._host_lock = threading.Lock()
+
+    def _session(self) -> requests.Session:
+        sess = getattr(self._tls, "session", None)
+        if sess is None:
+            sess = self._tls.session = requests.Session()
+            sess.headers.update(self.headers)
+        return sess
+
+    def _host_sem(self, u: str) -> threading.BoundedSemaphore:
+        host = urlparse(u).netloc.lower()
+        with self._host_lock:
+            return self._host_sems.setdefault(host, threading.BoundedSemaphore(self.per_host))
+
+    def check(self, u: str):
+        try:
+            with self._host_sem(u):
+                sess = self._session()
+                try:
+                    r = sess.head(u, timeout=self.head_timeout, allow_redirects=True)
+                    if r.status_code >= 400:
+                        raise Exception("head_blocked")
+                except Exception:
+                    r = sess.get(u, timeout=self.get_timeout, allow_redirects=True, stream=True)
+                    r.close()
+            return (r.status_code, getattr(r, "url", u), len(getattr(r, "history", []) or []),
+                    (200 <= r.status_code < 300))
+        except Exception:
+            return NETWORK_ERROR
+
+    def check_many(self, urls, workers: int = 16) -> dict:
+        """{url: kết quả check} cho các URL distinct, song song `workers` thread."""
+        urls = sorted(set(urls))
+        if not urls:
+            return {}
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            return dict(zip(urls, pool.map(self.check, urls)))
+
+
+def cache_rows(results: dict) -> list:
+    """
+    Dòng (url, status_code, final_url, redirects, is_ok) để MERGE vào gold.link_check_cache.
+    Lỗi mạng không cache -> lần chạy sau kiểm tra lại; status HTTP (kể cả 4xx / 5xx) thì cache.
+    """
+    return [(u, *res[:3], bool(res[3])) for u, res in results.items() if res[0] is not None]
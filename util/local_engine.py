@@ -0,0 +1,263 @@
+# util/local_engine.py
+# Engine "local": snapshot silver/gold (Parquet) + DuckDB chạy ngay trong process.
+# Các tab giữ nguyên SQL (dialect Databricks); module này dịch sang DuckDB trước khi chạy.
+import json
+import os
+import re
+import threading
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# ---- DuckDB import guard (phụ thuộc tuỳ chọn) ----
+try:
+    import duckdb
+except Exception:
+    duckdb = None
+
+# Bảng cần snapshot -> cột cần lấy (None = toàn bộ cột).
+# gold.trend_daily_cube không snapshot: sketch HLL chỉ đọc được bằng hàm của Databricks,
+# app tự quay về query silver khi không thấy bảng này.
+SNAPSHOT_TABLES: dict = {
+    "silver.silver_trend": [
+        "dt", "hashtag", "hashtag_raw", "country_code", "industry", "category",
+        "url", "rank", "view_count", "video_count", "is_promoted",
+    ],
+    "gold.trend_momentum": None,
+    "gold.trend_retention": None,
+    "gold.trend_latest_top100": None,
+    "gold.trend_weekly_summary": None,
+    "gold.trend_country_summary": None,
+    "gold.trend_promoted_share": None,
+    "gold.hashtag_dim": None,
+}
+
+_VERSION_FILE = "_versions.json"
+
+
+def available() -> bool:
+    return duckdb is not None
+
+
+# ------------- Dịch SQL Databricks -> DuckDB -------------
+def _literal_end(sql: str, i: int) -> int:
+    """sql[i] là dấu ' mở chuỗi -> vị trí ngay sau dấu ' đóng (hỗ trợ '' escape)."""
+    j, n = i + 1, len(sql)
+    while j < n:
+        if sql[j] == "'":
+            if j + 1 < n and sql[j + 1] == "'":
+                j += 2
+                continue
+            return j + 1
+        j += 1
+    return n
+
+
+def _literal_spans(sql: str) -> list:
+    """Các đoạn [start, end) nằm trong chuỗi '...'."""
+    spans, i = [], 0
+    while True:
+        i = sql.find("'", i)
+        if i < 0:
+            return spans
+        end = _literal_end(sql, i)
+        spans.append((i, end))
+        i = end
+
+
+def _in_spans(pos: int, spans: list) -> bool:
+    return any(a <= pos < b for a, b in spans)
+
+
+def _outside_literals(sql: str, fn) -> str:
+    """Áp fn lên phần SQL nằm ngoài chuỗi literal."""
+    out, last = [], 0
+    for a, b in _literal_spans(sql):
+        out.append(fn(sql[last:a]))
+        out.append(sql[a:b])
+        last = b
+    out.append(fn(sql[last:]))
+    return "".join(out)
+
+
+def _close_paren(sql: str, open_idx: int) -> int:
+    depth, i, n = 0, open_idx, len(sql)
+    while i < n:
+        ch = sql[i]
+        if ch == "'":
+            i = _literal_end(sql, i)
+            continue
+        if ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+            if depth == 0:
+                return i
+        i += 1
+    raise ValueError("SQL thiếu dấu ')'")
+
+
+def _split_args(s: str) -> list:
+    args, depth, start, i, n = [], 0, 0, 0, len(s)
+    while i < n:
+        ch = s[i]
+        if ch == "'":
+            i = _literal_end(s, i)
+            continue
+        if ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+        elif ch == "," and depth == 0:
+            args.append(s[start:i].strip())
+            start = i + 1
+        i += 1
+    args.append(s[start:].strip())
+    return args
+
+
+def _rewrite_calls(sql: str, name: str, fn) -> str:
+    """Thay mọi lời gọi `name(...)` bằng fn(args); tham số đã được dịch đệ quy."""
+    pat = re.compile(rf"(?<![\w.]){name}\s*\(", re.IGNORECASE)
+    pos = 0
+    while True:
+        spans = _literal_spans(sql)
+        m = pat.search(sql, pos)
+        while m and _in_spans(m.start(), spans):
+            m = pat.search(sql, m.end())
+        if not m:
+            return sql
+        open_idx = m.end() - 1
+        close_idx = _close_paren(sql, open_idx)
+        args = [_rewrite_calls(a, name, fn) for a in _split_args(sql[open_idx + 1:close_idx])]
+        repl = fn(args)
+        sql = sql[:m.start()] + repl + sql[close_idx + 1:]
+        pos = m.start() + len(repl)
+
+
+def _from_json(args: list) -> str:
+    schema = args[1].strip().lower() if len(args) > 1 else ""
+    if schema == "'array<string>'":
+        return f"from_json({args[0]}, '[\"VARCHAR\"]')"
+    return f"from_json({', '.join(args)})"
+
+
+_SHOW_COLUMNS_RE = re.compile(r"^\s*(?:SHOW\s+COLUMNS\s+IN|DESCRIBE\s+TABLE)\s+(\w+)\.(\w+)\s*;?\s*$", re.IGNORECASE)
+_PARAM_RE = re.compile(r"(?<![:\w]):([A-Za-z_]\w*)")
+
+
+def to_duckdb_sql(query: str) -> str:
+    """
+    Dịch các cấu trúc Databricks mà app đang dùng sang DuckDB:
+      - marker `:tên`                 -> `$tên`
+      - DATE(x)                       -> CAST(x AS DATE)
+      - DATEDIFF(end, start)          -> datediff('day', start, end)
+      - from_json(x, 'array<string>') -> from_json(x, '["VARCHAR"]')
+      - collect_set(x)                -> list_distinct(list(x))
+      - SHOW COLUMNS IN / DESCRIBE TABLE -> information_schema.columns (cột col_name)
+    Các hàm còn lại (array_sort, array_contains, COUNT_IF, DATE_TRUNC, ...) DuckDB hỗ trợ sẵn.
+    """
+    m = _SHOW_COLUMNS_RE.match(query)
+    if m:
+        return (
+            "SELECT column_name AS col_name FROM information_schema.columns "
+            f"WHERE table_schema = '{m.group(1)}' AND table_name = '{m.group(2)}' "
+            "ORDER BY ordinal_position"
+        )
+    out = _outside_literals(query, lambda s: _PARAM_RE.sub(r"$\1", s))
+    out = _rewrite_calls(out, "DATE", lambda a: f"CAST({a[0]} AS DATE)")
+    out = _rewrite_calls(out, "DATEDIFF", lambda a: f"datediff('day', {a[1]}, {a[0]})")
+    out = _rewrite_calls(out, "from_json", _from_json)
+    out = _rewrite_calls(out, "collect_set", lambda a: f"list_distinct(list({a[0]}))")
+    return out
+
+
+# ------------- Snapshot + engine -------------
+def _snapshot_path(snapshot_dir: str, table: str) -> str:
+    return os.path.join(snapshot_dir, f"{table}.parquet")
+
+
+def _read_versions(snapshot_dir: str):
+    try:
+        with open(os.path.join(snapshot_dir, _VERSION_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return None
+
+
+def build_snapshot(fetch, snapshot_dir: str, versions: dict, tables: dict | None = None) -> list:
+    """
+    Tải các bảng về Parquet trong snapshot_dir.
+      - fetch(sql) -> pyarrow.Table (VD util.db._execute)
+      - versions: {bảng: version Delta}, ghi vào _versions.json để lần sau biết snapshot còn mới
+    Bảng không đọc được (chưa tạo, thiếu quyền) bị bỏ qua; trả danh sách bảng đã snapshot.
+    """
+    tables = SNAPSHOT_TABLES if tables is None else tables
+    os.makedirs(snapshot_dir, exist_ok=True)
+    done = []
+    for table, cols in tables.items():
+        queries = [f"SELECT {', '.join(cols)} FROM {table}"] if cols else []
+        queries.append(f"SELECT * FROM {table}")  # thiếu cột -> lấy toàn bộ
+        for q in queries:
+            try:
+                data = fetch(q)
+            except Exception:
+                continue
+            tmp = _snapshot_path(snapshot_dir, table) + ".tmp"
+            pq.write_table(data, tmp)
+            os.replace(tmp, _snapshot_path(snapshot_dir, table))
+            done.append(table)
+            break
+    with open(os.path.join(snapshot_dir, _VERSION_FILE), "w", encoding="utf-8") as f:
+        json.dump(versions, f)
+    return done
+
+
+class LocalEngine:
+    """
+    Các bảng snapshot nạp vào 1 database DuckDB in-memory (schema silver / gold giữ nguyên tên),
+    nên SQL của tab chạy được mà không đổi tên bảng.
+    """
+
+    def __init__(self, snapshot_dir: str):
+        if duckdb is None:
+            raise RuntimeError("Chưa cài duckdb (pip install duckdb)")
+        self.snapshot_dir = snapshot_dir
+        self.tables: list = []
+        self._con = duckdb.connect(":memory:")
+        self._lock = threading.Lock()
+        for fname in sorted(os.listdir(snapshot_dir)) if os.path.isdir(snapshot_dir) else []:
+            if not fname.endswith(".parquet"):
+                continue
+            table = fname[: -len(".parquet")]
+            schema = table.split(".")[0]
+            path = os.path.join(snapshot_dir, fname).replace("'", "''")
+            self._con.execute(f"CREATE SCHEMA IF NOT EXISTS {schema}")
+            self._con.execute(f"CREATE TABLE {table} AS SELECT * FROM read_parquet('{path}')")
+            self.tables.append(table)
+
+    @classmethod
+    def open(cls, snapshot_dir: str, versions: dict, fetch=None) -> "LocalEngine":
+        """
+        Dùng snapshot có sẵn nếu khớp version (hoặc không biết version - chạy offline);
+        ngược lại tải lại bằng `fetch`.
+        """
+        known = any(v is not None for v in versions.values())
+        have = _read_versions(snapshot_dir)
+        if fetch is not None and (have is None or (known and have != versions)):
+            build_snapshot(fetch, snapshot_dir, versions)
+        return cls(snapshot_dir)
+
+    def query(self, sql: str, params: dict | None = None) -> pa.Table:
+        duck_sql = to_duckdb_sql(sql)
+        # Mỗi lần chạy dùng cursor riêng (an toàn khi gọi từ nhiều thread)
+        with self._lock:
+            cur = self._con.cursor()
+        try:
+            if params:
+                cur.execute(duck_sql, params)
+            else:
+                cur.execute(duck_sql)
+            return cur.fetch_arrow_table()
+        finally:
+            cur.close()
@@ -0,0 +1,199 @@
+# util/prompt_context.py
+# Biên dịch context dữ liệu của Tab 9 thành văn bản gọn trong 1 ngân sách token:
+#   - gộp hashtag trùng giữa các nhóm (prefer / hot / opportunity / evergreen / proven / weekly) thành 1 bảng,
+#     cột `groups` ghi hashtag thuộc nhóm nào
+#   - bảng ghi dạng CSV (header 1 lần) thay vì JSON lặp tên trường ở mỗi dòng
+#   - vượt ngân sách -> bỏ các dòng điểm thấp trước (điểm theo nhóm + vị trí trong nhóm)
+import csv
+import io
+import json
+
+import pandas as pd
+
+CHARS_PER_TOKEN = 4
+
+# Trọng số nhóm hashtag (nhóm quan trọng hơn giữ lại lâu hơn khi cắt theo ngân sách)
+HASHTAG_GROUPS = {"prefer": 5.0, "hot": 4.0, "opportunity": 3.0, "evergreen": 2.0, "proven": 2.0, "weekly": 1.0}
+# Trọng số bảng thị trường so với bảng hashtag (điểm dòng hashtag chuẩn hoá về [0, 1])
+MARKET_WEIGHTS = {"industry_share": 0.6, "industry_efficiency": 0.6, "country_views": 0.5}
+HASHTAG_COLS = ["hashtag", "groups", "view_delta", "streak_days", "rank", "view_count", "video_count"]
+
+
+def estimate_tokens(text: str) -> int:
+    """Ước lượng số token (~4 ký tự / token) - đủ để so sánh và chặn ngân sách, không cần tokenizer."""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def _display(value) -> str:
+    """Hashtag để hiển thị: bỏ khoảng trắng / dấu # đầu, giữ nguyên cách viết hoa."""
+    if value is None or (pd.api.types.is_scalar(value) and pd.isna(value)):
+        return ""  # NULL của cột Arrow là pd.NA: `value or ""` sẽ lỗi
+    return str(value).strip().lstrip("#")
+
+
+def _tag(value) -> str:
+    """Khoá gộp hashtag (không phân biệt hoa thường) - chỉ dùng để so khớp, không để hiển thị."""
+    return _display(value).lower()
+
+
+def _records(value) -> list:
+    """List hashtag (str) hoặc list record -> list dict có khoá hashtag."""
+    return [v if isinstance(v, dict) else {"hashtag": v} for v in (value or [])]
+
+
+def merge_hashtags(hashtags: dict) -> tuple[pd.DataFrame, int]:
+    """
+    Gộp các nhóm hashtag của context thành 1 bảng (1 dòng / hashtag) kèm điểm.
+    Trả về (bảng đã sắp theo điểm giảm dần, số lần xuất hiện trùng đã gộp).
+    """
+    sections = {
+        "prefer": hashtags.get("prefer"),
+        "hot": hashtags.get("hot_top10"),
+        "opportunity": hashtags.get("opportunity_top20"),
+        "evergreen": hashtags.get("evergreen_top20"),
+        "proven": hashtags.get("proven_top100"),
+        "weekly": hashtags.get("weekly_top"),
+    }
+    rows: dict = {}
+    seen = 0
+    for group, items in sections.items():
+        items = _records(items)
+        for pos, rec in enumerate(items):
+            key = _tag(rec.get("hashtag"))
+            if not key:
+                continue
+            seen += 1
+            row = rows.setdefault(key, {"hashtag": _display(rec.get("hashtag")), "groups": [], "score": 0.0})
+            if group not in row["groups"]:
+                row["groups"].append(group)
+                row["score"] += HASHTAG_GROUPS[group] * (1 - 0.5 * pos / max(len(items), 1))
+            for col in HASHTAG_COLS[2:]:
+                if row.get(col) is None and rec.get(col) is not None and not pd.isna(rec.get(col)):
+                    row[col] = rec[col]
+    if not rows:
+        return pd.DataFrame(columns=HASHTAG_COLS + ["score"]), 0
+    df = pd.DataFrame(list(rows.values()))
+    df["groups"] = df["groups"].map("|".join)
+    cols = [c for c in HASHTAG_COLS if c in df.columns and (c in ("hashtag", "groups") or df[c].notna().any())]
+    df = df.sort_values("score", ascending=False, kind="stable").reset_index(drop=True)
+    df["score"] = df["score"] / df["score"].max()
+    return df[cols + ["score"]], seen - len(df)
+
+
+def _country_summary(records: list) -> pd.DataFrame:
+    """Chuỗi thời gian view theo quốc gia -> 1 dòng / quốc gia (tổng view, view ngày cuối, số ngày)."""
+    df = pd.DataFrame(records)
+    if df.empty or not {"dt", "country_code", "total_views"} <= set(df.columns):
+        return df
+    df = df.sort_values("dt")
+    out = (df.groupby("country_code", dropna=False)
+             .agg(total_views=("total_views", "sum"), last_views=("total_views", "last"),
+                  days=("dt", "nunique"), last_dt=("dt", "last"))
+             .reset_index()
+             .sort_values("total_views", ascending=False))
+    return out
+
+
+def _ranked(df: pd.DataFrame) -> pd.DataFrame:
+    """Bảng đã sắp theo mức quan trọng -> điểm 1 (dòng đầu) giảm dần tới 0.5 (dòng cuối)."""
+    df = df.reset_index(drop=True).copy()
+    df["score"] = 1 - 0.5 * df.index / max(len(df), 1)
+    return df
+
+
+def _csv_cell(value):
+    if pd.api.types.is_scalar(value) and pd.isna(value):
+        return ""
+    if isinstance(value, float):
+        return "%.4g" % value
+    return value
+
+
+def _csv_lines(df: pd.DataFrame) -> list[str]:
+    """
+    CSV: 1 phần tử / record (header + từng dòng), ghi bằng csv.writer nên giá trị có dấu phẩy, dấu nháy
+    hay xuống dòng vẫn nằm trọn trong 1 record. Cột float toàn số nguyên (bị NaN đẩy sang float)
+    ghi lại dạng số nguyên.
+    """
+    df = df.copy()
+    for c in df.columns:
+        if pd.api.types.is_float_dtype(df[c]):
+            vals = df[c].dropna()
+            if len(vals) and (vals % 1 == 0).all():
+                df[c] = df[c].astype("Int64")
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\n")
+    lines = []
+    for row in [list(df.columns), *df.itertuples(index=False, name=None)]:
+        writer.writerow([_csv_cell(v) for v in row])
+        lines.append(buf.getvalue()[:-1])
+        buf.seek(0)
+        buf.truncate()
+    return lines
+
+
+def compile_context(payload: dict, budget_tokens: int = 3000) -> tuple[str, dict]:
+    """
+    context_payload của Tab 9 -> (văn bản context, thống kê).
+    Phần cố định (filter, Prompt Builder, hashtag cần tránh) luôn giữ; các dòng bảng được chọn theo
+    điểm (trọng số bảng x điểm dòng) cho tới khi chạm `budget_tokens`, thứ tự dòng trong bảng giữ nguyên.
+    Thống kê: tokens (ước lượng context gửi đi), raw_tokens (JSON đầy đủ), rows_total, rows_kept, duplicates.
+    """
+    compact = lambda v: json.dumps(v, ensure_ascii=False, default=str, separators=(",", ":"))
+    hashtags = payload.get("hashtags", {}) or {}
+    market = payload.get("market", {}) or {}
+
+    fixed = [
+        "## filters\n" + compact(payload.get("filters_active", {})),
+        "## prompt_builder\n" + compact({k: v for k, v in (payload.get("prompt_builder") or {}).items() if v}),
+    ]
+    avoid = {}
+    for t in hashtags.get("avoid") or []:
+        if _tag(t):
+            avoid.setdefault(_tag(t), _display(t))
+    if avoid:
+        fixed.append("## avoid (hashtag đang giảm, hạn chế dùng)\n" + ",".join(avoid.values()))
+
+    tag_df, duplicates = merge_hashtags(hashtags)
+    tables = [("hashtags (groups: prefer|hot|opportunity|evergreen|proven|weekly)", tag_df, 1.0)]
+    for name, df in [
+        ("industry_share", pd.DataFrame(market.get("industry_share_latest") or [])),
+        ("industry_efficiency", pd.DataFrame(market.get("industry_efficiency_latest") or [])),
+        ("country_views", _country_summary(market.get("country_views_timeseries_head") or [])),
+    ]:
+        if not df.empty:
+            tables.append((name, _ranked(df), MARKET_WEIGHTS[name]))
+
+    # Mỗi bảng: header CSV (chi phí cố định) + từng dòng (ứng viên theo điểm)
+    rendered = []
+    candidates = []  # (điểm, chỉ số bảng, chỉ số dòng, token)
+    for t_idx, (name, df, weight) in enumerate(tables):
+        lines = _csv_lines(df.drop(columns="score")) if not df.empty else []
+        rendered.append((name, lines[:1], lines[1:]))
+        for r_idx, line in enumerate(lines[1:]):
+            candidates.append((weight * float(df["score"].iloc[r_idx]), t_idx, r_idx, estimate_tokens(line) + 1))
+
+    used = estimate_tokens("\n\n".join(fixed)) + sum(
+        estimate_tokens(f"## {name}\n{head[0] if head else ''}") + 2 for name, head, _ in rendered)
+    keep = set()
+    for score, t_idx, r_idx, tokens in sorted(candidates, key=lambda c: -c[0]):
+        if used + tokens > budget_tokens:
+            continue  # dòng ngắn hơn phía sau vẫn có thể vừa
+        used += tokens
+        keep.add((t_idx, r_idx))
+
+    parts = list(fixed)
+    for t_idx, (name, head, rows) in enumerate(rendered):
+        kept = [line for r_idx, line in enumerate(rows) if (t_idx, r_idx) in keep]
+        if kept:
+            parts.append(f"## {name}\n" + "\n".join(head + kept))
+
+    text = "\n\n".join(parts)
+    stats = {
+        "tokens": estimate_tokens(text),
+        "raw_tokens": estimate_tokens(json.dumps(payload, ensure_ascii=False, default=str)),
+        "rows_total": len(candidates),
+        "rows_kept": len(keep),
+        "duplicates": duplicates,
+    }
+    return text, stats
@@ -0,0 +1,382 @@
+# util/result_cache.py
+# Cache kết quả query bền vững (sống qua restart / deploy, dùng chung giữa nhiều replica).
+#   - DiskCache  : mỗi kết quả 1 file Arrow IPC trong 1 thư mục
+#   - RedisCache : lưu trên server Redis (hoặc server nói giao thức Redis)
+#   - MemoryCache: trong process (dùng khi không bật backend bền vững, VD cache phản hồi AI)
+# Cả ba giới hạn tổng dung lượng, vượt ngưỡng thì xoá kết quả ít dùng gần đây nhất (LRU),
+# và đếm hit / miss.
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import pyarrow as pa
+
+# ---- Redis import guard (phụ thuộc tuỳ chọn) ----
+try:
+    import redis
+except Exception:
+    redis = None
+
+
+# ---- Chuẩn hoá SQL ----
+# Cùng 1 query logic có thể tới dưới nhiều chuỗi khác nhau (thụt lề, comment, hoa/thường từ khoá,
+# thứ tự giá trị trong IN (...)) -> đưa về 1 dạng chuẩn trước khi băm làm khoá cache.
+_SQL_TOKEN = re.compile(
+    r"""(?P<comment>--[^\n]*|/\*.*?\*/)
+      |(?P<string>'(?:[^'\\]|\\.|'')*'|"(?:[^"\\]|\\.|"")*")
+      |(?P<ident>`(?:[^`]|``)*`)
+      |(?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+      |(?P<word>[A-Za-z_][A-Za-z0-9_]*)
+      |(?P<op>::|:[A-Za-z_][A-Za-z0-9_]*|<=|>=|<>|!=|==|\|\||\S)""",
+    re.S | re.X,
+)
+# Viết hoa từ khoá và tên hàm (Spark / DuckDB tự đặt tên cột kiểu sum(x) bất kể hoa/thường);
+# tên cột / alias giữ nguyên vì chúng quyết định tên cột kết quả -> chỉ từ khoá dành riêng, không có
+# các từ hay dùng làm tên cột / alias như day, week, month, year, first, last
+# (NULLS FIRST / LAST, INTERVAL n DAY khác hoa-thường thì chỉ lệch khoá cache, không sai kết quả)
+SQL_KEYWORDS = frozenset("""
+    ALL AND ANY AS ASC BETWEEN BY CASE CAST CROSS CURRENT_DATE DESC DISTINCT ELSE END EXCEPT EXISTS FALSE
+    FOLLOWING FROM FULL GROUP HAVING ILIKE IN INNER INTERSECT INTERVAL IS JOIN LEFT LIKE LIMIT
+    NOT NULL NULLS OFFSET ON OR ORDER OUTER OVER PARTITION PRECEDING QUALIFY RANGE RIGHT RLIKE ROWS
+    SELECT SEMI ANTI THEN TRUE UNBOUNDED UNION USING VALUES WHEN WHERE WINDOW WITH
+""".split())
+_LITERAL_KINDS = ("string", "number")
+
+
+def _sql_tokens(query: str) -> list[tuple[str, str]]:
+    """[(loại, text)] bỏ comment và khoảng trắng; từ khoá / tên hàm viết hoa, phần còn lại giữ nguyên."""
+    tokens = [(m.lastgroup, m.group()) for m in _SQL_TOKEN.finditer(query) if m.lastgroup != "comment"]
+    for i, (kind, text) in enumerate(tokens):
+        if kind == "word" and (text.upper() in SQL_KEYWORDS or tokens[i + 1:i + 2] == [("op", "(")]):
+            tokens[i] = (kind, text.upper())
+    return tokens
+
+
+def _sort_in_lists(tokens: list[tuple[str, str]]) -> list[tuple[str, str]]:
+    """IN (...) chỉ gồm literal (chuỗi / số) -> sắp xếp + bỏ trùng; list có cột, bind, subquery giữ nguyên."""
+    out = []
+    i = 0
+    while i < len(tokens):
+        out.append(tokens[i])
+        if tokens[i] == ("word", "IN") and i + 1 < len(tokens) and tokens[i + 1][1] == "(":
+            j = tokens.index(("op", ")"), i + 1) if ("op", ")") in tokens[i + 1:] else -1
+            items = tokens[i + 2:j]
+            values = items[::2]
+            if (j > 0 and values and all(k in _LITERAL_KINDS for k, _ in values)
+                    and all(t == "," for _, t in items[1::2])):
+                values = sorted(set(values), key=lambda v: (v[0], v[1]))
+                out.append(tokens[i + 1])
+                for n, v in enumerate(values):
+                    out.extend([("op", ",")] if n else [])
+                    out.append(v)
+                out.append(tokens[j])
+                i = j + 1
+                continue
+        i += 1
+    return out
+
+
+def canonical_sql(query: str) -> str:
+    """
+    Dạng chuẩn của 1 câu SQL: bỏ comment, khoảng trắng chuẩn hoá, từ khoá viết hoa,
+    giá trị literal trong IN (...) sắp xếp. Literal chuỗi / identifier trong `...` giữ nguyên.
+    """
+    parts = []
+    prev = ""
+    for _, text in _sort_in_lists(_sql_tokens(query)):
+        # Không cách trước , ) . ( và sau ( . :: -> "f (x , y)" và "f(x,y)" cho cùng kết quả
+        if parts and text not in (",", ")", ".", "(", "::") and prev not in ("(", ".", "::"):
+            parts.append(" ")
+        parts.append(text)
+        prev = text
+    return "".join(parts)
+
+
+def fingerprint(query: str, params: dict | None = None, namespace: str = "") -> str:
+    """Khoá của 1 câu lệnh: SQL dạng chuẩn (canonical_sql) + tham số bind + namespace (engine, ...)."""
+    text = canonical_sql(query)
+    payload = json.dumps([namespace, text, params or {}], sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def table_to_bytes(table: pa.Table) -> bytes:
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def table_from_bytes(data: bytes) -> pa.Table:
+    return pa.ipc.open_stream(pa.py_buffer(data)).read_all()
+
+
+class _Stats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._stats_lock = threading.Lock()
+
+    def _count(self, name: str, n: int = 1):
+        with self._stats_lock:
+            setattr(self, name, getattr(self, name) + n)
+
+    def stats(self) -> dict:
+        return {"backend": self.backend, "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+    # Giao diện chung theo pyarrow.Table
+    def get_table(self, key: str) -> pa.Table | None:
+        data = self.get(key)
+        return None if data is None else table_from_bytes(data)
+
+    def put_table(self, key: str, table: pa.Table) -> None:
+        self.put(key, table_to_bytes(table))
+
+
+class MemoryCache(_Stats):
+    """LRU trong process theo tổng dung lượng `max_bytes`, hết hạn sau `ttl` giây (None = không)."""
+
+    backend = "memory"
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024, ttl: float | None = None):
+        super().__init__()
+        self.max_bytes = int(max_bytes)
+        self.ttl = ttl
+        self._items: OrderedDict = OrderedDict()  # key -> (data, lúc ghi)
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None and self.ttl is not None and time.time() - item[1] > self.ttl:
+                del self._items[key]
+                item = None
+            if item is not None:
+                self._items.move_to_end(key)
+        self._count("hits" if item is not None else "misses")
+        return None if item is None else item[0]
+
+    def put(self, key: str, data: bytes) -> None:
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = (data, time.time())
+            total = sum(len(d) for d, _ in self._items.values())
+            while total > self.max_bytes and len(self._items) > 1:
+                _, (old, _) = self._items.popitem(last=False)
+                total -= len(old)
+                self._count("evictions")
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+
+class DiskCache(_Stats):
+    """
+    Kết quả lưu thành `<dir>/<key><suffix>` (mặc định .arrow).
+    mtime = lúc ghi (hết hạn sau `ttl` giây), atime = lần dùng gần nhất (thứ tự LRU, đặt bằng os.utime).
+    """
+
+    backend = "disk"
+
+    def __init__(self, directory: str, max_bytes: int = 512 * 1024 * 1024, ttl: float | None = None,
+                 suffix: str = ".arrow"):
+        super().__init__()
+        self.directory = directory
+        self.max_bytes = int(max_bytes)
+        self.ttl = ttl
+        self.suffix = suffix
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}{self.suffix}")
+
+    def get(self, key: str) -> bytes | None:
+        path = self._path(key)
+        try:
+            st = os.stat(path)
+            if self.ttl is not None and time.time() - st.st_mtime > self.ttl:
+                os.remove(path)
+                raise FileNotFoundError(path)
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path, (time.time(), st.st_mtime))  # đánh dấu vừa dùng (LRU)
+        except OSError:
+            self._count("misses")
+            return None
+        self._count("hits")
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        path = self._path(key)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        now = time.time()
+        os.utime(path, (now, now))
+        self._evict()
+
+    def _evict(self):
+        with self._lock:
+            files = []
+            for name in os.listdir(self.directory):
+                if not name.endswith(self.suffix):
+                    continue
+                try:
+                    st = os.stat(os.path.join(self.directory, name))
+                except OSError:
+                    continue
+                files.append((st.st_atime, st.st_size, name))
+            total = sum(size for _, size, _ in files)
+            for _, size, name in sorted(files):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    continue
+                total -= size
+                self._count("evictions")
+
+    def clear(self) -> None:
+        with self._lock:
+            for name in os.listdir(self.directory):
+                if name.endswith(self.suffix):
+                    try:
+                        os.remove(os.path.join(self.directory, name))
+                    except OSError:
+                        pass
+
+
+class RedisCache(_Stats):
+    """
+    Kết quả lưu ở key `<prefix>:r:<key>`; sorted set `<prefix>:lru` (score = lần dùng gần nhất)
+    và hash `<prefix>:size` giúp giới hạn dung lượng phía client, không phụ thuộc maxmemory-policy.
+    `client`: đối tượng kiểu redis.Redis (hoặc stand-in cùng API, VD fakeredis).
+    """
+
+    backend = "redis"
+
+    def __init__(self, client, prefix: str = "tt:sql", max_bytes: int = 256 * 1024 * 1024,
+                 ttl: float | None = None):
+        super().__init__()
+        self.client = client
+        self.prefix = prefix
+        self.max_bytes = int(max_bytes)
+        self.ttl = ttl
+
+    @classmethod
+    def from_url(cls, url: str, **kwargs) -> "RedisCache":
+        if redis is None:
+            raise RuntimeError("Chưa cài redis (pip install redis)")
+        return cls(redis.Redis.from_url(url), **kwargs)
+
+    def _k(self, key: str) -> str:
+        return f"{self.prefix}:r:{key}"
+
+    def get(self, key: str) -> bytes | None:
+        data = self.client.get(self._k(key))
+        if data is None:
+            self._count("misses")
+            self._forget(key)  # hết hạn do TTL -> dọn metadata
+            return None
+        self.client.zadd(f"{self.prefix}:lru", {key: time.time()})
+        self._count("hits")
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        ex = int(self.ttl) if self.ttl else None
+        pipe = self.client.pipeline()
+        pipe.set(self._k(key), data, ex=ex)
+        pipe.zadd(f"{self.prefix}:lru", {key: time.time()})
+        pipe.hset(f"{self.prefix}:size", key, len(data))
+        pipe.execute()
+        self._evict()
+
+    def _forget(self, key: str) -> None:
+        pipe = self.client.pipeline()
+        pipe.zrem(f"{self.prefix}:lru", key)
+        pipe.hdel(f"{self.prefix}:size", key)
+        pipe.execute()
+
+    def _evict(self):
+        sizes = {_s(k): int(v) for k, v in self.client.hgetall(f"{self.prefix}:size").items()}
+        total = sum(sizes.values())
+        while total > self.max_bytes:
+            oldest = self.client.zrange(f"{self.prefix}:lru", 0, 0)
+            if not oldest:
+                break
+            key = _s(oldest[0])
+            self.client.delete(self._k(key))
+            self._forget(key)
+            total -= sizes.get(key, 0)
+            self._count("evictions")
+
+    def clear(self) -> None:
+        keys = [_s(k) for k in self.client.zrange(f"{self.prefix}:lru", 0, -1)]
+        if keys:
+            self.client.delete(*[self._k(k) for k in keys])
+        self.client.delete(f"{self.prefix}:lru", f"{self.prefix}:size")
+
+
+def _s(x) -> str:
+    return x.decode("utf-8") if isinstance(x, bytes) else str(x)
+
+
+_SIZE_RE = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([kmg]?b?)?\s*$", re.IGNORECASE)
+
+
+def parse_size(value, default: int) -> int:
+    """512 / "512MB" / "1g" -> số byte."""
+    if value is None or value == "":
+        return default
+    if isinstance(value, (int, float)):
+        return int(value)
+    m = _SIZE_RE.match(str(value))
+    if not m:
+        return default
+    unit = (m.group(2) or "").lower().rstrip("b")
+    return int(float(m.group(1)) * {"": 1, "k": 1024, "m": 1024 ** 2, "g": 1024 ** 3}[unit])
+
+
+def from_config(cfg: dict):
+    """
+    Tạo backend từ mục [cache] của secrets.toml; trả None nếu không bật (backend = "memory").
+      backend = "disk"  -> dir, max_size
+      backend = "redis" -> url, prefix, max_size
+      ttl_seconds: tuỳ chọn (khoá đã gồm version bảng nên mặc định không hết hạn)
+    """
+    backend = str(cfg.get("backend", "memory")).lower()
+    ttl = cfg.get("ttl_seconds")
+    if backend == "disk":
+        return DiskCache(cfg.get("dir", ".cache/results"),
+                         max_bytes=parse_size(cfg.get("max_size"), 512 * 1024 ** 2), ttl=ttl)
+    if backend == "redis":
+        return RedisCache.from_url(cfg.get("url", "redis://localhost:6379/0"),
+                                   prefix=cfg.get("prefix", "tt:sql"),
+                                   max_bytes=parse_size(cfg.get("max_size"), 256 * 1024 ** 2), ttl=ttl)
+    return None
+
+
+def response_cache_from_config(cfg: dict):
+    """
+    Cache phản hồi AI (Tab 9): cùng backend với mục [cache] nhưng tách riêng khoá / dung lượng.
+      disk  -> <dir>/ai/<key>.json      redis -> prefix "<prefix>:ai"      memory -> MemoryCache
+      ai_max_size (mặc định 32MB), ai_ttl_seconds (tuỳ chọn; khoá đã gồm version dữ liệu)
+    """
+    backend = str(cfg.get("backend", "memory")).lower()
+    max_bytes = parse_size(cfg.get("ai_max_size"), 32 * 1024 ** 2)
+    ttl = cfg.get("ai_ttl_seconds")
+    if backend == "disk":
+        return DiskCache(os.path.join(cfg.get("dir", ".cache/results"), "ai"),
+                         max_bytes=max_bytes, ttl=ttl, suffix=".json")
+    if backend == "redis":
+        return RedisCache.from_url(cfg.get("url", "redis://localhost:6379/0"),
+                                   prefix=f"{cfg.get('prefix', 'tt:sql')}:ai", max_bytes=max_bytes, ttl=ttl)
+    return MemoryCache(max_bytes=max_bytes, ttl=ttl)
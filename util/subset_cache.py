@@ -0,0 +1,206 @@
+# util/subset_cache.py
+# Cache kết quả kèm predicate của filter (khoảng ngày, tập quốc gia, tập ngành, keyword).
+# Khi filter bị thu hẹp (ALL -> ['VN'], rút ngắn khoảng ngày, keyword dài hơn, ...) thì lọc lại
+# kết quả "cha" đang giữ ngay trên pandas thay vì gửi query mới lên warehouse.
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+
+# Tham số bind (FILTER_PARAMS của app) -> chiều filter
+PARAM_DIMS = {
+    "f_start": "date",
+    "f_end": "date",
+    "f_end_excl": "date",
+    "f_countries": "country",
+    "f_industries": "industry",
+    "f_keyword": "keyword",
+}
+DIMS = ("date", "country", "industry", "keyword")
+
+
+def _as_set(value):
+    """JSON list trong tham số -> frozenset; '[]' / None = ALL (None)."""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except Exception:
+            return None
+    values = frozenset(str(v) for v in value)
+    return values or None
+
+
+def _as_ts(value):
+    if value is None or value == "":
+        return None
+    try:
+        return pd.Timestamp(value).normalize()
+    except Exception:
+        return None
+
+
+def filter_spec(params: dict | None) -> dict:
+    """
+    Predicate của filter global từ bộ tham số bind:
+      {"date": (start, end), "country": frozenset|None, "industry": frozenset|None, "keyword": str}
+    None / '' nghĩa là không lọc chiều đó.
+    """
+    params = params or {}
+    end = _as_ts(params.get("f_end"))
+    if end is None and _as_ts(params.get("f_end_excl")) is not None:
+        end = _as_ts(params.get("f_end_excl")) - pd.Timedelta(days=1)  # cận trên loại trừ -> ngày cuối
+    return {
+        "date": (_as_ts(params.get("f_start")), end),
+        "country": _as_set(params.get("f_countries")),
+        "industry": _as_set(params.get("f_industries")),
+        "keyword": str(params.get("f_keyword") or "").lower(),
+    }
+
+
+def _unfiltered(dim: str):
+    return (None, None) if dim == "date" else ("" if dim == "keyword" else None)
+
+
+def _covers_dim(dim: str, outer, inner) -> bool:
+    if dim == "date":
+        (o_start, o_end), (i_start, i_end) = outer, inner
+        if o_start is not None and (i_start is None or i_start < o_start):
+            return False
+        if o_end is not None and (i_end is None or i_end > o_end):
+            return False
+        return True
+    if dim == "keyword":
+        # mọi chuỗi khớp %inner% đều khớp %outer% khi outer là chuỗi con của inner
+        return outer in inner
+    return outer is None or (inner is not None and inner <= outer)
+
+
+def covers(outer: dict, inner: dict, narrowable) -> bool:
+    """
+    Kết quả lấy theo `outer` có chứa đủ dữ liệu cho `inner` không.
+    Chiều không lọc lại được trên kết quả (không có trong `narrowable`) phải khớp tuyệt đối.
+    """
+    for dim in DIMS:
+        if dim in narrowable:
+            if not _covers_dim(dim, outer[dim], inner[dim]):
+                return False
+        elif outer[dim] != inner[dim]:
+            return False
+    return True
+
+
+def _like_regex(keyword: str) -> str:
+    """Pattern LIKE '%kw%' -> regex (giữ nguyên nghĩa của ký tự đại diện % và _)."""
+    return "".join(".*" if ch == "%" else "." if ch == "_" else re.escape(ch) for ch in keyword)
+
+
+def narrow(df: pd.DataFrame, spec: dict, cols: dict) -> pd.DataFrame:
+    """
+    Lọc df (kết quả của 1 filter rộng hơn) về đúng filter `spec`.
+    cols: chiều -> cột trong df; riêng "keyword" là tuple cột dùng như COALESCE(c1, c2, ...).
+    """
+    mask = pd.Series(True, index=df.index)
+    start, end = spec["date"]
+    if "date" in cols and (start is not None or end is not None):
+        d = pd.to_datetime(df[cols["date"]], errors="coerce").dt.normalize()
+        if start is not None:
+            mask &= (d >= start).fillna(False).astype(bool)
+        if end is not None:
+            mask &= (d <= end).fillna(False).astype(bool)
+    for dim in ("country", "industry"):
+        if dim in cols and spec[dim] is not None:
+            mask &= df[cols[dim]].astype("string").isin(spec[dim]).fillna(False).astype(bool)
+    if "keyword" in cols and spec["keyword"]:
+        text = None
+        for c in cols["keyword"]:
+            s = df[c].astype("string")
+            text = s if text is None else text.fillna(s)
+        hit = text.str.lower().str.contains(_like_regex(spec["keyword"]), regex=True)
+        mask &= hit.fillna(False).astype(bool)
+    return df.loc[mask.to_numpy()].reset_index(drop=True)
+
+
+class SubsetCache:
+    """
+    LRU các kết quả (df, spec) theo `key` (SQL + engine + version dữ liệu + tham số không thuộc filter).
+    Mỗi key giữ vài kết quả; lookup chọn kết quả nhỏ nhất bao trùm filter hiện tại.
+    Dùng chung giữa các session (thread-safe).
+    """
+
+    def __init__(self, max_entries: int = 64, ttl: float | None = None):
+        self.max_entries = max(1, int(max_entries))
+        self.ttl = ttl  # None = không hết hạn (key đã gồm version dữ liệu)
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict = OrderedDict()  # key -> [{spec, df, cols, narrowable, ts}]
+        self._lock = threading.Lock()
+
+    def _count(self) -> int:
+        return sum(len(v) for v in self._entries.values())
+
+    def get(self, key, spec: dict, cols: dict, filtered) -> pd.DataFrame | None:
+        """
+        Kết quả cho `spec` lấy từ cache (đã lọc lại), hoặc None nếu chưa có superset phù hợp.
+        filtered: các chiều mà query thực sự lọc (chiều còn lại bỏ qua khi so khớp).
+        """
+        spec = self._project(spec, filtered)
+        now = time.monotonic()
+        with self._lock:
+            entries = [e for e in self._entries.get(key, [])
+                       if self.ttl is None or now - e["ts"] <= self.ttl]
+            if key in self._entries:
+                self._entries[key] = entries
+                self._entries.move_to_end(key)
+            best = None
+            for e in entries:
+                if covers(e["spec"], spec, e["narrowable"]) and (best is None or len(e["df"]) < len(best["df"])):
+                    best = e
+            if best is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return narrow(best["df"], spec, best["cols"])
+
+    def put(self, key, spec: dict, cols: dict, filtered, df: pd.DataFrame) -> None:
+        """Lưu bản sao df (caller có thể sửa df trả về mà không làm hỏng cache)."""
+        cols = {dim: c for dim, c in cols.items() if dim in filtered}
+        if df is None or any(c not in df.columns for c in _needed_columns(cols)):
+            return  # thiếu cột để lọc lại (VD query lỗi trả DataFrame rỗng)
+        spec = self._project(spec, filtered)
+        narrowable = set(cols)
+        with self._lock:
+            # Kết quả mới bao trùm kết quả cũ -> bỏ kết quả cũ
+            entries = [e for e in self._entries.pop(key, []) if not covers(spec, e["spec"], narrowable)]
+            entries.append({"spec": spec, "df": df.copy(), "cols": cols, "narrowable": narrowable,
+                            "ts": time.monotonic()})
+            self._entries[key] = entries
+            while self._count() > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._entries[oldest].pop(0)
+                if not self._entries[oldest]:
+                    del self._entries[oldest]
+
+    @staticmethod
+    def _project(spec: dict, filtered) -> dict:
+        return {dim: (spec[dim] if dim in filtered else _unfiltered(dim)) for dim in DIMS}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+def _needed_columns(cols: dict) -> list:
+    out = []
+    for dim, c in cols.items():
+        out.extend(c if dim == "keyword" else [c])
+    return out
+
+
+def filtered_dims(names) -> set:
+    """Các chiều filter mà 1 query dùng, suy ra từ tên tham số bind trong query."""
+    return {PARAM_DIMS[n] for n in names if n in PARAM_DIMS}